@@ -0,0 +1,1181 @@
+#!/usr/bin/env python3
+"""
+Offline benchmarks for the Telegram Channel Message Editor Bot
+
+Usage:
+   python benchmarks.py              # run every benchmark
+   python benchmarks.py filters      # run a single benchmark
+   python benchmarks.py --quick suite  # short run, e.g. in CI
+   python benchmarks.py startup      # cold start time and memory
+
+The bot script is imported from this directory and run inside a temporary
+working directory, so your real filter/channel files are never touched.
+Nothing talks to the network: Telegram is replaced by FakeBotAPI, a local
+HTTP server, so the suite runs in CI without a bot token.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import collections
+import urllib.parse
+import tempfile
+import argparse
+import importlib.util
+
+BOT_SCRIPT_NAMES = ["simple_bot.py", "simple_bot (1).py"]
+
+# Seconds each timing loop runs; --quick lowers it
+MIN_TIME = 0.5
+
+
+def bot_script_path():
+    """Path of the bot script next to this file."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in BOT_SCRIPT_NAMES:
+        path = os.path.join(here, name)
+        if os.path.exists(path):
+            return path
+    raise SystemExit(f"Bot script not found in {here}")
+
+
+def load_bot(workdir):
+    """Import the bot script with `workdir` as the current directory."""
+    path = bot_script_path()
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("simple_bot", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["simple_bot"] = module
+    spec.loader.exec_module(module)
+
+    # Benchmarks measure the pipeline, not the console
+    logging.getLogger().setLevel(logging.WARNING)
+    return module
+
+
+def per_call_us(func, inputs, min_time=None):
+    """Run func over inputs until min_time elapsed; return microseconds per call."""
+    min_time = MIN_TIME if min_time is None else min_time
+    for item in inputs:
+        func(item)  # warm-up, so one-off compilation is not counted
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for item in inputs:
+            func(item)
+        calls += len(inputs)
+        elapsed = time.perf_counter() - start
+    return elapsed / calls * 1e6
+
+
+def make_user_filters(count):
+    """Synthetic user filters shaped like the ones added through /addfilter."""
+    filters_list = []
+    for i in range(count):
+        if i % 4 == 0:
+            filters_list.append([rf"(?i)\b(keyword{i})\b", f"KEYWORD{i}"])
+        else:
+            filters_list.append([f"@handle_{i:04d}", f"@replaced_{i:04d}"])
+    return filters_list
+
+
+SAMPLE_POSTS = [
+    "🚧 Urgent update from @Gazew_07: signals at 09:00 and 12:30",
+    "Important: market opens 08:15, closes 16:45:30. Follow @handle_0003 for more.",
+    "Plain post without anything interesting in it at all, just some words.",
+    "keyword4 keyword8 " * 20,
+]
+
+# Characters whose full lowercase (str.lower) differs from the simple
+# per-character folding re's IGNORECASE uses: İ ı ſ K (Kelvin sign) ß ẞ
+CASE_FOLD_POSTS = [
+    "istanbul ISTANBUL ıstanbul",
+    "İSTANBUL'da İstanbul",
+    "STRASSE straße STRAẞE strasse",
+    "ſtraße",
+    "kelvin KELVIN",
+    "Kelvins",
+    "groß GROß gross GROSS",
+    "GROẞ großartig",
+    "id ID ıd",
+    "İD",
+]
+CASE_FOLD_LITERALS = [
+    [r"(?i)\bİstanbul\b", "IST"],
+    [r"(?i)ſtraße", "Street"],
+    [r"(?i)\bKelvin\b", "K"],
+    [r"(?i)groẞ", "big"],
+    [r"(?i)ıd", "ID"],
+]
+CASE_FOLD_REGEXES = [
+    [r"(?i)İstanbul\b", "IST"],
+    [r"(?i)ſtra(ß|ẞ)e+", "Street"],
+    [r"(?i)\bKelvins?", "K"],
+    [r"(?i)groẞ\w*", "big"],
+    [r"(?i)\bıd\b", "ID"],
+]
+
+
+def apply_sequentially(filters_list, text):
+    """Reference result: one re.sub per filter, in order."""
+    for pattern, replacement in filters_list:
+        text = re.sub(pattern, replacement, text)
+    return text
+
+
+# Legacy pipeline, kept here verbatim so the benchmark compares like for like
+LEGACY_FILTERS_FILE = "legacy_user_filters.json"
+
+
+def legacy_apply_text_filters(bot, text):
+    filters_list = bot.STATIC_FILTERS + json.load(open(LEGACY_FILTERS_FILE))
+    modified_text = text
+    for pattern, replacement in filters_list:
+        try:
+            modified_text = re.sub(pattern, replacement, modified_text)
+        except Exception:
+            pass
+    return modified_text
+
+
+def legacy_convert_timezone(text):
+    modified_text = text
+    for match in re.findall(r'(\d{2}:\d{2}(:\d{2})?)', text):
+        time_str = match[0]
+        parts = time_str.split(':')
+        hours, minutes = int(parts[0]), int(parts[1])
+        has_seconds = len(parts) > 2
+        seconds = int(parts[2]) if has_seconds else 0
+        minutes += 30
+        if minutes >= 60:
+            hours += 1
+            minutes -= 60
+        hours += 3
+        if hours >= 24:
+            hours -= 24
+        if has_seconds:
+            new_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+        else:
+            new_time = f"{hours:02d}:{minutes:02d}"
+        modified_text = modified_text.replace(time_str, new_time)
+    return modified_text
+
+
+def make_schedule_post(count):
+    """A schedule post with `count` distinct timestamps."""
+    lines = []
+    for i in range(count):
+        minutes = (i * 17) % (24 * 60)
+        lines.append(f"Signal {i}: entry at {minutes // 60:02d}:{minutes % 60:02d}, check again later")
+    return "\n".join(lines)
+
+
+def bench_filters(bot):
+    """Per-message cost of applying filters: legacy JSON + re.sub vs FilterEngine."""
+    print("Filter application (µs per message)")
+    print(f"{'user filters':>12} {'legacy':>10} {'engine':>10} {'speedup':>8}")
+    for count in (0, 50, 200, 500):
+        bot.save_filters(make_user_filters(count))
+        with open(LEGACY_FILTERS_FILE, 'w') as f:
+            json.dump(make_user_filters(count), f)
+
+        legacy = per_call_us(lambda t: legacy_apply_text_filters(bot, t), SAMPLE_POSTS)
+        engine = per_call_us(bot.apply_text_filters, SAMPLE_POSTS)
+        print(f"{count:>12} {legacy:>10.1f} {engine:>10.1f} {legacy / engine:>7.1f}x")
+    print("")
+
+
+def bench_compiler(bot):
+    """One re.sub pass per filter vs literal groups merged into single passes."""
+    print("Filter compiler (µs per message)")
+    print(f"{'filters':>8} {'steps':>6} {'per-filter':>11} {'compiled':>10} {'speedup':>8} {'build ms':>9}")
+    steps = bot.compile_filters(CASE_FOLD_LITERALS)
+    for post in CASE_FOLD_POSTS:
+        text = post
+        for step in steps:
+            text = step.apply(text)
+        assert text == apply_sequentially(CASE_FOLD_LITERALS, post), post
+    for count in (10, 100, 1000):
+        filters_list = bot.STATIC_FILTERS + make_user_filters(count)
+        one_pass_each = [(re.compile(pattern), replacement) for pattern, replacement in filters_list]
+
+        def per_filter(text):
+            for regex, replacement in one_pass_each:
+                text = regex.sub(replacement, text)
+            return text
+
+        start = time.perf_counter()
+        steps = bot.compile_filters(filters_list)
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        def compiled(text):
+            for step in steps:
+                text = step.apply(text)
+            return text
+
+        assert all(per_filter(post) == compiled(post) for post in SAMPLE_POSTS)
+        baseline = per_call_us(per_filter, SAMPLE_POSTS)
+        merged = per_call_us(compiled, SAMPLE_POSTS)
+        print(f"{count:>8} {len(steps):>6} {baseline:>11.1f} {merged:>10.1f} {baseline / merged:>7.1f}x {build_ms:>9.1f}")
+    print("")
+
+
+def bench_prefilter(bot):
+    """Regex filters without hints, with per-filter hint checks and with combined hint scans."""
+    print("Literal prefilter (µs per message)")
+    print(f"{'filters':>8} {'no hints':>10} {'hints':>10} {'grouped':>10} {'speedup':>8} {'skip rate':>10}")
+    bot.save_filters(CASE_FOLD_REGEXES)
+    for post in CASE_FOLD_POSTS:
+        expected = apply_sequentially(bot.STATIC_FILTERS + CASE_FOLD_REGEXES, post)
+        assert bot.filter_engine.apply(post) == expected, post
+    for count in (10, 100, 500):
+        regex_filters = [[rf"(?i)\b(keyword{i})s?\b", r"\1!"] for i in range(count)]
+        bot.save_filters(regex_filters)
+        engine = bot.filter_engine
+        steps = engine.compiled_steps()
+
+        grouped = per_call_us(engine.apply, SAMPLE_POSTS)
+        engine.compiled_steps()
+        totals = engine.pattern_stats().values()
+        evaluated = sum(stats[1] for stats in totals)
+        skipped = sum(stats[0] for stats in totals) - evaluated
+        rate = skipped / (skipped + evaluated) * 100
+
+        # One member per run means no runs: every filter checks its own hints.
+        # Saving the filters again recompiles their scope with the new size.
+        cold_run_size, bot.COLD_RUN_SIZE = bot.COLD_RUN_SIZE, 1
+        bot.save_filters([])
+        bot.save_filters(regex_filters)
+        steps = engine.compiled_steps()
+        hinted = per_call_us(engine.apply, SAMPLE_POSTS)
+        bot.COLD_RUN_SIZE = cold_run_size
+
+        saved_hints = [step.hints for step in steps]
+        for step in steps:
+            step.hints = None
+        unhinted = per_call_us(engine.apply, SAMPLE_POSTS)
+        for step, hints in zip(steps, saved_hints):
+            step.hints = hints
+        engine.invalidate()
+        print(f"{count:>8} {unhinted:>10.1f} {hinted:>10.1f} {grouped:>10.1f} {unhinted / grouped:>7.1f}x {rate:>9.1f}%")
+    print("")
+
+
+def bench_scopes(bot):
+    """500 filters as one global set vs split across channel scopes."""
+    print("Per-channel filter scopes (µs per message)")
+    print(f"{'channels':>8} {'global':>10} {'scoped':>10} {'speedup':>8} {'build ms':>9} {'pooled':>7}")
+    filters_list = make_user_filters(500)
+    engine = bot.filter_engine
+    for channels in (5, 20, 100):
+        bot.save_filters(filters_list)
+        everything = per_call_us(engine.apply, SAMPLE_POSTS)
+
+        bot.save_filters(filters_list[:20])  # A few filters every channel shares
+        per_channel = len(filters_list) // channels
+        chains = []
+        for i in range(channels):
+            scope = bot.channel_scope(f"-100{i}")
+            bot.save_filters(filters_list[20 + i * per_channel:20 + (i + 1) * per_channel], scope)
+            chains.append(("", scope))
+
+        start = time.perf_counter()
+        for chain in chains:
+            engine.compiled_steps(chain)
+        build_ms = (time.perf_counter() - start) * 1e3
+        inputs = [(post, chain) for chain in chains for post in SAMPLE_POSTS]
+        scoped = per_call_us(lambda item: engine.apply(item[0], scopes=item[1]), inputs)
+        print(f"{channels:>8} {everything:>10.1f} {scoped:>10.1f} {everything / scoped:>7.1f}x "
+              f"{build_ms:>9.1f} {len(bot.pattern_pool):>7}")
+
+        for _, scope in chains:
+            bot.save_filters([], scope)
+    print("")
+
+
+# Human edits of the bot's output (shifted by +60 minutes): (output, edit, expected)
+EDIT_CASES = [
+    ("Starts 17:30 sharp", "Starts 17:30! sharp", "Starts 17:30! sharp"),
+    ("Starts 17:30 sharp", "Starts 17:30, sharp", "Starts 17:30, sharp"),
+    ("Opens 17:30.", "Opens 17:30. Closes 21:00.", "Opens 17:30. Closes 22:00."),
+    ("Opens 17:30", "Opens at 17:30", "Opens at 17:30"),
+    ("Call 10:0", "Call 10:05", "Call 11:05"),
+]
+
+
+def bench_timezone(bot):
+    """Single-pass convert_timezone vs the findall + str.replace loop."""
+    for previous, edited, expected in EDIT_CASES:
+        result, _ = asyncio.run(bot.rewrite_text(edited, None, 60, previous))
+        assert result == expected, (edited, result)
+
+    print("Timestamp conversion (µs per message)")
+    print(f"{'timestamps':>10} {'legacy':>10} {'single-pass':>12} {'speedup':>8}")
+    for count in (1, 10, 60, 200):
+        post = [make_schedule_post(count)]
+        legacy = per_call_us(legacy_convert_timezone, post)
+        current = per_call_us(bot.convert_timezone, post)
+        print(f"{count:>10} {legacy:>10.1f} {current:>12.1f} {legacy / current:>7.1f}x")
+
+    sample = "Open 09:00, close 12:30"
+    print(f"Correctness: {sample!r} -> legacy {legacy_convert_timezone(sample)!r}, "
+          f"single-pass {bot.convert_timezone(sample, 210)!r}")
+    print("")
+
+
+class FakeChat:
+    def __init__(self, chat_id, username=None):
+        self.id = chat_id
+        self.username = username
+
+
+LEGACY_CHANNELS_FILE = "legacy_monitored_channels.json"
+
+
+def legacy_channel_match(chat):
+    for channel in json.load(open(LEGACY_CHANNELS_FILE)):
+        if channel.startswith('@'):
+            if chat.username and chat.username.lower() == channel.replace('@', '').lower():
+                return True
+        elif chat.id and str(chat.id) == channel:
+            return True
+    return False
+
+
+def bench_channels(bot):
+    """Channel membership: JSON load + linear scan vs ChannelRegistry."""
+    print("Channel membership test (µs per post)")
+    print(f"{'channels':>8} {'legacy':>10} {'registry':>10} {'speedup':>8}")
+    for count in (10, 1000, 5000):
+        channels = [f"@channel_{i}" if i % 2 else f"-100{i:010d}" for i in range(count)]
+        bot.save_channels(channels)
+        bot.channel_registry.load(channels)
+        with open(LEGACY_CHANNELS_FILE, 'w') as f:
+            json.dump(channels, f)
+        chats = [FakeChat(-1, f"CHANNEL_{count - 1}"), FakeChat(-1234, "unmonitored")]
+
+        legacy = per_call_us(legacy_channel_match, chats)
+        registry = per_call_us(bot.channel_registry.should_process, chats)
+        print(f"{count:>8} {legacy:>10.1f} {registry:>10.2f} {legacy / registry:>7.0f}x")
+    bot.save_channels([])
+    bot.channel_registry.load([])
+    print("")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class FakeBotAPI:
+    """
+    Minimal local stand-in for the Telegram Bot API over HTTP/1.1.
+
+    Answers getMe, edits and sendMessage with plausible results, can answer
+    every Nth edit with a 429 flood wait, and can delay chosen chats to
+    simulate a slow one, or every call to stand in for the network. Updates put on `updates` are served to getUpdates
+    long polls, and `edited` records when each message was last edited.
+    """
+
+    REASONS = {200: "OK", 400: "Bad Request", 429: "Too Many Requests"}
+
+    def __init__(self, flood_every=0, retry_after=1, slow_chats=(), slow_delay=0.2, round_trip=0.0):
+        self.flood_every = flood_every
+        self.round_trip = round_trip
+        self.retry_after = retry_after
+        self.slow_chats = set(slow_chats)
+        self.slow_delay = slow_delay
+        self.calls = collections.Counter()
+        self.updates = asyncio.Queue()
+        self.edited = {}
+        self.edit_waiters = {}
+        self.pollers = 0
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        # Answer pending long polls so their handlers finish instead of being cancelled
+        for _ in range(self.pollers):
+            self.updates.put_nowait(None)
+        await asyncio.sleep(0)
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = line.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self.respond(path, headers, body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {self.REASONS.get(status, 'Error')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _params(headers, body):
+        content_type = headers.get("content-type", "")
+        if "json" in content_type:
+            return json.loads(body or b"{}")
+        if "urlencoded" in content_type:
+            return dict(urllib.parse.parse_qsl(body.decode()))
+        return {}
+
+    async def respond(self, path, headers, body):
+        api_method = path.rsplit("/", 1)[-1]
+        params = self._params(headers, body)
+        self.calls[api_method] += 1
+
+        chat_id = int(params.get("chat_id", 0))
+        if chat_id in self.slow_chats:
+            await asyncio.sleep(self.slow_delay)
+        if self.round_trip and api_method != "getUpdates":
+            await asyncio.sleep(self.round_trip)
+
+        if (self.flood_every and api_method.startswith("edit")
+                and self.calls[api_method] % self.flood_every == 0):
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+
+        if api_method == "getUpdates":
+            return 200, {"ok": True, "result": await self._next_updates(float(params.get("timeout", 0)))}
+        if api_method.startswith("edit"):
+            message_id = int(params.get("message_id", 0))
+            self.edited[message_id] = time.perf_counter()
+            waiter = self.edit_waiters.pop(message_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(self.edited[message_id])
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif api_method in ("editMessageText", "editMessageCaption", "sendMessage"):
+            result = {"message_id": int(params.get("message_id", 1)), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "channel"},
+                      "text": params.get("text", params.get("caption", ""))}
+        else:
+            result = True
+        return 200, {"ok": True, "result": result}
+
+    async def _next_updates(self, timeout):
+        self.pollers += 1
+        try:
+            batch = [await asyncio.wait_for(self.updates.get(), timeout or 0.01)]
+        except asyncio.TimeoutError:
+            return []
+        finally:
+            self.pollers -= 1
+        while not self.updates.empty():
+            batch.append(self.updates.get_nowait())
+        return [update for update in batch if update is not None]
+
+    def wait_for_edit(self, message_id):
+        """Future resolved with the perf_counter time the message gets edited."""
+        waiter = asyncio.get_running_loop().create_future()
+        self.edit_waiters[message_id] = waiter
+        return waiter
+
+
+async def make_fake_bot(api):
+    """A real telegram.Bot pointed at the fake API server."""
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+    # Same connection pool size Application.builder() gives the bot
+    request = HTTPXRequest(connection_pool_size=256)
+    bot_client = Bot(token="123456:BENCHMARK", base_url=api.base_url, request=request)
+    await bot_client.initialize()
+    return bot_client
+
+
+def bench_dispatcher(bot):
+    """Edit throughput and latency: inline awaits vs the EditDispatcher."""
+    chats, per_chat = 20, 25
+
+    async def inline(api, client):
+        latencies = []
+        start = time.perf_counter()
+        for message_id in range(per_chat):
+            for chat_id in range(chats):
+                await client.edit_message_text(chat_id=chat_id, message_id=message_id, text="edited")
+                latencies.append(time.perf_counter() - start)
+        return time.perf_counter() - start, latencies, None
+
+    async def dispatched(api, client, workers=8):
+        dispatcher = bot.EditDispatcher(workers=workers, chat_rate=1e6, chat_burst=1e6, global_rate=1e6)
+        dispatcher.start(client)
+        start = time.perf_counter()
+        for message_id in range(per_chat):
+            for chat_id in range(chats):
+                dispatcher.enqueue(bot.EditJob(chat_id, message_id, "text", "edited"))
+        await dispatcher.stop()
+        return time.perf_counter() - start, list(dispatcher.latencies), dispatcher.stats
+
+    async def scenario(runner, **api_options):
+        api = await FakeBotAPI(**api_options).start()
+        client = await make_fake_bot(api)
+        try:
+            return await runner(api, client)
+        finally:
+            await client.shutdown()
+            await api.stop()
+
+    total = chats * per_chat
+    print(f"Edit dispatch ({total} edits over {chats} chats arriving at once, local fake Bot API)")
+    print("Latency is measured from arrival of the burst to completion of each edit")
+    print(f"{'scenario':<34} {'edits/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    scenarios = [
+        ("inline awaits", inline, {}),
+        ("dispatcher, 8 workers", dispatched, {}),
+        # The fake API shares the CPU with the bot; with a real round trip the workers overlap it
+        ("inline awaits, 20 ms round trip", inline, {"round_trip": 0.02}),
+        ("dispatcher, 20 ms round trip", dispatched, {"round_trip": 0.02}),
+        ("inline awaits, one slow chat", inline, {"slow_chats": [0]}),
+        ("dispatcher, one slow chat", dispatched, {"slow_chats": [0]}),
+        ("dispatcher, 429 on every 50th", dispatched, {"flood_every": 50}),
+    ]
+    for label, runner, api_options in scenarios:
+        logging.getLogger("simple_bot").setLevel(logging.ERROR)
+        elapsed, latencies, stats = asyncio.run(scenario(runner, **api_options))
+        print(f"{label:<34} {total / elapsed:>8.0f} {percentile(latencies, 50) * 1e3:>8.1f} "
+              f"{percentile(latencies, 99) * 1e3:>8.1f}" + (f"  {dict(stats)}" if stats else ""))
+    print("")
+
+
+def bench_outbox(bot):
+    """Cost of making edits durable: one synced commit per edit vs batched commits."""
+    edits = 300
+    path = "bench_outbox.db"
+
+    def remove_outbox():
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    async def save(flush_delay, spacing, one_by_one):
+        remove_outbox()
+        outbox = bot.Outbox(path, flush_delay=flush_delay)
+        jobs = []
+        start = time.perf_counter()
+        for message_id in range(edits):
+            job = bot.EditJob(message_id % 20, message_id, "text", "edited")
+            outbox.append(job)
+            jobs.append(job)
+            if one_by_one:
+                await job.saved
+            await asyncio.sleep(spacing)
+        await asyncio.gather(*(job.saved for job in jobs))
+        elapsed = time.perf_counter() - start
+        await outbox.close()
+        assert all(job.outbox_id is not None for job in jobs)
+        return elapsed, outbox.stats['commits']
+
+    async def replay():
+        # A process killed after saving its edits, then a fresh start
+        remove_outbox()
+        outbox = bot.Outbox(path)
+        jobs = [bot.EditJob(1, message_id, "text", "edited") for message_id in range(50)]
+        for job in jobs:
+            outbox.append(job)
+        await asyncio.gather(*(job.saved for job in jobs))
+        api = await FakeBotAPI().start()
+        client = await make_fake_bot(api)
+        restarted = bot.EditDispatcher(workers=4, chat_rate=1e6, chat_burst=1e6, global_rate=1e6,
+                                       outbox=bot.Outbox(path))
+        restarted.start(client)
+        await restarted.stop()
+        await client.shutdown()
+        await api.stop()
+        return restarted.stats['replayed'], len(jobs), api.calls['editMessageText']
+
+    print(f"Durable outbox ({edits} edits written before sending)")
+    print(f"{'scenario':<36} {'commits':>8} {'total ms':>9} {'syncs saved':>12}")
+    scenarios = [
+        ("commit per edit", 0, 0, True),
+        ("batched, burst of edits", bot.OUTBOX_FLUSH_DELAY, 0, False),
+        ("batched, one edit every 5 ms", bot.OUTBOX_FLUSH_DELAY, 0.005, False),
+    ]
+    for label, flush_delay, spacing, one_by_one in scenarios:
+        elapsed, commits = asyncio.run(save(flush_delay, spacing, one_by_one))
+        print(f"{label:<36} {commits:>8} {elapsed * 1e3:>9.1f} {(1 - commits / edits) * 100:>11.0f}%")
+    replayed, saved, sent = asyncio.run(replay())
+    print(f"Replay after a simulated crash: {replayed} of {saved} saved edits replayed, {sent} sent")
+    remove_outbox()
+    print("")
+
+
+def bench_executor(bot):
+    """Event-loop lag while a heavy filter set runs inline, in threads or in processes."""
+    # Patterns without literals, so the prefilter cannot skip them
+    heavy_filters = [[rf"\b([a-z]{{{i % 12 + 3}}})(\d+)\b", r"\2\1"] for i in range(300)]
+    bot.save_filters(heavy_filters)
+    post = " ".join(f"word{i} other{i} text" for i in range(400))
+    messages = 100
+
+    async def run(mode):
+        executor = bot.PipelineExecutor(mode, workers=2)
+        lags = []
+        done = False
+
+        async def ticker(interval=0.005):
+            while not done:
+                expected = time.perf_counter() + interval
+                await asyncio.sleep(interval)
+                lags.append(max(0.0, time.perf_counter() - expected))
+
+        tick = asyncio.create_task(ticker())
+        if mode == "process":
+            await executor.process("warm up")
+        start = time.perf_counter()
+        await asyncio.gather(*(executor.process(post) for _ in range(messages)))
+        elapsed = time.perf_counter() - start
+        done = True
+        await tick
+        executor.shutdown()
+        return elapsed, lags
+
+    print(f"Event-loop lag ({messages} posts, {len(heavy_filters)} regex filters, 5 ms ticker)")
+    print(f"{'mode':<8} {'posts/s':>8} {'p50 lag ms':>11} {'p99 lag ms':>11} {'max lag ms':>11}")
+    for mode in bot.PipelineExecutor.MODES:
+        elapsed, lags = asyncio.run(run(mode))
+        print(f"{mode:<8} {messages / elapsed:>8.1f} {percentile(lags, 50) * 1e3:>11.1f} "
+              f"{percentile(lags, 99) * 1e3:>11.1f} {max(lags, default=0) * 1e3:>11.1f}")
+    bot.save_filters([])
+    print("")
+
+
+def legacy_logged_pipeline(bot, log, text):
+    """The original apply_text_filters + convert_timezone logging, eager f-strings at INFO."""
+    filters_list = bot.STATIC_FILTERS + json.load(open(LEGACY_FILTERS_FILE))
+    log.info(f"Got {len(filters_list)} filters to apply")
+    log.info(f"Original text: {text}")
+    modified_text = text
+    for pattern, replacement in filters_list:
+        log.info(f"Applying filter: pattern='{pattern}', replacement='{replacement}'")
+        try:
+            text_before = modified_text
+            modified_text = re.sub(pattern, replacement, modified_text)
+            if modified_text != text_before:
+                log.info(f"Text changed: '{text_before}' -> '{modified_text}'")
+        except Exception as e:
+            log.error(f"Error applying filter pattern '{pattern}': {e}")
+    log.info(f"Final modified text: {modified_text}")
+    log.info(f"Finding times to add 3:30 hours in: {modified_text}")
+    return legacy_convert_timezone(modified_text)
+
+
+def bench_logging(bot):
+    """Messages/sec with logging at its default level: synchronous handlers vs the queue listener."""
+    count = 200
+    bot.save_filters(make_user_filters(count))
+    with open(LEGACY_FILTERS_FILE, 'w') as f:
+        json.dump(make_user_filters(count), f)
+    devnull = open(os.devnull, 'w')
+    formatter = logging.Formatter(bot.LOG_FORMAT)
+
+    # Legacy setup: console + FileHandler written on the calling thread
+    legacy_log = logging.getLogger("legacy_bench")
+    legacy_log.propagate = False
+    legacy_log.setLevel(logging.INFO)
+    for handler in (logging.StreamHandler(devnull), logging.FileHandler("legacy_bench.log")):
+        handler.setFormatter(formatter)
+        legacy_log.addHandler(handler)
+
+    # Current setup: the bot's queue listener, console silenced
+    listener = bot.setup_logging()
+    console = listener.handlers[0]
+    console.setStream(devnull)
+    root = logging.getLogger()
+
+    def current(text):
+        bot.logger.info("Processing message %s from channel %s", 1, -100)
+        return bot.process_message_text(text)
+
+    def legacy(text):
+        legacy_log.info(f"Processing message {1} from channel {-100}")
+        return legacy_logged_pipeline(bot, legacy_log, text)
+
+    print(f"Pipeline throughput with logging ({count} user filters, messages/sec)")
+    print(f"{'setup':<32} {'msgs/s':>10}")
+    root.setLevel(logging.INFO)
+    rows = [
+        ("legacy: f-strings, sync handlers", legacy),
+        ("queue listener, INFO (default)", current),
+    ]
+    for label, func in rows:
+        print(f"{label:<32} {1e6 / per_call_us(func, SAMPLE_POSTS):>10.0f}")
+    root.setLevel(logging.DEBUG)
+    print(f"{'queue listener, DEBUG traces':<32} {1e6 / per_call_us(current, SAMPLE_POSTS):>10.0f}")
+    root.setLevel(logging.WARNING)
+
+    # Let the listener drain before the handlers are swapped back
+    listener.stop()
+    console.setStream(sys.stderr)
+    listener.start()
+    for handler in legacy_log.handlers:
+        handler.close()
+    bot.save_filters([])
+    print("")
+
+
+class FakeEntity:
+    """Just the MessageEntity fields the remapper reads."""
+
+    def __init__(self, type, offset, length):
+        self.type, self.offset, self.length = type, offset, length
+        self.url = self.user = self.language = self.custom_emoji_id = None
+
+
+def make_formatted_post(paragraphs):
+    """A long post with emoji, timestamps and a bold/link/mention entity on every line."""
+    text = ""
+    entities = []
+    for i in range(paragraphs):
+        line = f"🚧 Urgent update {i}: entry at {(i * 7) % 24:02d}:15, details from @handle_{i % 50:04d} 🔥 read more\n"
+        base = len(text.encode("utf-16-le")) // 2
+        units = lambda s: len(s.encode("utf-16-le")) // 2
+        head, _, rest = line.partition("Urgent")
+        entities.append(FakeEntity("bold", base + units(head), units("Urgent update")))
+        mention_at = line.index("@handle")
+        entities.append(FakeEntity("mention", base + units(line[:mention_at]), len("@handle_0000")))
+        entities.append(FakeEntity("text_link", base + units(line[:line.index("read more")]), len("read more")))
+        text += line
+    return text, entities
+
+
+def bench_entities(bot):
+    """Cost of recording an edit script and remapping entities on long formatted posts."""
+    bot.save_filters(make_user_filters(200))
+    print("Entity remapping (µs per post, 200 user filters)")
+    print("  map: offset mapping only; remap: including new MessageEntity objects")
+    print(f"{'lines':>6} {'entities':>9} {'plain':>10} {'recorded':>10} {'map':>8} {'remap':>8}")
+    for paragraphs in (5, 20, 50):
+        text, entities = make_formatted_post(paragraphs)
+        plain = per_call_us(bot.process_message_text, [text])
+
+        def recorded(text):
+            script = bot.EditScript()
+            new_text = bot.process_message_text(text, None, script)
+            return script, new_text
+
+        with_script = per_call_us(recorded, [text])
+        script, new_text = recorded(text)
+        points = [(e.offset, False) for e in entities] + [(e.offset + e.length, True) for e in entities]
+        mapping = per_call_us(script.map_points, [points])
+        remap = per_call_us(lambda t: script.remap_entities(entities, t, new_text), [text])
+        print(f"{paragraphs:>6} {len(entities):>9} {plain:>10.1f} {with_script:>10.1f} "
+              f"{mapping:>8.1f} {remap:>8.1f}")
+    bot.save_filters([])
+    print("")
+
+
+def make_recorded_updates(count, chat_id, first_id=1):
+    """Channel post updates in the JSON shape Telegram sends them."""
+    updates = []
+    for i in range(count):
+        message_id = first_id + i
+        # Every post needs an edit, so each update ends in exactly one API call
+        text = SAMPLE_POSTS[i % len(SAMPLE_POSTS)] + " Remember: urgent"
+        updates.append({
+            "update_id": 10_000 + message_id,
+            "channel_post": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "channel", "title": "Bench", "username": "bench_channel"},
+                "text": text,
+            },
+        })
+    return updates
+
+
+def bench_webhook(bot):
+    """End-to-end update latency, from Telegram's side to the edit arriving: polling vs webhook."""
+    import socket
+    import httpx
+
+    chat_id = -1001234567890
+    bot.add_channel(str(chat_id))
+    count = 200
+    port_finder = socket.socket()
+    port_finder.bind(("127.0.0.1", 0))
+    bot.WEBHOOK_LISTEN, bot.WEBHOOK_PORT = port_finder.getsockname()
+    port_finder.close()
+
+    async def run(mode, first_id):
+        api = await FakeBotAPI().start()
+        # No flood limits here: this measures delivery, not the dispatcher's pacing
+        bot.edit_dispatcher = bot.EditDispatcher(workers=8, chat_rate=1e6, chat_burst=1e6, global_rate=1e6)
+        bot.WEBHOOK_URL = f"https://example.invalid/{bot.WEBHOOK_PATH}"
+        application = bot.build_application(token="123456:BENCHMARK", base_url=api.base_url)
+        try:
+            await bot.start_application(application, mode)
+        except RuntimeError as e:
+            # Webhook mode needs the python-telegram-bot[webhooks] extra
+            await bot.stop_application(application)
+            await api.stop()
+            return None, f"skipped: {e}"
+        webhook = f"http://127.0.0.1:{bot.WEBHOOK_PORT}/{bot.WEBHOOK_PATH}"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": bot.WEBHOOK_SECRET}
+
+        latencies = []
+        async with httpx.AsyncClient() as client:
+            for update in make_recorded_updates(count, chat_id, first_id):
+                message_id = update["channel_post"]["message_id"]
+                edited = api.wait_for_edit(message_id)
+                sent = time.perf_counter()
+                if mode == "webhook":
+                    response = await client.post(webhook, json=update, headers=headers)
+                    response.raise_for_status()
+                else:
+                    api.updates.put_nowait(update)
+                latencies.append(await asyncio.wait_for(edited, 10) - sent)
+
+            note = ""
+            if mode == "webhook":
+                spoofed = await client.post(webhook, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+                note = f"wrong secret token -> HTTP {spoofed.status_code}"
+
+        await bot.stop_application(application)
+        await api.stop()
+        return latencies, note
+
+    print(f"Update-to-edit latency ({count} recorded channel posts, one at a time)")
+    print(f"{'mode':<8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}  notes")
+    for index, mode in enumerate(("polling", "webhook")):
+        latencies, note = asyncio.run(run(mode, first_id=index * count + 1))
+        if latencies is None:
+            print(f"{mode:<8} {'-':>8} {'-':>8} {'-':>8}  {note}")
+            continue
+        print(f"{mode:<8} {percentile(latencies, 50) * 1e3:>8.2f} {percentile(latencies, 99) * 1e3:>8.2f} "
+              f"{max(latencies) * 1e3:>8.2f}  {note}")
+    print("")
+
+
+CORPUS_KINDS = ("short", "long", "emoji", "timestamps", "captioned")
+EMOJI = "🚀🔥📈📉💰✅❌⚠️🚧🎯💎🌙"
+
+
+def make_corpus(per_kind=40, seed=7):
+    """
+    Synthetic channel posts, per_kind of each kind in CORPUS_KINDS.
+
+    Returns (kind, text, is_caption) tuples. Posts mix words the static and
+    user filters hit with ones they don't, so the corpus exercises both
+    the changed and the unchanged paths.
+    """
+    rng = random.Random(seed)
+    words = ["signal", "entry", "target", "stop", "market", "update", "urgent", "important",
+             "keyword4", "keyword8", "@handle_0003", "@Gazew_07", "profit", "long", "short", "today"]
+
+    def sentence(count):
+        return " ".join(rng.choice(words) for _ in range(count)).capitalize() + "."
+
+    def clock():
+        return f"{rng.randrange(24):02d}:{rng.randrange(60):02d}"
+
+    corpus = []
+    for _ in range(per_kind):
+        corpus.append(("short", f"{sentence(6)} {clock()}", False))
+        corpus.append(("long", "\n\n".join(sentence(rng.randint(15, 30)) for _ in range(25))[:4000], False))
+        corpus.append(("emoji", " ".join(rng.choice(EMOJI) + " " + sentence(3) for _ in range(30)), False))
+        corpus.append(("timestamps", "\n".join(f"{rng.choice(EMOJI)} {sentence(2)} {clock()}:{rng.randrange(60):02d}"
+                                                 if rng.random() < 0.2 else f"{sentence(3)} at {clock()}"
+                                                 for _ in range(60)), False))
+        corpus.append(("captioned", f"{rng.choice(EMOJI)} {sentence(12)} Valid until {clock()}", True))
+    return corpus
+
+
+def latency_profile(func, inputs):
+    """Time every call individually until MIN_TIME elapsed; return (msgs/s, p50 µs, p99 µs)."""
+    samples = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < MIN_TIME:
+        for item in inputs:
+            began = time.perf_counter()
+            func(item)
+            samples.append(time.perf_counter() - began)
+    return len(samples) / sum(samples), percentile(samples, 50) * 1e6, percentile(samples, 99) * 1e6
+
+
+def make_update(message_id, chat_id, text, is_caption):
+    """A channel_post update as Telegram sends it, as text or as a photo caption."""
+    post = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "channel", "title": "Bench", "username": "bench_channel"},
+    }
+    if is_caption:
+        post["caption"] = text
+        post["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 90, "height": 90}]
+    else:
+        post["text"] = text
+    return {"update_id": 100_000 + message_id, "channel_post": post}
+
+
+def bench_suite(bot):
+    """The pipeline functions per post kind, then the full handler against FakeBotAPI."""
+    from telegram import Update
+
+    bot.save_filters(make_user_filters(200))
+    corpus = make_corpus()
+    by_kind = {kind: [text for k, text, _ in corpus if k == kind] for kind in CORPUS_KINDS}
+
+    print("Pipeline functions (200 user filters, single thread)")
+    print(f"{'function':<22} {'posts':<11} {'msgs/s':>9} {'p50 µs':>9} {'p99 µs':>9}")
+    functions = [
+        ("apply_text_filters", bot.apply_text_filters),
+        ("convert_timezone", bot.convert_timezone),
+        ("process_message_text", bot.process_message_text),
+    ]
+    for name, func in functions:
+        for kind in CORPUS_KINDS:
+            rate, p50, p99 = latency_profile(func, by_kind[kind])
+            print(f"{name:<22} {kind:<11} {rate:>9.0f} {p50:>9.1f} {p99:>9.1f}")
+    print("")
+
+    chat_id = -1009876543210
+    bot.add_channel(str(chat_id))
+
+    async def run():
+        api = await FakeBotAPI().start()
+        bot.edit_dispatcher = bot.EditDispatcher(workers=8, chat_rate=1e6, chat_burst=1e6, global_rate=1e6)
+        application = bot.build_application(token="123456:BENCHMARK", base_url=api.base_url)
+        await application.initialize()
+        await application.start()
+        bot.edit_dispatcher.start(application.bot)
+        api.calls.clear()
+
+        stats = {kind: {"latencies": [], "calls": 0, "count": 0} for kind in CORPUS_KINDS}
+        start = time.perf_counter()
+        for message_id, (kind, text, is_caption) in enumerate(corpus, 1):
+            update = Update.de_json(make_update(message_id, chat_id, text, is_caption), application.bot)
+            before = sum(api.calls.values())
+            edited = api.wait_for_edit(message_id)
+            began = time.perf_counter()
+            await application.process_update(update)
+            if bot.edit_dispatcher.queued():
+                await asyncio.wait_for(edited, 10)
+            else:
+                edited.cancel()
+            stats[kind]["latencies"].append(time.perf_counter() - began)
+            stats[kind]["calls"] += sum(api.calls.values()) - before
+            stats[kind]["count"] += 1
+        elapsed = time.perf_counter() - start
+
+        await bot.edit_dispatcher.stop()
+        await application.stop()
+        await application.shutdown()
+        await api.stop()
+        return stats, elapsed
+
+    stats, elapsed = asyncio.run(run())
+    print(f"Full process_channel_post handler against FakeBotAPI ({len(corpus)} posts, one at a time)")
+    print(f"{'posts':<11} {'p50 ms':>8} {'p99 ms':>8} {'API calls/msg':>14}")
+    for kind in CORPUS_KINDS:
+        entry = stats[kind]
+        print(f"{kind:<11} {percentile(entry['latencies'], 50) * 1e3:>8.2f} "
+              f"{percentile(entry['latencies'], 99) * 1e3:>8.2f} {entry['calls'] / entry['count']:>14.2f}")
+    print(f"overall: {len(corpus) / elapsed:.0f} msgs/s")
+    bot.save_filters([])
+    print("")
+
+
+# Runs in a fresh interpreter: argv is the bot script, the working directory
+# and "time" or "memory". Prints one JSON object.
+STARTUP_PROBE = """
+import importlib.util, json, os, sys, time
+path, workdir, mode = sys.argv[1:4]
+if mode == "memory":
+    import tracemalloc
+    tracemalloc.start()
+os.chdir(workdir)
+existing = set(os.listdir(workdir))
+result = {}
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location("simple_bot", path)
+bot = importlib.util.module_from_spec(spec)
+sys.modules["simple_bot"] = bot
+spec.loader.exec_module(bot)
+result["import"] = time.perf_counter() - started
+result["telegram_loaded"] = "telegram" in sys.modules
+result["files"] = sorted(set(os.listdir(workdir)) - existing)
+if mode == "memory":
+    import sysconfig
+    stdlib = sysconfig.get_paths()["stdlib"] + os.sep
+    roots = sorted((entry + os.sep for entry in sys.path if entry), key=len, reverse=True)
+    packages = {}
+    for stat in tracemalloc.take_snapshot().statistics("filename"):
+        filename = stat.traceback[0].filename
+        root = next((root for root in roots if filename.startswith(root)), None)
+        if filename.startswith("<frozen importlib"):
+            name = "code objects (importlib)"
+        elif filename == path:
+            name = "bot script"
+        elif root is None or root == stdlib:
+            name = "stdlib"
+        else:
+            name = filename[len(root):].split(os.sep)[0]
+        packages[name] = packages.get(name, 0) + stat.size
+    result["traced"] = sum(packages.values())
+    result["packages"] = sorted(packages.items(), key=lambda item: -item[1])[:6]
+    tracemalloc.stop()
+def peak_rss_kb():
+    # VmHWM starts over at exec; ru_maxrss keeps the peak of the parent on Linux
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+result["rss_import"] = peak_rss_kb()
+
+started = time.perf_counter()
+channels = bot.load_channels()
+bot.channel_registry.load(channels)
+result["pipelines"] = bot.filter_engine.prebuild(channels)
+result["prebuild"] = time.perf_counter() - started
+started = time.perf_counter()
+bot.build_application(token="123456:BENCHMARK")
+result["application"] = time.perf_counter() - started
+result["rss_ready"] = peak_rss_kb()
+print(json.dumps(result))
+"""
+
+
+def run_startup_probe(mode, importtime=False):
+    """Run STARTUP_PROBE in a new interpreter; returns (result, -X importtime lines)."""
+    import subprocess
+    command = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    command += ["-c", STARTUP_PROBE, bot_script_path(), os.getcwd(), mode]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr.splitlines()
+
+
+def bench_startup(bot):
+    """Cold start in a fresh interpreter: import time, prebuilt indexes, RSS and allocations."""
+    bot.save_filters(make_user_filters(200))
+    channels = [f"@startup_channel_{i}" for i in range(20)]
+    for i, channel in enumerate(channels):
+        bot.add_channel(channel)
+        if i % 2:
+            bot.add_filter(rf"\bchannel{i}\b", f"CH{i}", bot.channel_scope(channel))
+    runs = 2 if MIN_TIME < 0.5 else 5
+
+    results = [run_startup_probe("time")[0] for _ in range(runs)]
+    def median(key):
+        return sorted(result[key] for result in results)[len(results) // 2] * 1e3
+    first = results[0]
+    print(f"Cold start in a fresh interpreter (median of {runs}, 200 filters, {len(channels)} channels)")
+    print(f"{'import the bot module':<28} {median('import'):>8.1f} ms  "
+          f"(telegram loaded: {'yes' if first['telegram_loaded'] else 'no'}, "
+          f"files written: {', '.join(first['files']) or 'none'})")
+    print(f"{'prebuild filters + channels':<28} {median('prebuild'):>8.1f} ms  ({first['pipelines']} pipelines)")
+    print(f"{'build_application':<28} {median('application'):>8.1f} ms  (imports telegram)")
+    if first["rss_import"] is not None:
+        # Peak RSS in kilobytes
+        print(f"{'max RSS':<28} {first['rss_import'] / 1024:>8.1f} MB after import, "
+              f"{first['rss_ready'] / 1024:.1f} MB once the application is built")
+
+    _, lines = run_startup_probe("time", importtime=True)
+    imports = []
+    for line in lines:
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+        # Top-level imports only; nested ones are indented under them
+        if match and not match.group(2):
+            imports.append((int(match.group(1)), match.group(3)))
+    print("Slowest imports (-X importtime, cumulative):")
+    for micros, name in sorted(imports, reverse=True)[:6]:
+        print(f"  {name:<26} {micros / 1e3:>8.1f} ms")
+
+    memory, _ = run_startup_probe("memory")
+    print(f"Python allocations after import (tracemalloc): {memory['traced'] / 1024:.0f} KB")
+    for name, size in memory["packages"]:
+        print(f"  {name:<26} {size / 1024:>8.0f} KB")
+
+    for channel in channels:
+        bot.remove_channel(channel)
+    bot.save_filters([])
+    print("")
+
+
+BENCHMARKS = {
+    "filters": bench_filters,
+    "compiler": bench_compiler,
+    "prefilter": bench_prefilter,
+    "scopes": bench_scopes,
+    "timezone": bench_timezone,
+    "channels": bench_channels,
+    "dispatcher": bench_dispatcher,
+    "outbox": bench_outbox,
+    "executor": bench_executor,
+    "logging": bench_logging,
+    "entities": bench_entities,
+    "webhook": bench_webhook,
+    "suite": bench_suite,
+    "startup": bench_startup,
+}
+
+
+def main():
+    global MIN_TIME
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--quick", action="store_true",
+                        help="shorter timing loops, for CI smoke runs")
+    args = parser.parse_args()
+    if args.quick:
+        MIN_TIME = 0.05
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = load_bot(workdir)
+        for name in args.names or BENCHMARKS:
+            BENCHMARKS[name](bot)
+
+
+if __name__ == "__main__":
+    main()
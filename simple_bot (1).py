@@ -12,31 +12,96 @@ Usage:
    python simple_bot.py
 """
 
+# Handler annotations name telegram.ext types, which are only imported when the bot starts
+from __future__ import annotations
+
 import os
 import re
+import sys
 import json
+import time
+import queue
+import random
+import atexit
+import signal
+import hashlib
+import secrets
+import sqlite3
 import logging
+import logging.handlers
 import asyncio
-from datetime import datetime
-from telegram import Bot, Update
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    filters,
-    ContextTypes
-)
+import functools
+import itertools
+import threading
+import multiprocessing
+import contextlib
+import bisect
+import collections
+import weakref
+import concurrent.futures
+from datetime import datetime, timezone, time as clock_time
+from typing import TYPE_CHECKING
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+try:
+    # Regex parser internals, used to derive literal hints from patterns
+    from re import _parser as sre_parse, _constants as sre_constants, _compiler as sre_compile
+except ImportError:  # Python < 3.11
+    import sre_parse, sre_constants, sre_compile
+# telegram is imported where it is used: loading it (and httpx) is the
+# largest part of startup, and the filter tools don't need it
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 # Configure logging
-# Log to both console and file
-console_handler = logging.StreamHandler()
-file_handler = logging.FileHandler('bot.log')
-
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[console_handler, file_handler]
-)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()  # DEBUG shows every filter step
+LOG_FILE = os.environ.get("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = 5 * 1024 * 1024    # Rotate the log file at 5 MB
+LOG_BACKUP_COUNT = 3               # Keep bot.log.1 .. bot.log.3
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+log_listener = None
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE):
+    """
+    Log to both console and a rotating file.
+    
+    Loggers only put records on an in-memory queue; a background listener
+    thread does the formatting and the console/file writes, so slow storage
+    never blocks the event loop.
+    """
+    global log_listener
+    if log_listener is not None:
+        return log_listener
+    
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        # delay: the file is only created once there is something to write
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    
+    log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    return log_listener
+
+class ForwardingHandler(logging.Handler):
+    """Hand records received from worker processes to this process's loggers."""
+    
+    def handle(self, record):
+        logging.getLogger(record.name).handle(record)
+        return True
+
+# setup_logging() is called by the entry points (main, backfill_main), so
+# importing this module (benchmarks, pool workers) writes no files
 logger = logging.getLogger(__name__)
 
 # Configuration
@@ -49,6 +114,78 @@ if not BOT_TOKEN:
 PROCESS_TEXT = True                # Process text messages
 PROCESS_CAPTIONS = True            # Process captions in media messages
 REPLY_ON_EDIT_FAILURE = True       # Reply with corrected text when editing fails
+TIME_OFFSET = os.environ.get("TIME_OFFSET", "+03:30")  # Shift applied to every timestamp
+
+# Edit dispatcher limits (Telegram allows about 20 messages per minute in a
+# channel and about 30 per second across all chats)
+EDIT_WORKERS = 4                   # Concurrent edit API calls
+CHAT_EDITS_PER_MINUTE = 20         # Per-chat edit budget
+CHAT_EDIT_BURST = 3                # Edits a quiet chat may send back to back
+GLOBAL_EDITS_PER_SECOND = 30       # Budget across all chats
+EDIT_MAX_ATTEMPTS = 3              # Attempts for timeouts/network errors and flood waits
+
+# Durable outbox: edits are written to disk before they are sent and replayed
+# after a crash or restart. Set OUTBOX_DB to an empty string to turn it off.
+OUTBOX_DB = os.environ.get("OUTBOX_DB", "bot_outbox.db")
+OUTBOX_FLUSH_DELAY = 0.05          # Seconds to gather edits into one synced commit
+OUTBOX_COMPACT_AFTER = 500         # Acknowledged entries allowed to pile up before they are deleted
+OUTBOX_MAX_AGE = 24 * 3600         # Seconds after which an unsent edit is no longer replayed
+
+# Backfill of old posts from a channel export (see backfill_main)
+BACKFILL_QUEUE_LIMIT = 50          # Unsent edits before reading more of the export
+BACKFILL_CHECKPOINT_EVERY = 100    # Posts between saved resume points
+BACKFILL_CHUNK_SIZE = 64 * 1024    # Characters read from the export at a time
+
+# Prometheus-format metrics at http://METRICS_LISTEN:METRICS_PORT/metrics (0 = off)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+
+# Where the text pipeline runs: "inline" on the event loop, or in a
+# "thread" or "process" pool so big filter sets don't block polling.
+# Only "process" enforces PIPELINE_TIMEOUT; see the startup warning.
+PIPELINE_EXECUTOR = os.environ.get("PIPELINE_EXECUTOR", "inline")
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "2"))
+
+# ReDoS protection
+FILTER_VET_TIMEOUT = 1.0           # Seconds a new pattern may spend on the probe strings
+FILTER_TIME_BUDGET_MS = 100        # Per-filter CPU time budget per message
+FILTER_BUDGET_STRIKES = 3          # Over-budget messages in a row before a filter is disabled
+PIPELINE_TIMEOUT = 5.0             # Hard deadline per message in process mode
+
+# Filter statistics over a sliding window of recent messages (see /filterstats)
+FILTER_STATS_WINDOW = 5000         # Messages in the window
+FILTER_STATS_SLOTS = 10            # The window moves on every WINDOW / SLOTS messages
+COLD_FILTER_RATE = 0.05            # Filters whose hints occur in fewer messages are "cold"
+COLD_RUN_SIZE = 64                 # Cold filters sharing one combined hint scan
+
+# Shadow filters (/shadowfilter): candidates tried on live posts without editing them
+SHADOW_SAMPLE_SIZE = 5             # Example changes kept for /shadowreport
+SHADOW_DIFF_CHARS = 400            # Longest example shown
+
+RECENT_POSTS_SIZE = 200            # Recent posts kept in memory for /profilefilter
+PROFILE_HOT_SPOTS = 3              # Slowest posts and filters listed by /profilefilter
+PROFILE_TIMEOUT = 10.0             # Seconds a /profilefilter run may take before it is stopped
+
+# Messages already handled, so restarts and overlapping instances don't re-edit them
+PROCESSED_CACHE_SIZE = 10000       # Messages remembered in memory
+PROCESSED_CACHE_TTL = 2 * 24 * 3600  # Seconds a message is remembered
+PERSIST_PROCESSED = os.environ.get("PERSIST_PROCESSED", "1") != "0"  # Also keep them in STATE_DB
+
+MEDIA_GROUP_WAIT = 1.0             # Seconds to collect the items of an album before processing it
+MEDIA_GROUP_SHUTDOWN_WAIT = 10.0   # Seconds shutdown waits for albums already being processed
+
+# How updates arrive: "polling" (default) or "webhook", where Telegram
+# POSTs them to an HTTP server inside the bot (needs a public HTTPS URL)
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "polling")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # Public URL Telegram posts to, e.g. https://example.com/telegram
+# Telegram sends this back with every update; a random one is used per run if unset
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# Update types Telegram delivers in either mode: commands arrive as messages.
+# Telegram remembers the list, so polling passes it too.
+ALLOWED_UPDATES = ["message", "channel_post", "edited_channel_post"]
 
 # Static filters to always apply (regex pattern, replacement)
 STATIC_FILTERS = [
@@ -59,82 +196,536 @@ STATIC_FILTERS = [
 ]
 
 # File paths
+STATE_DB = os.environ.get("STATE_DB", "bot_state.db")
+# Legacy JSON files, migrated into STATE_DB on first start
 CHANNELS_FILE = "monitored_channels.json"
+CHANNEL_SETTINGS_FILE = "channel_settings.json"
 FILTERS_FILE = "user_filters.json"
 
-# Create files if they don't exist
-for file in [CHANNELS_FILE, FILTERS_FILE]:
-    if not os.path.exists(file):
-        with open(file, 'w') as f:
-            json.dump([], f)
+# State Store
+class StateStore:
+    """
+    SQLite storage for filters, channels and per-channel settings.
+
+    The database runs in WAL mode and every change is a single-row upsert or
+    delete (or one transaction for bulk saves), so a process killed mid-write
+    leaves the previous state intact instead of a truncated JSON file.
+    """
+
+    FILTERS_TABLE = """
+        CREATE TABLE IF NOT EXISTS filters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scope TEXT NOT NULL DEFAULT '',
+            pattern TEXT NOT NULL,
+            replacement TEXT NOT NULL,
+            options TEXT,
+            UNIQUE (scope, pattern)
+        );
+    """
+
+    SCHEMA = FILTERS_TABLE + """
+        CREATE TABLE IF NOT EXISTS channels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS channel_settings (
+            channel TEXT PRIMARY KEY,
+            settings TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            is_output INTEGER NOT NULL DEFAULT 0,
+            output_text TEXT,
+            expires REAL NOT NULL,
+            PRIMARY KEY (chat_id, message_id, content_hash)
+        ) WITHOUT ROWID;
+    """
+
+    # Every write to the filters table, from any connection, bumps
+    # meta.filters_version, so other writes (processed messages, backfill
+    # checkpoints) never make a running bot reload its filters
+    FILTER_TRIGGERS = """
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('filters_version', 0);
+        CREATE TRIGGER IF NOT EXISTS filters_inserted AFTER INSERT ON filters BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'filters_version';
+        END;
+        CREATE TRIGGER IF NOT EXISTS filters_updated AFTER UPDATE ON filters BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'filters_version';
+        END;
+        CREATE TRIGGER IF NOT EXISTS filters_deleted AFTER DELETE ON filters BEGIN
+            UPDATE meta SET value = value + 1 WHERE key = 'filters_version';
+        END;
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._conn = conn
+            self._migrate_filter_scopes()
+            # After the migration, which replaces the filters table and its triggers
+            conn.executescript(self.FILTER_TRIGGERS)
+            self._migrate_json()
+        return self._conn
+
+    def query(self, sql, params=()):
+        """Run a statement and return all rows."""
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        """Run a single statement and return the number of changed rows."""
+        with self._lock:
+            return self._connect().execute(sql, params).rowcount
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run several statements atomically."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def filters_version(self):
+        """Changes whenever any connection adds, changes or removes a filter."""
+        with self._lock:
+            row = self._connect().execute("SELECT value FROM meta WHERE key = 'filters_version'").fetchone()
+        return row[0] if row else None
+
+    def _migrate_filter_scopes(self):
+        """Give filter tables created before filter scopes a scope column."""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        if 'scope' in [row[1] for row in conn.execute("PRAGMA table_info(filters)")]:
+            conn.execute("ROLLBACK")
+            return
+        # The UNIQUE constraint moves from pattern to (scope, pattern), so copy the table
+        conn.execute("ALTER TABLE filters RENAME TO filters_unscoped")
+        conn.execute(self.FILTERS_TABLE)
+        conn.execute("INSERT INTO filters (id, scope, pattern, replacement, options) "
+                     "SELECT id, '', pattern, replacement, options FROM filters_unscoped")
+        conn.execute("DROP TABLE filters_unscoped")
+        conn.execute("COMMIT")
+        logger.info("Added filter scopes to %s", self.path)
+
+    def _migrate_json(self):
+        """Import the legacy JSON files once, then rename them out of the way."""
+        conn = self._conn
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return
+        
+        def read_json(path, default):
+            if not os.path.exists(path):
+                return default
+            try:
+                with open(path, 'r') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error("Error reading %s for migration: %s", path, e)
+                return default
+        
+        filters_list = read_json(FILTERS_FILE, [])
+        channels = read_json(CHANNELS_FILE, None)
+        settings = read_json(CHANNEL_SETTINGS_FILE, {})
+        if channels is None:
+            # Fresh install: seed the default channel from the environment
+            channels = [os.environ["CHANNEL_ID"]] if os.environ.get("CHANNEL_ID") else []
+        
+        conn.execute("BEGIN IMMEDIATE")
+        for entry in filters_list:
+            pattern, replacement, options = filter_fields(entry)
+            conn.execute(
+                "INSERT OR REPLACE INTO filters (pattern, replacement, options) VALUES (?, ?, ?)",
+                (pattern, replacement, json.dumps(options) if options else None)
+            )
+        for channel in channels:
+            conn.execute("INSERT OR IGNORE INTO channels (channel) VALUES (?)", (str(channel),))
+        for channel, entry in settings.items():
+            conn.execute("INSERT OR REPLACE INTO channel_settings (channel, settings) VALUES (?, ?)",
+                         (channel, json.dumps(entry)))
+        conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)",
+                     (datetime.now(timezone.utc).isoformat(),))
+        conn.execute("COMMIT")
+        
+        for path in (FILTERS_FILE, CHANNELS_FILE, CHANNEL_SETTINGS_FILE):
+            if os.path.exists(path):
+                os.replace(path, path + ".migrated")
+        logger.info("Migrated %d filters, %d channels and %d channel settings into %s",
+                    len(filters_list), len(channels), len(settings), self.path)
+
+state_store = StateStore(STATE_DB)
+
+# Metrics
+# Upper bounds in seconds for latency histograms, from 50 µs to 10 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    """Fixed-bucket latency histogram, cheap enough to update for every message."""
+
+    __slots__ = ('bounds', 'counts', 'total', 'count')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last bucket is everything above bounds[-1]
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the bucket it falls in."""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / n
+            seen += n
+        return 0.0
+
+def _label(value):
+    """Escape a Prometheus label value."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrics:
+    """
+    Latency histograms per pipeline stage plus message counters.
+
+    Other components keep their own counters (filter counters, the edit
+    dispatcher's stats, the processed-message cache); they are read only when
+    /status or the Prometheus endpoint asks, so the hot path pays for one
+    perf_counter pair and one histogram update per stage.
+    """
+
+    STAGES = {
+        'message': "Whole channel post handler",
+        'channel_lookup': "Monitored-channel check",
+        'pipeline': "Text pipeline including executor overhead",
+        'filters': "All text filters for one text",
+        'time_conversion': "Timestamp conversion for one text",
+        'edit_api': "One edit or reply API call",
+    }
+
+    def __init__(self):
+        self.histograms = {stage: Histogram() for stage in self.STAGES}
+        self.messages = collections.Counter()
+
+    def observe(self, stage, seconds):
+        self.histograms[stage].observe(seconds)
+
+    def report(self):
+        """Return a formatted summary of the stage timings for /status."""
+        lines = []
+        for stage, histogram in self.histograms.items():
+            if histogram.count:
+                lines.append(f"{stage}: {histogram.count} × p50 {histogram.quantile(0.5) * 1000:.2f} ms, "
+                             f"p99 {histogram.quantile(0.99) * 1000:.2f} ms")
+        counts = ", ".join(f"{name} {count}" for name, count in sorted(self.messages.items()))
+        edits = ", ".join(f"{name} {count}" for name, count in sorted(edit_dispatcher.stats.items()))
+        lines.append(f"Messages: {counts or 'none yet'}")
+        lines.append(f"Edits: {edits or 'none yet'} ({edit_dispatcher.queued()} queued)")
+        if edit_dispatcher.outbox is not None:
+            lines.append(f"Outbox: {edit_dispatcher.outbox.report()}")
+        # /status is sent as Markdown, where underscores start italics
+        return "\n".join(lines).replace('_', ' ')
+
+    def render_prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        out = [
+            "# HELP bot_stage_seconds Latency of each pipeline stage.",
+            "# TYPE bot_stage_seconds histogram",
+        ]
+        for stage, histogram in self.histograms.items():
+            cumulative = 0
+            for bound, n in zip(histogram.bounds, histogram.counts):
+                cumulative += n
+                out.append(f'bot_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            out.append(f'bot_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            out.append(f'bot_stage_seconds_sum{{stage="{stage}"}} {histogram.total}')
+            out.append(f'bot_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        
+        out += ["# HELP bot_messages_total Channel posts by outcome.", "# TYPE bot_messages_total counter"]
+        out += [f'bot_messages_total{{outcome="{name}"}} {count}' for name, count in self.messages.items()]
+        
+        out += ["# HELP bot_edit_events_total Edit dispatcher events (sent, failed, fallback_replies, "
+                "flood_waits, not_modified).", "# TYPE bot_edit_events_total counter"]
+        out += [f'bot_edit_events_total{{event="{name}"}} {count}' for name, count in edit_dispatcher.stats.items()]
+        out += ["# HELP bot_edit_queue_depth Edits waiting to be sent.", "# TYPE bot_edit_queue_depth gauge",
+                f"bot_edit_queue_depth {edit_dispatcher.queued()}"]
+        
+        out += ["# HELP bot_processed_cache_total Idempotency cache lookups and updates.",
+                "# TYPE bot_processed_cache_total counter"]
+        out += [f'bot_processed_cache_total{{event="{name}"}} {count}' for name, count in processed_cache.stats.items()]
+        
+        filter_engine.compiled_steps()
+        stats = [(_label(pattern), totals) for pattern, totals in filter_engine.pattern_stats().items()]
+        out += ["# HELP bot_filter_checks_total Filter checks by outcome.", "# TYPE bot_filter_checks_total counter"]
+        for label, (checks, evaluated, matched, _) in stats:
+            for outcome, count in (('skipped', checks - evaluated), ('evaluated', evaluated), ('matched', matched)):
+                out.append(f'bot_filter_checks_total{{pattern="{label}",outcome="{outcome}"}} {count}')
+        out += ["# HELP bot_filter_seconds_total CPU time spent in each filter.",
+                "# TYPE bot_filter_seconds_total counter"]
+        out += [f'bot_filter_seconds_total{{pattern="{label}"}} {seconds}' for label, (*_, seconds) in stats]
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+metrics_server = None
+
+async def _serve_metrics(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split('?')[0] == "/metrics":
+            status, body = "200 OK", metrics.render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, UnicodeDecodeError):
+        pass
+    finally:
+        writer.close()
+
+async def start_metrics_server(port=None, listen=None):
+    """Serve /metrics for Prometheus on the running event loop, if METRICS_PORT is set."""
+    global metrics_server
+    port = METRICS_PORT if port is None else port
+    if not port or metrics_server is not None:
+        return metrics_server
+    metrics_server = await asyncio.start_server(_serve_metrics, listen or METRICS_LISTEN, port)
+    logger.info("Metrics endpoint on http://%s:%d/metrics", listen or METRICS_LISTEN, port)
+    return metrics_server
+
+async def stop_metrics_server():
+    global metrics_server
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+        metrics_server = None
 
 # Filter Manager Functions
-def load_filters():
-    """Load user-defined filters from the JSON file."""
-    if not os.path.exists(FILTERS_FILE):
-        save_filters([])
+# A user filter is stored as [pattern, replacement] or
+# [pattern, replacement, options], where options is a dict such as
+# {"hints": ["urgent"]} declaring literals one of which must be present
+# for the pattern to match.
+#
+# Every user filter belongs to a scope: '' (global, every channel),
+# 'group:<name>' (the channels in a channel group) or 'channel:<key>' (one
+# channel, keyed by channel_key()). A channel gets the global filters
+# first, then its group's, then its own. The 'shadow' scope holds candidate
+# filters that run after them on every post without editing anything.
+SHADOW_SCOPE = 'shadow'
+
+def filter_fields(entry):
+    """Split a stored filter into (pattern, replacement, options)."""
+    options = entry[2] if len(entry) > 2 and isinstance(entry[2], dict) else {}
+    return entry[0], entry[1], options
+
+def group_scope(name):
+    """Scope of the filters for a channel group."""
+    return f"group:{name.lower()}"
+
+def channel_scope(channel_id):
+    """Scope of the filters for a single channel."""
+    return f"channel:{channel_key(channel_id)}"
+
+def describe_scope(scope):
+    """Human readable name of a filter scope."""
+    if not scope:
+        return "global"
+    if scope == SHADOW_SCOPE:
+        return "the shadow set"
+    kind, _, name = scope.partition(':')
+    return f"{kind} {name}"
+
+def _filter_entry(pattern, replacement, options):
+    return [pattern, replacement, json.loads(options)] if options else [pattern, replacement]
+
+def load_filters(scope=''):
+    """Load the user-defined filters of one scope from the state database, in order."""
+    try:
+        rows = state_store.query("SELECT pattern, replacement, options FROM filters WHERE scope = ? ORDER BY id",
+                                 (scope,))
+    except Exception as e:
+        logger.error("Error loading filters: %s", e)
         return []
     
+    return [_filter_entry(*row) for row in rows]
+
+def load_scoped_filters():
+    """Load every user-defined filter as {scope: filters in order}."""
     try:
-        with open(FILTERS_FILE, 'r') as f:
-            filters = json.load(f)
-            return filters
+        rows = state_store.query("SELECT scope, pattern, replacement, options FROM filters ORDER BY id")
     except Exception as e:
-        logger.error(f"Error loading filters: {e}")
-        return []
+        logger.error("Error loading filters: %s", e)
+        return {}
+    
+    scoped = {}
+    for scope, pattern, replacement, options in rows:
+        scoped.setdefault(scope, []).append(_filter_entry(pattern, replacement, options))
+    return scoped
 
-def save_filters(filters_list):
-    """Save filters to the JSON file."""
+def save_filters(filters_list, scope=''):
+    """Replace all user filters of a scope in one transaction."""
     try:
-        with open(FILTERS_FILE, 'w') as f:
-            json.dump(filters_list, f, indent=2)
+        with state_store.transaction() as conn:
+            conn.execute("DELETE FROM filters WHERE scope = ?", (scope,))
+            for entry in filters_list:
+                pattern, replacement, options = filter_fields(entry)
+                conn.execute(
+                    "INSERT OR REPLACE INTO filters (scope, pattern, replacement, options) VALUES (?, ?, ?, ?)",
+                    (scope, pattern, replacement, json.dumps(options) if options else None)
+                )
+        filter_engine.invalidate()
         return True
     except Exception as e:
-        logger.error(f"Error saving filters: {e}")
+        logger.error("Error saving filters: %s", e)
         return False
 
-def add_filter(pattern, replacement):
-    """Add a new filter pattern and replacement."""
-    filters = load_filters()
+def add_filter(pattern, replacement, scope=''):
+    """Add a new filter pattern and replacement to a scope (global by default)."""
+    try:
+        # Update the replacement of an existing pattern in place, keeping its position
+        state_store.execute(
+            "INSERT INTO filters (scope, pattern, replacement) VALUES (?, ?, ?) "
+            "ON CONFLICT(scope, pattern) DO UPDATE SET replacement = excluded.replacement",
+            (scope, pattern, replacement)
+        )
+    except Exception as e:
+        logger.error("Error saving filter: %s", e)
+        return False
+    
+    # Adding a pattern again re-enables it if it had been disabled
+    try:
+        _update_filter_options(pattern, lambda options: [options.pop(key, None) for key in ('disabled', 'disabled_reason')],
+                               scope)
+    except Exception as e:
+        logger.error("Error re-enabling filter '%s': %s", pattern, e)
     
-    # Check if filter already exists with same pattern
-    for i, (p, _) in enumerate(filters):
-        if p == pattern:
-            # Update replacement for existing pattern
-            filters[i] = (pattern, replacement)
-            return save_filters(filters)
+    filter_engine.invalidate()
+    return True
+
+def _update_filter_options(pattern, update, scope=None):
+    """Apply update(options) to the options dict of a stored filter, in one scope or all of them."""
+    with state_store.transaction() as conn:
+        if scope is None:
+            rows = conn.execute("SELECT id, options FROM filters WHERE pattern = ?", (pattern,)).fetchall()
+        else:
+            rows = conn.execute("SELECT id, options FROM filters WHERE scope = ? AND pattern = ?",
+                                (scope, pattern)).fetchall()
+        for row_id, stored in rows:
+            options = json.loads(stored) if stored else {}
+            update(options)
+            conn.execute("UPDATE filters SET options = ? WHERE id = ?",
+                         (json.dumps(options) if options else None, row_id))
+    return bool(rows)
+
+def budget_reason(budget_ms):
+    """Reason recorded for filters disabled by the per-filter time budget."""
+    return f"exceeded {budget_ms:.0f} ms CPU budget on {FILTER_BUDGET_STRIKES} posts in a row"
+
+def disable_filters(patterns, reason):
+    """Mark user filters as disabled, in every scope, so the engine skips them."""
+    disabled = []
+    for pattern in patterns:
+        try:
+            if _update_filter_options(pattern, lambda options: options.update(disabled=True, disabled_reason=reason)):
+                disabled.append(pattern)
+        except Exception as e:
+            logger.error("Error disabling filter '%s': %s", pattern, e)
     
-    # Add new filter
-    filters.append((pattern, replacement))
-    return save_filters(filters)
+    if disabled:
+        filter_engine.invalidate()
+        logger.warning("Disabled filters %s: %s", disabled, reason)
+    return disabled
 
-def remove_filter(pattern):
-    """Remove a filter by its pattern."""
-    filters = load_filters()
-    initial_count = len(filters)
+def remove_filter(pattern, scope=''):
+    """Remove a filter by its pattern from a scope (global by default)."""
+    try:
+        removed = state_store.execute("DELETE FROM filters WHERE scope = ? AND pattern = ?", (scope, pattern))
+    except Exception as e:
+        logger.error("Error removing filter: %s", e)
+        return False
     
-    filters = [f for f in filters if f[0] != pattern]
+    if removed:
+        filter_engine.invalidate()
+    return removed > 0
+
+def promote_shadow_filters():
+    """Move the shadow filters into the global scope, after the filters already there; returns how many."""
+    try:
+        with state_store.transaction() as conn:
+            rows = conn.execute("SELECT pattern, replacement, options FROM filters WHERE scope = ? ORDER BY id",
+                                (SHADOW_SCOPE,)).fetchall()
+            conn.execute("DELETE FROM filters WHERE scope = ?", (SHADOW_SCOPE,))
+            # A pattern that is already global takes the candidate's replacement and moves to the end
+            conn.executemany("DELETE FROM filters WHERE scope = '' AND pattern = ?", [(row[0],) for row in rows])
+            conn.executemany("INSERT INTO filters (scope, pattern, replacement, options) VALUES ('', ?, ?, ?)", rows)
+    except Exception as e:
+        logger.error("Error promoting shadow filters: %s", e)
+        return None
     
-    if len(filters) < initial_count:
-        return save_filters(filters)
+    filter_engine.invalidate()
+    logger.info("Promoted %d shadow filters to the global scope", len(rows))
+    return len(rows)
+
+def clear_shadow_filters():
+    """Drop every shadow filter; returns how many there were."""
+    try:
+        removed = state_store.execute("DELETE FROM filters WHERE scope = ?", (SHADOW_SCOPE,))
+    except Exception as e:
+        logger.error("Error removing shadow filters: %s", e)
+        return None
     
-    return False
+    filter_engine.invalidate()
+    return removed
 
 def list_filters():
     """Return a formatted list of all filters."""
     # Static filters from config
     static_filters = STATIC_FILTERS
-    logger.info(f"Static filters from config: {static_filters}")
+    logger.info("Static filters from config: %s", static_filters)
     
-    # User-defined filters from JSON
-    user_filters = load_filters()
-    logger.info(f"Dynamic filters from user_filters.json: {user_filters}")
+    # User-defined filters from the state database, by scope
+    scoped = load_scoped_filters()
+    user_filters = scoped.pop('', [])
+    logger.debug("Dynamic filters from %s: %s", STATE_DB, user_filters)
     
     # Combine both lists for display
     all_filters = static_filters + user_filters
-    logger.info(f"Total filters: {len(all_filters)}")
+    logger.info("Total filters: %d global, %d in %d other scopes",
+                len(all_filters), sum(map(len, scoped.values())), len(scoped))
     
-    if not all_filters:
+    if not all_filters and not scoped:
         return "No text filters configured."
     
     result = "📋 *Text Filters:*\n\n"
@@ -143,10 +734,16 @@ def list_filters():
     for i, (pattern, replacement) in enumerate(static_filters, 1):
         result += f"{i}. `{pattern}` → `{replacement}`\n"
     
-    if user_filters:
-        result += "\n*User-defined filters:*\n"
-        for i, (pattern, replacement) in enumerate(user_filters, 1):
-            result += f"{i}. `{pattern}` → `{replacement}`\n"
+    sections = [("User-defined filters", user_filters)] if user_filters else []
+    sections += [(f"Filters for {describe_scope(scope)}", entries) for scope, entries in sorted(scoped.items())]
+    for title, entries in sections:
+        result += f"\n*{title}:*\n"
+        for i, entry in enumerate(entries, 1):
+            pattern, replacement, options = filter_fields(entry)
+            result += f"{i}. `{pattern}` → `{replacement}`"
+            if options.get('disabled'):
+                result += f" (disabled: {options.get('disabled_reason', 'unknown')})"
+            result += "\n"
     
     return result
 
@@ -173,12 +770,9 @@ def test_filter(text, pattern):
                     result += f"{i}. `{match}`\n"
             
             # Show the text with the pattern applied/replaced
-            try:
-                replaced_text = regex.sub(r'*\1*', text)
-                result += f"\n*With matches highlighted:*\n{replaced_text}"
-            except:
-                # In case of complex patterns where replacement fails
-                pass
+            # The whole match, so this works with and without groups; empty matches stay empty
+            replaced_text = regex.sub(lambda m: f"*{m.group()}*" if m.group() else m.group(), text)
+            result += f"\n*With matches highlighted:*\n{replaced_text}"
         else:
             result += "*No matches found*"
         
@@ -194,180 +788,2405 @@ def get_all_filters():
     user_filters = load_filters()
     return static_filters + user_filters
 
-# Utility Functions
-def apply_text_filters(text):
-    """Apply text filters to the message text"""
-    filters = get_all_filters()
-    logger.info(f"Got {len(filters)} filters to apply")
-    logger.info(f"Original text: {text}")
-    
-    modified_text = text
-    
-    # Apply each filter pattern
-    for pattern, replacement in filters:
-        logger.info(f"Applying filter: pattern='{pattern}', replacement='{replacement}'")
-        
-        try:
-            text_before = modified_text
-            modified_text = re.sub(pattern, replacement, modified_text)
-            
-            if modified_text != text_before:
-                logger.info(f"Text changed: '{text_before}' -> '{modified_text}'")
-        except Exception as e:
-            logger.error(f"Error applying filter pattern '{pattern}': {e}")
-    
-    logger.info(f"Final modified text: {modified_text}")
-    return modified_text
+# Filter Compiler
+# Regex metacharacters that make a pattern more than a plain literal
+REGEX_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+WORD_CHAR = re.compile(r'\w')
 
-def convert_timezone(text):
+def _is_word_char(ch):
+    return bool(WORD_CHAR.match(ch))
+
+def parse_literal_filter(pattern):
     """
-    Find time stamps in the text and simply add 3:30 hours
+    Return (literal, ignore_case, word_bounded) when the pattern is a plain
+    literal such as '@Gazew_07' or '(?i)\\b(urgent)\\b', otherwise None.
     """
-    logger.info(f"Finding times to add 3:30 hours in: {text}")
+    body = pattern
+    ignore_case = body.startswith('(?i)')
+    if ignore_case:
+        body = body[4:]
     
-    # Find times with this regex pattern - matches 00:00 or 00:00:00 format
-    time_pattern = r'(\d{2}:\d{2}(:\d{2})?)'
+    word_bounded = body.startswith(r'\b') and body.endswith(r'\b') and len(body) > 4 and body[-3] != '\\'
+    if word_bounded:
+        body = body[2:-2]
     
-    # Modified text will be our result
-    modified_text = text
+    # A single plain capture group around the literal, e.g. (urgent)
+    if body.startswith('(') and body.endswith(')') and not body.startswith('(?'):
+        body = body[1:-1]
     
-    # Find all time matches
-    time_matches = re.findall(time_pattern, text)
-    for match in time_matches:
-        time_str = match[0]  # Get the full time string
-        
-        try:
-            # Split into parts
-            parts = time_str.split(':')
-            hours = int(parts[0])
-            minutes = int(parts[1])
-            has_seconds = len(parts) > 2
-            seconds = int(parts[2]) if has_seconds else 0
-            
-            # Add 3 hours and 30 minutes
-            minutes += 30
-            if minutes >= 60:
-                hours += 1
-                minutes -= 60
-                
-            hours += 3
-            if hours >= 24:
-                hours -= 24
-                
-            # Format the new time string
-            if has_seconds:
-                new_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-            else:
-                new_time = f"{hours:02d}:{minutes:02d}"
-                
-            logger.info(f"Changed time: {time_str} -> {new_time}")
-            
-            # Replace in the text
-            modified_text = modified_text.replace(time_str, new_time)
-            
-        except Exception as e:
-            logger.error(f"Error processing time {time_str}: {e}")
+    literal = []
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch == '\\':
+            # Escaped punctuation is literal; \d, \1, \n and friends are not
+            if i + 1 >= len(body) or body[i + 1].isalnum():
+                return None
+            literal.append(body[i + 1])
+            i += 2
+            continue
+        if ch in REGEX_SPECIAL_CHARS:
+            return None
+        literal.append(ch)
+        i += 1
+    
+    literal = ''.join(literal)
+    if not literal:
+        return None
+    if word_bounded and not (_is_word_char(literal[0]) and _is_word_char(literal[-1])):
+        return None
+    return literal, ignore_case, word_bounded
+
+def _suffix_is_prefix(a, b):
+    """True if some proper suffix of a is a prefix of b."""
+    start = a.find(b[0], 1)
+    while start != -1:
+        if b.startswith(a[start:]):
+            return True
+        start = a.find(b[0], start + 1)
+    return False
+
+def _strings_interact(a, b):
+    """True if a match of one string can overlap or touch a match of the other."""
+    if not a or not b or a in b or b in a:
+        return True
+    return _suffix_is_prefix(a, b) or _suffix_is_prefix(b, a)
+
+def _preserves_edges(literal, replacement):
+    """True if the replacement keeps the word/non-word kind of the literal's edges."""
+    return bool(replacement) and (
+        _is_word_char(literal[0]) == _is_word_char(replacement[0])
+        and _is_word_char(literal[-1]) == _is_word_char(replacement[-1])
+    )
+
+def _trie_regex(words):
+    """Build a regex source matching any of the words, factored as a trie."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = True
+    
+    def emit(node):
+        alternatives = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not alternatives:
+            return ''
+        body = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        if '' in node:
+            body = '(?:' + body + ')?'
+        return body
     
-    return modified_text
+    return emit(trie)
+
+# Characters that re's IGNORECASE treats as equal although lower() differs
+_CASE_FIXES = getattr(sre_compile, '_EXTRA_CASES', None) or getattr(sre_compile, '_ignorecase_fixes', {})
+FOLD_TABLE = {code: chr(min((code,) + others)) for code, others in _CASE_FIXES.items()}
+
+try:
+    from _sre import unicode_tolower as _simple_lower
+except ImportError:
+    def _simple_lower(code):
+        lowered = chr(code).lower()
+        return ord(lowered) if len(lowered) == 1 else code
 
-def process_message_text(text):
+def fold_text(text):
     """
-    Process a message text by applying text filters and timezone conversion
+    Normalise text for literal hint checks. Characters are folded one at a
+    time with the simple case mapping re's IGNORECASE uses, so the result
+    keeps the length of the text.
     """
-    # First apply text replacements
-    filtered_text = apply_text_filters(text)
+    folded = text.lower()
+    if len(folded) != len(text):
+        # Full case mapping expands characters such as 'İ' to two code points
+        folded = ''.join(chr(_simple_lower(ord(ch))) for ch in text)
+    return folded.translate(FOLD_TABLE)
+
+def _exact_literal(items):
+    """Return the string matched by a sequence of plain literals, or None."""
+    chars = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            chars.append(chr(av))
+        elif op is sre_constants.AT:
+            continue
+        elif op is sre_constants.SUBPATTERN:
+            inner = _exact_literal(av[-1])
+            if inner is None:
+                return None
+            chars.append(inner)
+        else:
+            return None
+    return ''.join(chars)
+
+def _required_literals(items):
+    """
+    Return a set of strings at least one of which occurs in every match of
+    the parsed sequence, or None when no such set can be derived.
+    """
+    candidates = []
+    run = []
     
-    # Then convert timestamps
-    result = convert_timezone(filtered_text)
+    def flush():
+        if run:
+            candidates.append(frozenset([''.join(run)]))
+            run.clear()
     
-    return result
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+        elif op is sre_constants.AT:
+            # Zero-width anchors such as \b do not break a literal run
+            continue
+        elif op is sre_constants.SUBPATTERN:
+            inner = _exact_literal(av[-1])
+            if inner is not None:
+                run.append(inner)
+                continue
+            flush()
+            sub = _required_literals(av[-1])
+            if sub:
+                candidates.append(sub)
+        elif op is sre_constants.BRANCH:
+            flush()
+            branches = [_required_literals(branch) for branch in av[1]]
+            if all(branches):
+                candidates.append(frozenset().union(*branches))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, 'POSSESSIVE_REPEAT', None)) and av[0] >= 1:
+            flush()
+            sub = _required_literals(av[2])
+            if sub:
+                candidates.append(sub)
+        else:
+            flush()
+    flush()
+    
+    if not candidates:
+        return None
+    # Prefer the most selective set: longest shortest-string, then fewest strings
+    return max(candidates, key=lambda c: (min(len(x) for x in c), -len(c)))
 
-# Channel Management Functions
-def load_channels():
-    """Load the list of channels to monitor from a JSON file."""
-    if not os.path.exists(CHANNELS_FILE):
-        # Create empty list with default channel from env var
-        channels = []
-        channel_id = os.environ.get("CHANNEL_ID")
-        if channel_id:
-            channels.append(channel_id)
-        save_channels(channels)
-        return channels
+def literal_hints(pattern, options=None):
+    """
+    Literal hints for a filter: declared in its options or derived from the
+    pattern. Returns a frozenset of folded strings, or None to always evaluate.
+    """
+    declared = (options or {}).get('hints')
+    if declared:
+        return frozenset(fold_text(hint) for hint in declared)
     
     try:
-        with open(CHANNELS_FILE, 'r') as f:
-            channels = json.load(f)
-            return channels
-    except Exception as e:
-        logger.error(f"Error loading channels: {e}")
-        return []
+        hints = _required_literals(sre_parse.parse(pattern))
+    except Exception:
+        return None
+    if not hints or not all(hints):
+        return None
+    return frozenset(fold_text(hint) for hint in hints)
 
-def save_channels(channels):
-    """Save the list of channels to monitor to a JSON file."""
-    try:
-        with open(CHANNELS_FILE, 'w') as f:
-            json.dump(channels, f, indent=2)
+class PatternPool:
+    """
+    Interned compiled regexes shared by every filter pipeline.
+
+    A pattern used in several scopes, or in the pipelines of many channels,
+    is compiled and analysed for hints once. Entries are held weakly and
+    disappear when no compiled step uses them any more.
+    """
+
+    def __init__(self):
+        self._regexes = weakref.WeakValueDictionary()  # (source, flags) -> compiled regex
+        self._hints = weakref.WeakKeyDictionary()  # compiled regex -> derived literal hints
+
+    def __len__(self):
+        return len(self._regexes)
+
+    def compile(self, source, flags=0):
+        regex = self._regexes.get((source, flags))
+        if regex is None:
+            regex = self._regexes[(source, flags)] = re.compile(source, flags)
+        return regex
+
+    def hints(self, regex, options=None):
+        """literal_hints() of a pooled regex; derived hints are computed once per pattern."""
+        if (options or {}).get('hints'):
+            return literal_hints(regex.pattern, options)
+        hints = self._hints.get(regex, False)
+        if hints is False:
+            hints = self._hints[regex] = literal_hints(regex.pattern)
+        return hints
+
+pattern_pool = PatternPool()
+
+class FilterCounters:
+    """How often a filter was skipped by its hints, evaluated and matched, and its time spent."""
+
+    __slots__ = ('skipped', 'evaluated', 'matched', 'seconds')
+
+    def __init__(self):
+        self.skipped = 0
+        self.evaluated = 0
+        self.matched = 0
+        self.seconds = 0.0
+
+class RegexStep:
+    """
+    A filter that really is a regex: one re.sub pass of its own.
+
+    When hints is set the engine skips the step unless one of the hint
+    strings occurs in the folded text.
+    """
+
+    def __init__(self, pattern, regex, replacement, hints, counters):
+        self.pattern = pattern
+        self.regex = regex
+        self.replacement = replacement
+        self.hints = hints
+        self.counters = counters
+        self.patterns = [pattern]
+        self.strikes = 0  # Consecutive runs over the time budget
+
+    def add_time(self, seconds):
+        self.counters.seconds += seconds
+
+    def apply(self, text, edits=None):
+        self.counters.evaluated += 1
+        if edits is None:
+            result, count = self.regex.subn(self.replacement, text)
+        else:
+            def replace(match):
+                new = match.expand(self.replacement)
+                edits.append((match.start(), match.end(), len(new)))
+                return new
+            result, count = self.regex.subn(replace, text)
+        if count:
+            self.counters.matched += 1
+        return result
+
+class LiteralGroupStep:
+    """
+    Consecutive literal filters applied in a single pass.
+
+    Members share the same flags and are pairwise independent: no member's
+    pattern overlaps another's, and no replacement can create or break a match
+    for a later member. Applying them together therefore gives exactly the
+    same result as applying them one after another.
+    """
+
+    hints = None  # The single scan is already as cheap as a hint check
+    strikes = 0  # Literal groups are never disabled for being slow
+
+    def __init__(self, ignore_case, word_bounded):
+        self.ignore_case = ignore_case
+        self.word_bounded = word_bounded
+        self.patterns = []
+        self.literals = []
+        self.replacements = {}
+        self.counters = {}
+        self._members = []
+        self._scans = 0
+        self._seconds = 0.0
+        self.regex = None
+
+    def _key(self, value):
+        return fold_text(value) if self.ignore_case else value
+
+    def accepts(self, literal, replacement):
+        """Check whether a filter can join the group without changing results."""
+        if self._key(literal) in self.replacements:
+            return False
+        if self.word_bounded and not _preserves_edges(literal, replacement):
+            return False
+        
+        # Compare case-insensitively so the check stays conservative
+        folded_literal = fold_text(literal)
+        for other_literal, other_replacement in self._members:
+            if _strings_interact(folded_literal, other_literal):
+                return False
+            if _strings_interact(folded_literal, other_replacement):
+                return False
         return True
-    except Exception as e:
-        logger.error(f"Error saving channels: {e}")
-        return False
 
-def add_channel(channel_id):
-    """Add a channel to the list of monitored channels."""
-    channels = load_channels()
+    def commutes_with(self, literal, replacement, word_bounded):
+        """Check whether a later literal filter may be applied before this group."""
+        if self.word_bounded and not _preserves_edges(literal, replacement):
+            return False
+        
+        folded_literal = fold_text(literal)
+        folded_replacement = fold_text(replacement)
+        for other_literal, other_replacement in self._members:
+            if word_bounded and not _preserves_edges(other_literal, other_replacement):
+                return False
+            if (_strings_interact(folded_literal, other_literal)
+                    or _strings_interact(folded_literal, other_replacement)
+                    or _strings_interact(other_literal, folded_replacement)):
+                return False
+        return True
+
+    def add(self, pattern, literal, replacement, counters):
+        self.patterns.append(pattern)
+        self.literals.append(literal)
+        self.replacements[self._key(literal)] = replacement
+        self.counters[self._key(literal)] = counters
+        self._members.append((fold_text(literal), fold_text(replacement)))
+
+    def build(self):
+        source = _trie_regex(sorted(set(self._key(literal) for literal in self.literals)))
+        if self.word_bounded:
+            source = r'\b' + source + r'\b'
+        self.regex = pattern_pool.compile(source, re.IGNORECASE if self.ignore_case else 0)
+
+    def add_time(self, seconds):
+        self._seconds += seconds
+
+    def flush_counters(self):
+        """Credit pending group scans, and an even share of their time, to every member."""
+        scans, self._scans = self._scans, 0
+        seconds, self._seconds = self._seconds, 0.0
+        if scans:
+            share = seconds / len(self.counters)
+            for counters in self.counters.values():
+                counters.evaluated += scans
+                counters.seconds += share
+
+    def apply(self, text, edits=None):
+        hits = set()
+        
+        def replace(match):
+            key = self._key(match.group())
+            hits.add(key)
+            if edits is not None:
+                edits.append((match.start(), match.end(), len(self.replacements[key])))
+            return self.replacements[key]
+        
+        self._scans += 1
+        result = self.regex.sub(replace, text)
+        for key in hits:
+            self.counters[key].matched += 1
+        return result
+
+class ColdRun:
+    """
+    Cold hinted filter steps checked with one combined scan for their hints.
+
+    A hinted step is skipped unless one of its hints occurs in the folded
+    text, so when the scan finds none of the run's hints every member can be
+    skipped at once. Members need not be adjacent: steps between them run as
+    usual, and once the text changes the remaining members are checked one
+    by one again. Filters are never reordered, so results do not change.
+    """
+
+    def __init__(self, members):
+        self.members = members  # [(step index, step)]
+        self.indices = frozenset(index for index, _ in members)
+        hints = set().union(*(step.hints for _, step in members))
+        self.regex = pattern_pool.compile(_trie_regex(sorted(hints)))
+        self.skips = 0
+
+    def uncount_after(self, index):
+        """Take back the pending skip of members after index; they get checked one by one."""
+        for member_index, step in self.members:
+            if member_index > index:
+                step.counters.skipped -= 1
+
+    def flush_counters(self):
+        """Credit pending run skips to every member."""
+        skips, self.skips = self.skips, 0
+        if skips:
+            for _, step in self.members:
+                step.counters.skipped += skips
+
+def compile_filters(filters_list, counters=None):
+    """
+    Compile stored filters into an ordered list of steps.
+
+    Plain literals are merged into LiteralGroupSteps that scan the text once;
+    everything else becomes a RegexStep. A literal may join an earlier group
+    only when it commutes with every group it moves ahead of, and never across
+    a RegexStep, so the result is the same as applying the filters in order.
     
-    # Normalize channel ID format
-    if channel_id.startswith('@'):
-        # Keep @ for usernames
-        normalized_id = channel_id
-    else:
-        # Ensure numeric IDs are strings without @
-        normalized_id = str(channel_id).replace('@', '')
+    counters maps patterns to FilterCounters and is filled in for new
+    patterns, so counts survive a recompile.
+    """
+    if counters is None:
+        counters = {}
+    steps = []
+    open_groups = []  # Literal groups since the last RegexStep
     
-    # Check if channel already exists
-    if normalized_id in channels:
-        return False, "Channel already in monitoring list."
+    for entry in filters_list:
+        pattern, replacement, options = filter_fields(entry)
+        if options.get('disabled'):
+            continue
+        try:
+            regex = pattern_pool.compile(pattern)
+        except re.error as e:
+            logger.error("Error compiling filter pattern '%s': %s", pattern, e)
+            continue
+        
+        parsed = parse_literal_filter(pattern) if '\\' not in replacement else None
+        if parsed is None:
+            open_groups = []
+            steps.append(RegexStep(pattern, regex, replacement, pattern_pool.hints(regex, options),
+                                   counters.setdefault(pattern, FilterCounters())))
+            continue
+        
+        literal, ignore_case, word_bounded = parsed
+        target = None
+        for group in reversed(open_groups):
+            if (group.ignore_case, group.word_bounded) == (ignore_case, word_bounded):
+                if group.accepts(literal, replacement):
+                    target = group
+                break
+            if not group.commutes_with(literal, replacement, word_bounded):
+                break
+        
+        if target is None:
+            target = LiteralGroupStep(ignore_case, word_bounded)
+            steps.append(target)
+            open_groups.append(target)
+        target.add(pattern, literal, replacement, counters.setdefault(pattern, FilterCounters()))
     
-    channels.append(normalized_id)
-    if save_channels(channels):
-        return True, f"Channel {normalized_id} added to monitoring list."
-    else:
-        return False, "Failed to save channel."
+    for step in steps:
+        if isinstance(step, LiteralGroupStep):
+            step.build()
+    
+    return steps
+
+# Filter Engine
+class FilterSegment:
+    """The compiled filter steps, and their cold runs, of one scope."""
+
+    def __init__(self, scope, entries, steps):
+        self.scope = scope
+        self.entries = entries
+        self.steps = steps
+        self.runs = {}  # Index of a run's first member -> ColdRun
+        self.planned = None  # Snapshot the runs were grouped for
+
+class FilterPipeline:
+    """A chain of scopes: the compiled segments of its scopes, applied in order."""
+
+    def __init__(self, scopes, segments):
+        self.scopes = scopes
+        self.segments = segments
+        self.entries = [entry for segment in segments for entry in segment.entries]
+        self.steps = [step for segment in segments for step in segment.steps]
+
+class FilterEngine:
+    """
+    Keeps STATIC_FILTERS plus the user filters as compiled filter pipelines.
+
+    Filters belong to scopes (see channel_scope and group_scope); a channel
+    gets the global filters, then those of its channel group, then its own.
+    Each scope is compiled once, on first use, into a FilterSegment, and the
+    pipeline of a chain of scopes just strings their segments together, so
+    a channel's pipeline never recompiles the global filters. The filters
+    are reloaded only when add_filter/remove_filter invalidate them or when
+    another process changes them, and only the segments of the scopes that
+    changed are recompiled, so the hot path never loads filters or
+    recompiles a pattern. Without a store the engine compiles only the
+    filters it was given (used by pool workers).
+
+    Every FILTER_STATS_WINDOW / FILTER_STATS_SLOTS messages the counters are
+    snapshotted, so differences against the oldest snapshot give per-filter
+    counts over a sliding window. Hinted filters whose hints occurred in
+    fewer than COLD_FILTER_RATE of those messages are grouped into ColdRuns
+    per segment; replan() regroups them between messages, never apply().
+    """
+
+    def __init__(self, static_filters, store, time_budget_ms=FILTER_TIME_BUDGET_MS, scoped=None):
+        self.static_filters = static_filters
+        self.store = store
+        self.time_budget = time_budget_ms / 1000
+        self.version = 0
+        self.scoped = {}  # scope -> entries; the global scope '' starts with the static filters
+        self.counters = {}
+        self.slow_patterns = []
+        self.messages = 0
+        self._given_scopes = scoped or {}
+        self._slot_size = max(1, FILTER_STATS_WINDOW // FILTER_STATS_SLOTS)
+        self._next_slot = self._slot_size
+        self._snapshots = collections.deque([(0, {})], maxlen=FILTER_STATS_SLOTS)  # (messages, totals)
+        self._segments = {}  # scope -> FilterSegment
+        self._pipelines = {}  # Chain of scopes -> FilterPipeline
+        self._chat_scopes = {}  # chat id -> chain of scopes
+        self._snapshot_id = 0  # Bumped by every counter snapshot
+        self._plan_window = None  # Window cold filters are grouped by, for _snapshot_id
+        self._filters_version = None
+        self._dirty = True
+
+    def invalidate(self):
+        """Force a reload of the filters the next time they are used."""
+        self._dirty = True
+
+    def _store_version(self):
+        if self.store is None:
+            return self._filters_version
+        try:
+            return self.store.filters_version()
+        except Exception:
+            return self._filters_version
+
+    def _flush_counters(self):
+        for segment in self._segments.values():
+            for step in segment.steps:
+                if isinstance(step, LiteralGroupStep):
+                    step.flush_counters()
+            for run in segment.runs.values():
+                run.flush_counters()
+
+    def _totals(self):
+        """Cumulative (checks, evaluated, matched, seconds) per pattern."""
+        return {pattern: (c.skipped + c.evaluated, c.evaluated, c.matched, c.seconds)
+                for pattern, c in self.counters.items()}
+
+    def _window(self):
+        """Per-pattern (checks, evaluated, matched, seconds) since the oldest snapshot."""
+        self._flush_counters()
+        base = self._snapshots[0][1]
+        window = {}
+        for pattern, totals in self._totals().items():
+            old = base.get(pattern)
+            if old is None or old[0] > totals[0]:
+                # Added, or removed and added again, since the snapshot
+                old = (0, 0, 0, 0.0)
+            window[pattern] = tuple(now - then for now, then in zip(totals, old))
+        return window
+
+    def _rotate(self):
+        """Snapshot the counters for the next slot; replan() regroups the cold filters."""
+        self._flush_counters()
+        self._snapshots.append((self.messages, self._totals()))
+        self._next_slot = self.messages + self._slot_size
+        self._snapshot_id += 1
+        self._plan_window = None
+
+    def _planning_window(self):
+        if self._plan_window is None:
+            self._plan_window = self._window()
+        return self._plan_window
+
+    def replan(self):
+        """
+        Regroup the cold filters of every segment grouped before the latest
+        counter snapshot. Called between messages; returns the segments regrouped.
+        """
+        stale = [segment for segment in self._segments.values() if segment.planned != self._snapshot_id]
+        if stale:
+            window = self._planning_window()
+            for segment in stale:
+                self._plan_runs(segment, window)
+        return len(stale)
+
+    def _plan_runs(self, segment, window):
+        """Group a segment's cold hinted steps into ColdRuns of up to COLD_RUN_SIZE members."""
+        cold = []
+        for index, step in enumerate(segment.steps):
+            if step.hints is None:
+                continue
+            checks, evaluated = window.get(step.pattern, (0, 0))[:2]
+            if not checks or evaluated / checks < COLD_FILTER_RATE:
+                cold.append((index, step))
+        
+        runs = {}
+        for start in range(0, len(cold), COLD_RUN_SIZE):
+            members = cold[start:start + COLD_RUN_SIZE]
+            if len(members) > 1:
+                # Keep an unchanged run, and its pending skips, instead of building it again
+                run = segment.runs.get(members[0][0])
+                runs[members[0][0]] = run if run is not None and run.members == members else ColdRun(members)
+        for start, run in segment.runs.items():
+            if runs.get(start) is not run:
+                run.flush_counters()
+        segment.runs = runs
+        segment.planned = self._snapshot_id
+        logger.debug("Grouped %d cold filters into %d hint scans for %s",
+                     sum(len(run.members) for run in runs.values()), len(runs), describe_scope(segment.scope))
+
+    def _load_scopes(self):
+        scoped = dict(self._given_scopes) if self.store is None else load_scoped_filters()
+        scoped[''] = list(self.static_filters) + scoped.get('', [])
+        return scoped
+
+    def _rebuild(self, filters_version):
+        self._flush_counters()
+        scoped = self._load_scopes()
+        changed = {scope for scope in scoped.keys() | self.scoped.keys()
+                   if scoped.get(scope) != self.scoped.get(scope)}
+        self.scoped = scoped
+        self._segments = {scope: segment for scope, segment in self._segments.items() if scope not in changed}
+        self._pipelines = {scopes: pipeline for scopes, pipeline in self._pipelines.items()
+                           if changed.isdisjoint(scopes)}
+        self._chat_scopes = {}
+        
+        active = {filter_fields(entry)[0] for entries in scoped.values() for entry in entries
+                  if not filter_fields(entry)[2].get('disabled')}
+        self.counters = {pattern: c for pattern, c in self.counters.items() if pattern in active}
+        
+        self._filters_version = filters_version
+        self._dirty = False
+        if changed:
+            self.version += 1
+            logger.info("Loaded filters for %d scopes (version %d)", len(scoped), self.version)
+
+    def _refresh(self):
+        filters_version = self._store_version()
+        if self._dirty or filters_version != self._filters_version:
+            self._rebuild(filters_version)
+
+    def chain_entries(self, scopes=None):
+        """Return the filter entries of a chain of scopes, in the order they apply."""
+        return [entry for scope in scopes or ('',) for entry in self.scoped.get(scope, ())]
+
+    def _segment(self, scope):
+        """Return the compiled segment of one scope, compiling it on first use."""
+        segment = self._segments.get(scope)
+        if segment is None:
+            entries = self.scoped[scope]
+            segment = FilterSegment(scope, entries, compile_filters(entries, self.counters))
+            self._plan_runs(segment, self._planning_window())
+            self._segments[scope] = segment
+            
+            groups = sum(1 for step in segment.steps if isinstance(step, LiteralGroupStep))
+            logger.info("Compiled %d filter steps for %s (%d literal groups, version %d)",
+                        len(segment.steps), describe_scope(scope), groups, self.version)
+        return segment
+
+    def pipeline(self, scopes=None):
+        """Return the pipeline for a chain of scopes, compiling scopes not used before."""
+        self._refresh()
+        scopes = scopes or ('',)
+        pipeline = self._pipelines.get(scopes)
+        if pipeline is None:
+            pipeline = FilterPipeline(scopes, [self._segment(scope) for scope in scopes if scope in self.scoped])
+            self._pipelines[scopes] = pipeline
+        return pipeline
+
+    def compiled_steps(self, scopes=None):
+        """Return the compiled filter steps of a chain of scopes, rebuilding them if stale."""
+        return self.pipeline(scopes).steps
+
+    def scopes_for(self, chat):
+        """Return the chain of scopes whose filters apply to a chat: global, its group, the channel."""
+        self._refresh()
+        scopes = self._chat_scopes.get(chat.id)
+        if scopes is None:
+            names = [chat.id, f"@{chat.username}"] if chat.username else [chat.id]
+            scopes = self._scope_chain(settings_for_chat(chat).get('group'), names)
+            self._chat_scopes[chat.id] = scopes
+        return scopes
+
+    def _scope_chain(self, group, channels):
+        """The scopes with filters among global, the group's and those of the channel's ids/usernames."""
+        candidates = [''] + ([group_scope(group)] if group else []) + [channel_scope(name) for name in channels]
+        return tuple(scope for scope in candidates if scope in self.scoped)
+
+    def prebuild(self, channels):
+        """Compile the pipeline of every monitored channel up front, e.g. at startup."""
+        self._refresh()
+        settings = get_channel_settings()
+        chains = {('',)}
+        for channel in channels:
+            group = settings.get(channel_key(channel), {}).get('group')
+            chains.add(self._scope_chain(group, [channel]))
+        for scopes in chains:
+            self.pipeline(scopes)
+        return len(chains)
+
+    def _over_budget(self, step, elapsed):
+        """Disable user filters that blew the per-filter time budget FILTER_BUDGET_STRIKES times in a row."""
+        # Worker engines get every entry as given, so check the built-in list
+        static_patterns = {entry[0] for entry in STATIC_FILTERS}
+        patterns = [pattern for pattern in step.patterns if pattern not in static_patterns]
+        logger.warning("Filter patterns %s took %.0f ms of CPU time (budget %.0f ms)",
+                       step.patterns, elapsed * 1000, self.time_budget * 1000)
+        if not patterns or not isinstance(step, RegexStep):
+            return
+        
+        step.strikes += 1
+        if step.strikes < FILTER_BUDGET_STRIKES:
+            return
+        if self.store is None:
+            # Pool workers report back; the parent process disables them
+            self.slow_patterns.extend(patterns)
+        else:
+            disable_filters(patterns, budget_reason(self.time_budget * 1000))
+
+    def apply(self, text, progress=None, script=None, scopes=None):
+        """
+        Apply every filter of a chain of scopes (global only by default) to the text in order.
+        
+        progress, if given, is called with each step's index before the step
+        runs, so a supervising process can tell which filter is hanging.
+        script, if given, is an EditScript that records every replacement.
+        """
+        pipeline = self.pipeline(scopes)
+        if self.messages >= self._next_slot:
+            self._rotate()
+        self.messages += 1
+        return self._run(pipeline, text, progress, script)
+
+    def apply_shadow(self, text):
+        """Apply the shadow filters to the live filters' output; not counted as a message."""
+        return self._run(self.pipeline((SHADOW_SCOPE,)), text)
+
+    def pattern_stats(self):
+        """Cumulative (checks, evaluated, matched, seconds) per pattern."""
+        self._flush_counters()
+        return self._totals()
+
+    def has_shadow(self):
+        """Whether there is a shadow filter set to try on live traffic."""
+        return SHADOW_SCOPE in self.scoped
+
+    def _run(self, pipeline, text, progress=None, script=None):
+        """Run the steps of a pipeline over text."""
+        # Checked once per message; per-step traces cost nothing unless DEBUG is on
+        trace = logger.isEnabledFor(logging.DEBUG)
+        if trace:
+            logger.debug("Got %d filter steps to apply", len(pipeline.steps))
+            logger.debug("Original text: %s", text)
+        
+        modified_text = text
+        folded = None  # Folded copy of modified_text for hint checks
+        offset = 0  # Index of the segment's first step in the pipeline
+        
+        for segment in pipeline.segments:
+            runs = segment.runs
+            clear = None  # ColdRun none of whose hints occur in modified_text
+            
+            # Apply each filter step
+            for index, step in enumerate(segment.steps):
+                if step.hints is not None:
+                    if clear is not None and index in clear.indices:
+                        continue
+                    if folded is None:
+                        folded = fold_text(modified_text)
+                    run = runs.get(index)
+                    if run is not None and run.regex.search(folded) is None:
+                        run.skips += 1
+                        clear = run
+                        continue
+                    if not any(hint in folded for hint in step.hints):
+                        step.counters.skipped += 1
+                        continue
+                
+                if trace:
+                    logger.debug("Applying filter step: patterns=%s", step.patterns)
+                if progress is not None:
+                    progress(offset + index)
+                
+                try:
+                    text_before = modified_text
+                    # CPU time of this thread, so a suspended process, GIL waits
+                    # or a GC pause are not blamed on the filter
+                    started = time.thread_time()
+                    modified_text = step.apply(modified_text, script.record() if script is not None else None)
+                    elapsed = time.thread_time() - started
+                    step.add_time(elapsed)
+                    if elapsed > self.time_budget:
+                        self._over_budget(step, elapsed)
+                    elif step.strikes:
+                        step.strikes = 0
+                    
+                    if modified_text != text_before:
+                        folded = None
+                        if clear is not None:
+                            clear.uncount_after(index)
+                            clear = None
+                        if trace:
+                            logger.debug("Text changed: '%s' -> '%s'", text_before, modified_text)
+                except Exception as e:
+                    logger.error("Error applying filter patterns %s: %s", step.patterns, e)
+            offset += len(segment.steps)
+        
+        if trace:
+            logger.debug("Final modified text: %s", modified_text)
+        return modified_text
+
+    def counters_report(self):
+        """Return a formatted summary of the per-filter counters."""
+        self.compiled_steps()
+        self._flush_counters()
+        if not self.counters:
+            return "No filter activity yet."
+        
+        skipped = sum(c.skipped for c in self.counters.values())
+        checked = skipped + sum(c.evaluated for c in self.counters.values())
+        hit_rate = skipped / checked * 100 if checked else 0.0
+        
+        result = f"Prefilter skipped {skipped} of {checked} filter checks ({hit_rate:.1f}%)\n"
+        for pattern, c in self.counters.items():
+            result += (f"`{pattern}`: skipped {c.skipped}, evaluated {c.evaluated}, matched {c.matched}, "
+                       f"{c.seconds * 1000:.1f} ms\n")
+        return result
+
+    def filter_stats_report(self, limit=10):
+        """Return user filters that never matched in the window and the most expensive ones."""
+        self.compiled_steps()
+        window = self._window()
+        messages = self.messages - self._snapshots[0][0]
+        static_patterns = {entry[0] for entry in self.static_filters}
+        user = {pattern: stats for pattern, stats in window.items() if pattern not in static_patterns}
+        if not user:
+            return "No user filters."
+        
+        # Where each pattern lives, so it can be removed with the right command
+        where = collections.defaultdict(list)
+        for scope, entries in self.scoped.items():
+            for entry in entries:
+                if scope:
+                    where[entry[0]].append(describe_scope(scope))
+        
+        runs = [run for segment in self._segments.values() for run in segment.runs.values()]
+        grouped = sum(len(run.members) for run in runs)
+        result = (f"Last {messages} messages, {len(user)} active user filters\n"
+                  f"Compiled pipelines: {len(self._pipelines)} from {len(self._segments)} scopes, "
+                  f"sharing {len(pattern_pool)} compiled patterns\n"
+                  f"Combined hint scans: {len(runs)}, covering {grouped} rarely matching filters\n\n")
+        
+        dead = [(pattern, stats[0]) for pattern, stats in user.items() if stats[0] and not stats[2]]
+        result += f"*Never matched ({len(dead)}):*\n"
+        for pattern, checks in dead[:limit * 3]:
+            scopes = f" in {', '.join(where[pattern])}" if where[pattern] else ""
+            result += f"`{pattern}`{scopes} (checked {checks} times)\n"
+        if len(dead) > limit * 3:
+            result += f"... and {len(dead) - limit * 3} more\n"
+        
+        expensive = sorted((item for item in user.items() if item[1][3]), key=lambda item: item[1][3], reverse=True)
+        result += "\n*Most expensive:*\n"
+        for pattern, (checks, evaluated, matched, seconds) in expensive[:limit]:
+            result += (f"`{pattern}`: {seconds / checks * 1e6:.1f} µs per message, "
+                       f"evaluated {evaluated}, matched {matched}\n")
+        if not expensive:
+            result += "No filter time recorded yet.\n"
+        return result
+
+filter_engine = FilterEngine(STATIC_FILTERS, state_store)
+
+# Utility Functions
+def apply_text_filters(text):
+    """Apply text filters to the message text"""
+    return filter_engine.apply(text)
+
+# Time Conversion
+# Matches 00:00 or 00:00:00 format; seconds are carried over unchanged
+TIME_PATTERN = re.compile(r'(\d{2}:\d{2})((?::\d{2})?)')
+
+def parse_offset(value):
+    """Parse an offset such as '+03:30', '-5:00' or '210' (minutes) into minutes."""
+    value = str(value).strip()
+    sign = -1 if value.startswith('-') else 1
+    value = value.lstrip('+-')
+    if ':' in value:
+        hours, minutes = value.split(':', 1)
+        return sign * (int(hours) * 60 + int(minutes))
+    return sign * int(value)
+
+def format_offset(offset_minutes):
+    """Format minutes as a signed offset such as '+03:30'."""
+    sign = '-' if offset_minutes < 0 else '+'
+    hours, minutes = divmod(abs(offset_minutes), 60)
+    return f"{sign}{hours:02d}:{minutes:02d}"
+
+TIME_OFFSET_MINUTES = parse_offset(TIME_OFFSET)
+
+@functools.lru_cache(maxsize=64)
+def _shifted_clock_table(offset_minutes):
+    """Map every valid 'HH:MM' to its shifted value for one offset."""
+    table = {}
+    for total in range(24 * 60):
+        shifted = (total + offset_minutes) % (24 * 60)
+        table[f"{total // 60:02d}:{total % 60:02d}"] = f"{shifted // 60:02d}:{shifted % 60:02d}"
+    return table
+
+def convert_timezone(text, offset_minutes=None, script=None):
+    """
+    Shift every timestamp in the text by the configured offset.
+
+    Each timestamp is converted exactly once in a single pass, so a converted
+    value is never picked up again by a later match. Values that are not valid
+    clock times (e.g. 25:61) are left untouched.
+    """
+    if offset_minutes is None:
+        offset_minutes = TIME_OFFSET_MINUTES
+    
+    table = _shifted_clock_table(offset_minutes)
+    
+    def shift(match):
+        clock, seconds = match.groups()
+        return table.get(clock, clock) + seconds
+    
+    if script is not None:
+        edits = script.record()
+        plain_shift = shift
+        
+        def shift(match):
+            new = plain_shift(match)
+            edits.append((match.start(), match.end(), len(new)))
+            return new
+    
+    result, count = TIME_PATTERN.subn(shift, text)
+    if count:
+        logger.debug("Shifted %d timestamps by %s", count, format_offset(offset_minutes))
+    return result
+
+@functools.lru_cache(maxsize=4096)
+def timezone_offset_minutes(source_tz, target_tz, day):
+    """
+    Minutes to add to a source-zone clock time to get the target-zone time
+    on the given (UTC) day, taking each zone's DST rules into account.
+    """
+    instant = datetime.combine(day, clock_time(12), tzinfo=timezone.utc)
+    source_offset = instant.astimezone(ZoneInfo(source_tz)).utcoffset()
+    target_offset = instant.astimezone(ZoneInfo(target_tz)).utcoffset()
+    return int((target_offset - source_offset).total_seconds() // 60)
+
+# Shadow Filters
+class ShadowStats:
+    """
+    What the shadow filter set would have done to live posts.
+
+    Counts the posts it would change, keeps a random sample of them
+    (reservoir sampling, so early posts are not favoured) and compares the
+    per-message pipeline time with and without it. Reset whenever the shadow
+    set changes.
+    """
+
+    def __init__(self, sample_size=SHADOW_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.reset()
+
+    def reset(self):
+        self.messages = 0
+        self.changed = 0
+        self.samples = []  # (live output, shadow output)
+        self.live = Histogram()
+        self.shadow = Histogram()
+
+    def record(self, live_text, shadow_text, live_seconds, shadow_seconds):
+        """Record one post; shadow_text is None when the shadow set left it as the live set did."""
+        self.messages += 1
+        self.live.observe(live_seconds)
+        self.shadow.observe(shadow_seconds)
+        if shadow_text is None:
+            return
+        self.changed += 1
+        if len(self.samples) < self.sample_size:
+            self.samples.append((live_text, shadow_text))
+        else:
+            k = random.randrange(self.changed)
+            if k < self.sample_size:
+                self.samples[k] = (live_text, shadow_text)
+
+    def report(self, entries):
+        """Return a formatted summary for /shadowreport; entries are the shadow filters."""
+        if not entries:
+            return "No shadow filters. Add candidates with /shadowfilter pattern replacement."
+        result = f"🕶 *Shadow set:* {len(entries)} filters\n"
+        if not self.messages:
+            return result + "No posts since the shadow set changed."
+        
+        live_mean = self.live.total / self.messages * 1000
+        shadow_mean = self.shadow.total / self.messages * 1000
+        result += (f"Posts since the shadow set changed: {self.messages}\n"
+                   f"Would change: {self.changed} ({self.changed / self.messages * 100:.1f}%)\n\n"
+                   f"*Time per post:*\n"
+                   f"Live: mean {live_mean:.2f} ms, p50 {self.live.quantile(0.5) * 1000:.2f} ms, "
+                   f"p99 {self.live.quantile(0.99) * 1000:.2f} ms\n"
+                   f"With shadow: mean {shadow_mean:.2f} ms, p50 {self.shadow.quantile(0.5) * 1000:.2f} ms, "
+                   f"p99 {self.shadow.quantile(0.99) * 1000:.2f} ms "
+                   f"({(shadow_mean / live_mean - 1) * 100 if live_mean else 0.0:+.0f}%)\n")
+        import difflib
+        for live_text, shadow_text in self.samples:
+            lines = list(difflib.unified_diff(live_text.splitlines(), shadow_text.splitlines(), n=0, lineterm=''))[2:]
+            # Keep the Markdown code block intact
+            diff = "\n".join(line for line in lines if not line.startswith('@@')).replace('`', "'")
+            result += f"\n```\n{diff[:SHADOW_DIFF_CHARS]}\n```"
+        return result
+
+def run_shadow(engine, filtered_text, live_seconds, offset_minutes):
+    """
+    Run an engine's shadow filters on the live filters' output.
+
+    Returns (shadow output or None if unchanged, seconds with the shadow set).
+    """
+    started = time.perf_counter()
+    shadow_text = engine.apply_shadow(filtered_text)
+    shadow_seconds = live_seconds + time.perf_counter() - started
+    if shadow_text == filtered_text:
+        return None, shadow_seconds
+    return convert_timezone(shadow_text, offset_minutes), shadow_seconds
+
+shadow_stats = ShadowStats()
+
+def process_message_text(text, offset_minutes=None, script=None, scopes=None):
+    """
+    Process a message text by applying text filters and timezone conversion
+    """
+    # First apply text replacements
+    started = time.perf_counter()
+    filtered_text = filter_engine.apply(text, script=script, scopes=scopes)
+    filtered = time.perf_counter()
+    
+    # Then convert timestamps
+    result = convert_timezone(filtered_text, offset_minutes, script)
+    converted = time.perf_counter()
+    
+    metrics.observe('filters', filtered - started)
+    metrics.observe('time_conversion', converted - filtered)
+    
+    # Candidate filters continue from the live output, so they only cost their own steps
+    if filter_engine.has_shadow():
+        live_seconds = converted - started
+        shadow_text, shadow_seconds = run_shadow(filter_engine, filtered_text, live_seconds, offset_minutes)
+        shadow_stats.record(result, shadow_text, live_seconds, shadow_seconds)
+    return result
+
+# Entity Remapping
+# Telegram measures entity offsets in UTF-16 code units; Python indexes code
+# points. Characters outside the BMP (most emoji) take two UTF-16 units.
+ASTRAL_CHAR = re.compile('[\U00010000-\U0010FFFF]')
+
+class EditScript:
+    """
+    The replacements made while rewriting a text, one list per pass.
+
+    Each pass is a sorted list of (start, end, new_length) spans in the
+    coordinates of that pass's input text. Passes that changed nothing stay
+    empty and cost nothing when mapping.
+    """
+
+    __slots__ = ('passes',)
+
+    def __init__(self):
+        self.passes = []
+
+    def record(self):
+        """Start a new pass and return the list its spans are appended to."""
+        edits = []
+        self.passes.append(edits)
+        return edits
+
+    def extend(self, passes):
+        """Append passes recorded elsewhere, e.g. in a pipeline process."""
+        self.passes.extend(edits for edits in passes if edits)
+
+    def offset_by(self, delta):
+        """Move every span, for a script recorded on a slice starting at delta."""
+        self.passes = [[(start + delta, end + delta, new_length) for start, end, new_length in edits]
+                       for edits in self.passes]
+
+    def map_points(self, points):
+        """
+        Map (position, is_end) points from the original text to the final one.
+
+        A start inside a replaced span moves to the start of its replacement
+        and an end moves to the end of it, so an entity covering a replaced
+        word covers the new word. Insertions at an entity's edge stay outside.
+        """
+        # Ends sort first at equal positions: an insertion there belongs after the end
+        order = sorted((position, not is_end, k) for k, (position, is_end) in enumerate(points))
+        for edits in self.passes:
+            if not edits:
+                continue
+            count = len(edits)
+            mapped = []
+            i = delta = 0
+            for position, is_start, k in order:
+                while i < count:
+                    start, end, new_length = edits[i]
+                    if end > position or (end == position and start == position and not is_start):
+                        break
+                    delta += new_length - (end - start)
+                    i += 1
+                if i < count and edits[i][0] < position:
+                    start, _, new_length = edits[i]
+                    position = start + delta + (0 if is_start else new_length)
+                else:
+                    position += delta
+                mapped.append((position, is_start, k))
+            # Already almost in order (only points inside one replaced span can swap)
+            mapped.sort()
+            order = mapped
+        
+        positions = [0] * len(points)
+        for position, _, k in order:
+            positions[k] = position
+        return positions
+
+    def remap_entities(self, entities, original_text, new_text):
+        """Return entities with UTF-16 offsets moved onto new_text; collapsed ones are dropped."""
+        from telegram import MessageEntity
+        if not entities:
+            return entities
+        if not any(self.passes):
+            return list(entities)
+        
+        old_astral = [m.start() for m in ASTRAL_CHAR.finditer(original_text)]
+        # UTF-16 end offset of every astral char, for converting back to indexes
+        old_units = [index + k + 2 for k, index in enumerate(old_astral)]
+        new_astral = [m.start() for m in ASTRAL_CHAR.finditer(new_text)]
+        
+        points = []
+        for entity in entities:
+            for offset, is_end in ((entity.offset, False), (entity.offset + entity.length, True)):
+                points.append((offset - bisect.bisect_right(old_units, offset), is_end))
+        mapped = [index + bisect.bisect_left(new_astral, index) for index in self.map_points(points)]
+        
+        result = []
+        for k, entity in enumerate(entities):
+            offset, end = mapped[2 * k], mapped[2 * k + 1]
+            if offset == entity.offset and end - offset == entity.length:
+                result.append(entity)
+            elif end > offset:
+                result.append(MessageEntity(
+                    entity.type, offset, end - offset, url=entity.url, user=entity.user,
+                    language=entity.language, custom_emoji_id=getattr(entity, 'custom_emoji_id', None)
+                ))
+        return result
+
+# Pattern Vetting
+def _pattern_chars(items, chars):
+    """Collect the literal characters used anywhere in a parsed pattern."""
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            chars.add(chr(av))
+        elif op is sre_constants.SUBPATTERN:
+            _pattern_chars(av[-1], chars)
+        elif op is sre_constants.BRANCH:
+            for branch in av[1]:
+                _pattern_chars(branch, chars)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, 'POSSESSIVE_REPEAT', None)):
+            _pattern_chars(av[2], chars)
+    return chars
+
+def probe_strings(pattern):
+    """Adversarial inputs: long runs of characters the pattern cares about, then a mismatch."""
+    try:
+        chars = _pattern_chars(sre_parse.parse(pattern), set())
+    except Exception:
+        chars = set()
+    chars = sorted(chars)[:16] + ['a', 'A', '0', ' ', '_', '\n']
+    
+    probes = []
+    for length in (32, 4096):
+        for ch in chars:
+            probes.append(ch * length + '!')
+            probes.append(ch * length + '\x00')
+        probes.append(''.join(chars) * (length // len(chars)) + '!')
+    return probes
+
+def _run_probes(pattern, conn):
+    regex = re.compile(pattern)
+    for probe in probe_strings(pattern):
+        regex.subn('', probe)
+    conn.send(True)
+
+def vet_pattern(pattern, timeout=FILTER_VET_TIMEOUT):
+    """
+    Compile a pattern and run it over adversarial probe strings in a child
+    process that is killed after timeout seconds.
+    
+    Returns (True, None) for a safe pattern or (False, reason).
+    """
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        return False, f"Invalid regex pattern: {e}"
+    
+    # The child reports success over a Pipe. A Queue would need POSIX semaphores,
+    # which Android does not always provide, and the exit code is not reliable:
+    # on Python 3.11 a child forked from a worker thread exits with 1 anyway
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.Process(target=_run_probes, args=(pattern, writer), daemon=True)
+    try:
+        child.start()
+    except (OSError, ImportError) as e:
+        logger.error("Could not start a process to vet pattern '%s': %s", pattern, e)
+        return False, f"The pattern could not be tested safely because no test process could be started ({e})"
+    finally:
+        writer.close()
+    
+    try:
+        if not reader.poll(timeout):
+            return False, f"Pattern took longer than {timeout}s on test input (catastrophic backtracking?)"
+        try:
+            reader.recv()
+        except EOFError:
+            return False, "Pattern crashed while being tested"
+        return True, None
+    finally:
+        if child.is_alive():
+            child.kill()
+        child.join()
+
+# Filter Profiling
+# The texts of the last RECENT_POSTS_SIZE posts, so /profilefilter can show
+# what a pattern or the current filter set costs on real traffic.
+recent_posts = collections.deque(maxlen=RECENT_POSTS_SIZE)
+
+def _snippet(text, length=60):
+    text = ' '.join(text.split())
+    return text if len(text) <= length else text[:length - 1] + "…"
+
+def _timing_summary(seconds):
+    """Mean, p99 and max of per-post times, for the profile reports."""
+    seconds = sorted(seconds)
+    mean = sum(seconds) / len(seconds)
+    p99 = seconds[min(len(seconds) - 1, int(len(seconds) * 0.99))]
+    return f"Time per post: mean {mean * 1000:.3f} ms, p99 {p99 * 1000:.3f} ms, max {seconds[-1] * 1000:.3f} ms"
+
+def _slowest_line(regex, text):
+    """The line of a post the regex spends the most time on, and that time."""
+    slowest = (0.0, text)
+    for line in text.splitlines():
+        started = time.perf_counter()
+        for _ in regex.finditer(line):
+            pass
+        slowest = max(slowest, (time.perf_counter() - started, line))
+    return slowest
+
+def profile_pattern(pattern, posts, hot_spots=PROFILE_HOT_SPOTS):
+    """Time one pattern on every post; returns a plain text report."""
+    regex = re.compile(pattern)
+    timings = []
+    matched_posts = matches = 0
+    for post in posts:
+        started = time.perf_counter()
+        count = sum(1 for _ in regex.finditer(post))
+        timings.append((time.perf_counter() - started, post))
+        matches += count
+        matched_posts += count > 0
+    
+    result = (f"Pattern: {pattern}\n"
+              f"Recent posts: {len(posts)}, {matched_posts} matched ({matches} matches)\n"
+              f"{_timing_summary([seconds for seconds, _ in timings])}\n\n"
+              f"Slowest posts and the line that costs the most:\n")
+    # Slow posts are mostly where the pattern backtracks; the slowest line shows where
+    for seconds, post in sorted(timings, key=lambda timing: timing[0], reverse=True)[:hot_spots]:
+        line_seconds, line = _slowest_line(regex, post)
+        result += f"{seconds * 1000:.3f} ms: {_snippet(post)}\n   {line_seconds * 1000:.3f} ms in line: {_snippet(line)}\n"
+    return result
+
+def profile_filter_set(entries, posts, hot_spots=PROFILE_HOT_SPOTS):
+    """Run a filter set over every post the way the pipeline does; returns a plain text report."""
+    engine = FilterEngine(entries, None, time_budget_ms=float('inf'))
+    engine.compiled_steps()
+    timings = []
+    changed = 0
+    for post in posts:
+        started = time.perf_counter()
+        output = engine.apply(post)
+        timings.append((time.perf_counter() - started, post))
+        changed += output != post
+    
+    stats = engine.pattern_stats()
+    result = (f"Filter set: {len(entries)} filters in {len(engine.compiled_steps())} steps\n"
+              f"Recent posts: {len(posts)}, {changed} changed\n"
+              f"{_timing_summary([seconds for seconds, _ in timings])}\n\n"
+              f"Most expensive filters:\n")
+    # Members of a literal group are credited an even share of the group's scans
+    expensive = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:hot_spots]
+    for pattern, (checks, evaluated, matched, seconds) in expensive:
+        result += (f"{seconds / len(posts) * 1000:.3f} ms per post: {pattern} "
+                   f"(ran on {evaluated} of {checks} posts, matched {matched})\n")
+    result += "\nSlowest posts:\n"
+    for seconds, post in sorted(timings, key=lambda timing: timing[0], reverse=True)[:hot_spots]:
+        result += f"{seconds * 1000:.3f} ms: {_snippet(post)}\n"
+    return result
+
+def _profile_in_child(profile, args, conn):
+    """Child process: run a profile function and send back its report."""
+    conn.send(profile(*args))
+    conn.close()
+
+def run_profile(profile, args, timeout=PROFILE_TIMEOUT):
+    """
+    Run profile(*args) in a killable child process and return its report,
+    or None if it did not finish within timeout seconds. re holds the GIL
+    while it matches, so a pattern that backtracks on a recent post would
+    freeze the whole bot if it ran in a thread.
+    """
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.Process(target=_profile_in_child, args=(profile, args, writer), daemon=True)
+    child.start()
+    writer.close()
+    try:
+        if not reader.poll(timeout):
+            return None
+        try:
+            return reader.recv()
+        except EOFError:
+            raise RuntimeError("the profiling process exited without a report") from None
+    finally:
+        if child.is_alive():
+            child.kill()
+        child.join()
+
+# Pipeline Executor
+_worker_engine = None
+
+def _init_pipeline_worker(scoped, log_queue, level):
+    """Process pool initializer: load the shipped filters ({scope: entries}) once per worker."""
+    global _worker_engine
+    # Send records back to the parent's listener instead of writing bot.log here
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    _worker_engine = FilterEngine((), None, scoped=scoped)
+    _worker_engine.compiled_steps()
+
+def _process_text_in_worker(text, offset_minutes, record=False, scopes=None):
+    # Regroup cold filters here, between messages, rather than inside apply()
+    _worker_engine.replan()
+    _worker_engine.slow_patterns = []
+    script = EditScript() if record else None
+    started = time.perf_counter()
+    filtered_text = _worker_engine.apply(text, script=script, scopes=scopes)
+    result = convert_timezone(filtered_text, offset_minutes, script)
+    shadow = None
+    if _worker_engine.has_shadow():
+        live_seconds = time.perf_counter() - started
+        shadow = (*run_shadow(_worker_engine, filtered_text, live_seconds, offset_minutes), live_seconds)
+    return result, _worker_engine.slow_patterns, script.passes if record else None, shadow
+
+def _apply_with_progress(entries, text, conn):
+    """Child process: run the filters, reporting each step index through conn."""
+    FilterEngine(entries, None, time_budget_ms=float('inf')).apply(text, progress=conn.send)
+    conn.send(None)
+
+def find_hanging_filter(entries, text, step_timeout=FILTER_VET_TIMEOUT):
+    """
+    Run the filters on text in a killable child process and return the
+    patterns of the step that exceeds step_timeout, or None if all finish.
+    """
+    steps = compile_filters(entries)
+    reader, writer = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.Process(target=_apply_with_progress, args=(entries, text, writer), daemon=True)
+    child.start()
+    writer.close()
+    
+    current = None
+    try:
+        while True:
+            if not reader.poll(step_timeout):
+                return steps[current].patterns if current is not None else None
+            try:
+                current = reader.recv()
+            except EOFError:
+                return None
+            if current is None:
+                return None
+    finally:
+        if child.is_alive():
+            child.kill()
+        child.join()
+
+class PipelineExecutor:
+    """
+    Runs process_message_text inline, in a thread pool or in a process pool.
+
+    Process workers receive the compiled filter set's source once, through
+    the pool initializer; the pool is replaced whenever the filters change.
+    Filter counters are only updated for inline and thread mode.
+    
+    Only process mode can enforce a hard deadline: a message that takes
+    longer than PIPELINE_TIMEOUT gets the pool killed, the hanging filter
+    located in a separate child and disabled, and the message retried once.
+    """
+
+    MODES = ("inline", "thread", "process")
+
+    def __init__(self, mode=PIPELINE_EXECUTOR, workers=PIPELINE_WORKERS):
+        if mode not in self.MODES:
+            logger.warning("Unknown PIPELINE_EXECUTOR '%s', using inline", mode)
+            mode = "inline"
+        self.mode = mode
+        self.workers = workers
+        self._pool = None
+        self._pool_version = None
+        self._log_queue = None
+        self._log_listener = None
+
+    def _get_pool(self):
+        if self.mode == "thread":
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="pipeline")
+            return self._pool
+        
+        filter_engine.compiled_steps()
+        if self._pool is None or self._pool_version != filter_engine.version:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            if self._log_listener is None:
+                self._log_queue = multiprocessing.Queue()
+                self._log_listener = logging.handlers.QueueListener(self._log_queue, ForwardingHandler())
+                self._log_listener.start()
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=_init_pipeline_worker,
+                initargs=(filter_engine.scoped, self._log_queue, logging.getLogger().level)
+            )
+            self._pool_version = filter_engine.version
+            logger.info("Started %d pipeline processes for filter set version %d", self.workers, self._pool_version)
+        return self._pool
+
+    async def process(self, text, offset_minutes=None, script=None, scopes=None):
+        """
+        Run the text pipeline for one message without blocking the event loop.
+        
+        Replacements are recorded into script (an EditScript) when one is given.
+        scopes is the chain of filter scopes to apply (global only by default).
+        """
+        started = time.perf_counter()
+        if self.mode == "inline":
+            result = process_message_text(text, offset_minutes, script, scopes)
+        elif self.mode == "thread":
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self._get_pool(), process_message_text,
+                                                text, offset_minutes, script, scopes)
+        else:
+            result = await self._process_with_deadline(text, offset_minutes, script, scopes)
+        metrics.observe('pipeline', time.perf_counter() - started)
+        # Regroup cold filters after a counter snapshot, between messages
+        filter_engine.replan()
+        return result
+
+    def _kill_pool(self):
+        """Terminate the process pool, e.g. when a worker is stuck in a regex."""
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        for process in list(getattr(pool, '_processes', {}).values()):
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def _process_with_deadline(self, text, offset_minutes, script, scopes=None, retry=True):
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        entries = filter_engine.chain_entries(scopes)
+        future = loop.run_in_executor(pool, _process_text_in_worker,
+                                      text, offset_minutes, script is not None, scopes)
+        try:
+            result, slow_patterns, passes, shadow = await asyncio.wait_for(future, PIPELINE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error("Text pipeline exceeded %ss; killing workers to find the culprit", PIPELINE_TIMEOUT)
+            self._kill_pool()
+            culprit = await loop.run_in_executor(None, find_hanging_filter, entries, text)
+            if culprit and disable_filters(culprit, f"exceeded {PIPELINE_TIMEOUT}s pipeline deadline") and retry:
+                return await self._process_with_deadline(text, offset_minutes, script, scopes, retry=False)
+            # Leave the post alone rather than risk another hang
+            return text
+        
+        if slow_patterns:
+            disable_filters(slow_patterns, budget_reason(FILTER_TIME_BUDGET_MS))
+        if shadow is not None:
+            shadow_text, shadow_seconds, live_seconds = shadow
+            shadow_stats.record(result, shadow_text, live_seconds, shadow_seconds)
+        if script is not None:
+            script.extend(passes)
+        return result
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+
+pipeline_executor = PipelineExecutor()
+
+# Channel Management Functions
+def load_channels():
+    """Load the list of channels to monitor from the state database."""
+    try:
+        return [row[0] for row in state_store.query("SELECT channel FROM channels ORDER BY id")]
+    except Exception as e:
+        logger.error("Error loading channels: %s", e)
+        return []
+
+def save_channels(channels):
+    """Replace the list of monitored channels in one transaction."""
+    try:
+        with state_store.transaction() as conn:
+            conn.execute("DELETE FROM channels")
+            conn.executemany("INSERT OR IGNORE INTO channels (channel) VALUES (?)",
+                             [(str(channel),) for channel in channels])
+        return True
+    except Exception as e:
+        logger.error("Error saving channels: %s", e)
+        return False
+
+def add_channel(channel_id):
+    """Add a channel to the list of monitored channels."""
+    # Normalize channel ID format
+    if channel_id.startswith('@'):
+        # Keep @ for usernames
+        normalized_id = channel_id
+    else:
+        # Ensure numeric IDs are strings without @
+        normalized_id = str(channel_id).replace('@', '')
+    
+    try:
+        added = state_store.execute("INSERT OR IGNORE INTO channels (channel) VALUES (?)", (normalized_id,))
+    except Exception as e:
+        logger.error("Error saving channel: %s", e)
+        return False, "Failed to save channel."
+    
+    # Check if channel already exists
+    if not added:
+        return False, "Channel already in monitoring list."
+    
+    channel_registry.load()
+    return True, f"Channel {normalized_id} added to monitoring list."
+
+def remove_channel(channel_id):
+    """Remove a channel from the list of monitored channels."""
+    # Normalize channel ID for comparison
+    normalized_id = str(channel_id).replace('@', '') if not channel_id.startswith('@') else channel_id
+    
+    # Check both formats (@username and username) for removal
+    for candidate in (normalized_id, f"@{normalized_id}", normalized_id.replace('@', '')):
+        try:
+            removed = state_store.execute("DELETE FROM channels WHERE channel = ?", (candidate,))
+        except Exception as e:
+            logger.error("Error removing channel: %s", e)
+            return False, "Failed to save channel."
+        if removed:
+            channel_registry.load()
+            return True, f"Channel {channel_id} removed from monitoring list."
+    
+    return False, f"Channel {channel_id} not found in monitoring list."
+
+class ChannelRegistry:
+    """
+    In-memory hash indexes of the monitored channels.
+
+    Numeric chat ids and lowercase usernames are kept in two frozensets that
+    are swapped in as one snapshot whenever the channel list changes, so a
+    membership test is constant-time and never touches disk.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+
+    def load(self, channels=None):
+        """Rebuild the indexes from a channel list (read from disk if omitted)."""
+        if channels is None:
+            channels = load_channels()
+        
+        ids = set()
+        usernames = set()
+        for channel in channels:
+            channel = str(channel)
+            if channel.startswith('@'):
+                usernames.add(channel.replace('@', '').lower())
+            else:
+                ids.add(channel)
+        
+        self._snapshot = (frozenset(ids), frozenset(usernames))
+        logger.info("Channel registry loaded: %d ids, %d usernames", len(ids), len(usernames))
+
+    def _indexes(self):
+        if self._snapshot is None:
+            self.load()
+        return self._snapshot
+
+    def __len__(self):
+        ids, usernames = self._indexes()
+        return len(ids) + len(usernames)
+
+    def contains(self, chat):
+        """Check whether a chat is monitored, by numeric id or username."""
+        ids, usernames = self._indexes()
+        if str(chat.id) in ids:
+            return True
+        return bool(chat.username) and chat.username.lower() in usernames
+
+    def should_process(self, chat):
+        """Posts are processed from monitored chats, or from any chat if none are configured."""
+        ids, usernames = self._indexes()
+        if not ids and not usernames:
+            return True
+        return self.contains(chat)
+
+channel_registry = ChannelRegistry()
+
+def list_channels():
+    """Get a formatted list of all monitored channels."""
+    channels = load_channels()
+    
+    if not channels:
+        return "No channels are being monitored."
+    
+    result = "Monitored channels:\n\n"
+    for i, channel in enumerate(channels, 1):
+        group = get_channel_settings().get(channel_key(channel), {}).get('group')
+        group_text = f", group {group}" if group else ""
+        result += f"{i}. `{channel}` ({describe_channel_timezone(channel)}{group_text})\n"
+    
+    return result
+
+# Channel Settings Functions
+# Per-channel settings live next to the channel list, keyed by channel_key():
+# "@channel" -> {"source_tz": "Europe/London", "target_tz": "Asia/Tehran"}
+_channel_settings = None
+
+def channel_key(channel_id):
+    """Normalize a channel id or @username for settings lookups."""
+    channel_id = str(channel_id).strip()
+    if channel_id.startswith('@'):
+        return channel_id.lower()
+    return channel_id.replace('@', '')
+
+def load_channel_settings():
+    """Load per-channel settings from the state database."""
+    try:
+        rows = state_store.query("SELECT channel, settings FROM channel_settings")
+    except Exception as e:
+        logger.error("Error loading channel settings: %s", e)
+        return {}
+    return {channel: json.loads(entry) for channel, entry in rows}
+
+def save_channel_settings(settings):
+    """Replace all per-channel settings in one transaction."""
+    global _channel_settings
+    try:
+        with state_store.transaction() as conn:
+            conn.execute("DELETE FROM channel_settings")
+            conn.executemany("INSERT INTO channel_settings (channel, settings) VALUES (?, ?)",
+                             [(channel, json.dumps(entry)) for channel, entry in settings.items()])
+        _channel_settings = dict(settings)
+        filter_engine.invalidate()
+        return True
+    except Exception as e:
+        logger.error("Error saving channel settings: %s", e)
+        return False
+
+def save_channel_setting(key, entry):
+    """Upsert (or delete, when entry is empty) the settings of one channel."""
+    global _channel_settings
+    try:
+        if entry:
+            state_store.execute(
+                "INSERT INTO channel_settings (channel, settings) VALUES (?, ?) "
+                "ON CONFLICT(channel) DO UPDATE SET settings = excluded.settings",
+                (key, json.dumps(entry))
+            )
+        else:
+            state_store.execute("DELETE FROM channel_settings WHERE channel = ?", (key,))
+    except Exception as e:
+        logger.error("Error saving channel settings: %s", e)
+        return False
+    
+    settings = dict(get_channel_settings())
+    if entry:
+        settings[key] = entry
+    else:
+        settings.pop(key, None)
+    _channel_settings = settings
+    # A channel's group decides which filter scopes apply to it
+    filter_engine.invalidate()
+    return True
+
+def get_channel_settings():
+    """Return the cached per-channel settings, loading them on first use."""
+    global _channel_settings
+    if _channel_settings is None:
+        _channel_settings = load_channel_settings()
+    return _channel_settings
+
+def set_channel_timezone(channel_id, source_tz, target_tz):
+    """Set the source and target timezone for a channel."""
+    for name in (source_tz, target_tz):
+        try:
+            ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            return False, f"Unknown timezone: {name}"
+    
+    key = channel_key(channel_id)
+    entry = dict(get_channel_settings().get(key, {}), source_tz=source_tz, target_tz=target_tz)
+    if save_channel_setting(key, entry):
+        return True, f"Timestamps in {key} will be converted from {source_tz} to {target_tz}."
+    return False, "Failed to save channel settings."
+
+def clear_channel_timezone(channel_id):
+    """Return a channel to the default fixed offset."""
+    key = channel_key(channel_id)
+    entry = get_channel_settings().get(key)
+    if not entry or 'target_tz' not in entry:
+        return False, f"Channel {key} already uses the default offset."
+    
+    entry = {k: v for k, v in entry.items() if k not in ('source_tz', 'target_tz')}
+    if save_channel_setting(key, entry):
+        return True, f"Channel {key} now uses the default offset {format_offset(TIME_OFFSET_MINUTES)}."
+    return False, "Failed to save channel settings."
+
+def set_channel_group(channel_id, group):
+    """Put a channel into a channel group, or take it out when group is None."""
+    key = channel_key(channel_id)
+    entry = dict(get_channel_settings().get(key, {}))
+    if group is None:
+        if 'group' not in entry:
+            return False, f"Channel {key} is not in a group."
+        del entry['group']
+        message = f"Channel {key} was removed from its group."
+    else:
+        if not re.fullmatch(r'\w+', group):
+            return False, "Group names may only contain letters, digits and underscores."
+        entry['group'] = group.lower()
+        message = f"Channel {key} is now in group {group.lower()}."
+    
+    if save_channel_setting(key, entry):
+        return True, message
+    return False, "Failed to save channel settings."
+
+def settings_for_chat(chat):
+    """Return the settings for a chat, matched by numeric id or username."""
+    settings = get_channel_settings()
+    if not settings:
+        return {}
+    entry = settings.get(str(chat.id))
+    if entry is None and chat.username:
+        entry = settings.get(f"@{chat.username.lower()}")
+    return entry or {}
+
+def channel_time_offset(chat, when=None):
+    """Offset in minutes to apply to timestamps posted in the chat at `when`."""
+    settings = settings_for_chat(chat)
+    if 'target_tz' not in settings:
+        return TIME_OFFSET_MINUTES
+    
+    day = (when or datetime.now(timezone.utc)).date()
+    return timezone_offset_minutes(settings['source_tz'], settings['target_tz'], day)
+
+def describe_channel_timezone(channel_id):
+    """Short description of a channel's time conversion for listings."""
+    settings = get_channel_settings().get(channel_key(channel_id), {})
+    if 'target_tz' in settings:
+        return f"{settings['source_tz']} → {settings['target_tz']}"
+    return format_offset(TIME_OFFSET_MINUTES)
+
+# Idempotency Cache
+def content_hash(text):
+    """Short, stable fingerprint of a message text or caption."""
+    # Telegram trims surrounding whitespace, so an echo of our edit may differ there
+    return hashlib.blake2b(text.strip().encode('utf-8', 'surrogatepass'), digest_size=8).hexdigest()
+
+class ProcessedCache:
+    """
+    Bounded LRU/TTL memory of messages the bot has already handled.
+
+    Entries are keyed by (chat_id, message_id) and hold the hashes of every
+    content the message is known to be done with: the original text when no
+    change was needed, and both the original and the edited text otherwise.
+    A message arriving again with one of those contents is skipped; a real
+    edit by the channel admin changes the hash and is processed normally.
+
+    The hash of the bot's latest output is kept separately: an edit update
+    carrying exactly that content is the echo of our own edit. The output
+    text itself is kept in the store (or in memory without one) so a human
+    edit can be diffed against it.
+
+    With a store, entries are also written to SQLite and looked up there on
+    a memory miss, which covers restarts and overlapping bot instances.
+    """
+
+    PRUNE_EVERY = 1000  # Stored entries between deletes of expired rows
+
+    def __init__(self, size=PROCESSED_CACHE_SIZE, ttl=PROCESSED_CACHE_TTL, store=None):
+        self.size = size
+        self.ttl = ttl
+        self.store = store
+        self.stats = collections.Counter()
+        # (chat_id, message_id) -> (expires, hashes, output hash, output text when there is no store)
+        self._entries = collections.OrderedDict()
+        self._writes = 0
+
+    def _lookup_store(self, key, now):
+        rows = self.store.query(
+            "SELECT content_hash, is_output, expires FROM processed_messages "
+            "WHERE chat_id = ? AND message_id = ? AND expires > ?",
+            (key[0], key[1], now)
+        )
+        if not rows:
+            return None
+        output = next((digest for digest, is_output, _ in rows if is_output), None)
+        return max(row[2] for row in rows), frozenset(row[0] for row in rows), output, None
+
+    def _get(self, key):
+        """Return (entry, source) from memory or the store; entry is None on a miss."""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= now:
+            del self._entries[key]
+            self.stats['expired'] += 1
+            entry = None
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry, 'memory_hits'
+        
+        if self.store is not None:
+            try:
+                entry = self._lookup_store(key, now)
+            except Exception as e:
+                logger.error("Error reading processed messages: %s", e)
+            if entry is not None:
+                self._insert(key, entry)
+        return entry, 'store_hits'
+
+    def seen(self, chat_id, message_id, text):
+        """Check whether this message was already handled with this exact content."""
+        entry, source = self._get((chat_id, message_id))
+        if entry is not None and content_hash(text) in entry[1]:
+            self.stats[source] += 1
+            return True
+        self.stats['misses'] += 1
+        return False
+
+    def is_own_edit(self, chat_id, message_id, text):
+        """Check whether an edit update just carries the bot's own latest output."""
+        entry, _ = self._get((chat_id, message_id))
+        if entry is not None and entry[2] == content_hash(text):
+            self.stats['own_edits'] += 1
+            return True
+        self.stats['misses'] += 1
+        return False
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def last_output(self, chat_id, message_id):
+        """The text the bot last left in the message, or None if unknown."""
+        entry, _ = self._get((chat_id, message_id))
+        if entry is None or self.store is None:
+            return entry[3] if entry is not None else None
+        try:
+            rows = self.store.query(
+                "SELECT output_text FROM processed_messages WHERE chat_id = ? AND message_id = ? AND is_output = 1",
+                (chat_id, message_id)
+            )
+        except Exception as e:
+            logger.error("Error reading processed messages: %s", e)
+            return None
+        return rows[0][0] if rows else None
+
+    def remember(self, chat_id, message_id, original, output):
+        """Record that the message is done, and that output is what the bot left in it."""
+        key = (chat_id, message_id)
+        expires = time.time() + self.ttl
+        output_hash = content_hash(output)
+        hashes = {content_hash(original), output_hash}
+        entry = self._entries.get(key)
+        if entry is not None:
+            hashes |= entry[1]
+        self._insert(key, (expires, frozenset(hashes), output_hash, output if self.store is None else None))
+        self.stats['stored'] += 1
+        
+        if self.store is None:
+            return
+        try:
+            with self.store.transaction() as conn:
+                conn.execute("UPDATE processed_messages SET is_output = 0, output_text = NULL "
+                             "WHERE chat_id = ? AND message_id = ?", (chat_id, message_id))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO processed_messages "
+                    "(chat_id, message_id, content_hash, is_output, output_text, expires) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(chat_id, message_id, digest, digest == output_hash,
+                      output if digest == output_hash else None, expires) for digest in hashes]
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 1:
+                    conn.execute("DELETE FROM processed_messages WHERE expires <= ?", (time.time(),))
+        except Exception as e:
+            logger.error("Error saving processed message: %s", e)
+
+    def forget(self, chat_id, message_id):
+        """Drop a message, e.g. when its edit failed and it should be retried."""
+        self._entries.pop((chat_id, message_id), None)
+        if self.store is not None:
+            try:
+                self.store.execute("DELETE FROM processed_messages WHERE chat_id = ? AND message_id = ?",
+                                   (chat_id, message_id))
+            except Exception as e:
+                logger.error("Error removing processed message: %s", e)
+
+    def report(self):
+        """Return a formatted summary of the hit-rate counters."""
+        hits = self.stats['memory_hits'] + self.stats['store_hits']
+        lookups = hits + self.stats['own_edits'] + self.stats['misses']
+        hit_rate = (hits + self.stats['own_edits']) / lookups * 100 if lookups else 0.0
+        return (
+            f"Skipped {hits} posts as already processed and {self.stats['own_edits']} echoes "
+            f"of our own edits, out of {lookups} updates ({hit_rate:.1f}%)\n"
+            f"Hits: {self.stats['memory_hits']} memory, {self.stats['store_hits']} database; "
+            f"remembered {len(self._entries)} of {self.size}, evicted {self.stats['evicted']}, "
+            f"expired {self.stats['expired']}"
+        )
+
+processed_cache = ProcessedCache(store=state_store if PERSIST_PROCESSED else None)
+
+# Edit Dispatcher
+class TokenBucket:
+    """Token bucket that hands out reservations instead of blocking."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available, without taking it."""
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def reserve(self):
+        """Take a token, returning how long the caller must wait before using it."""
+        self._refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class EditJob:
+    """One API call the dispatcher should make: an edit or a fallback reply."""
+
+    __slots__ = ('chat_id', 'message_id', 'kind', 'text', 'entities', 'attempts', 'created',
+                 'outbox_id', 'saved')
+
+    def __init__(self, chat_id, message_id, kind, text, entities=None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.kind = kind  # 'text', 'caption' or 'reply'
+        self.text = text
+        self.entities = entities
+        self.attempts = 0
+        self.created = time.monotonic()
+        self.outbox_id = None  # Row in the outbox once the job is on disk
+        self.saved = None  # Future resolved when the outbox has written the job
+
+class Outbox:
+    """
+    Durable log of edits that have not been handled yet.
+
+    Every job is appended before its API call and acknowledged once it has
+    been handled (sent, already up to date, or given up on), so the
+    unacknowledged ones can be replayed after the process is killed. Appends
+    and acknowledgements are gathered for OUTBOX_FLUSH_DELAY and committed in
+    one synced transaction on a worker thread: a burst of edits shares one
+    disk sync, and the event loop never waits for the disk. Acknowledged
+    rows are deleted in bulk once OUTBOX_COMPACT_AFTER of them pile up.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            text TEXT NOT NULL,
+            entities TEXT,
+            created REAL NOT NULL,
+            acked INTEGER NOT NULL DEFAULT 0
+        );
+    """
+
+    def __init__(self, path, flush_delay=OUTBOX_FLUSH_DELAY, compact_after=OUTBOX_COMPACT_AFTER):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.compact_after = compact_after
+        self.stats = collections.Counter()
+        self._conn = None
+        self._lock = threading.Lock()
+        self._appends = []
+        self._acks = []
+        self._acked = None  # Acknowledged rows not compacted yet
+        self._flusher = None
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Unlike the state database, every commit here must reach the disk
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.executescript(self.SCHEMA)
+            self._acked = conn.execute("SELECT COUNT(*) FROM outbox WHERE acked = 1").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def append(self, job):
+        """Queue a job for the next commit; job.saved resolves once it is on disk."""
+        job.saved = asyncio.get_running_loop().create_future()
+        self._appends.append(job)
+        self._schedule()
+
+    def ack(self, job):
+        """Mark a handled job so it is not replayed."""
+        if job.outbox_id is not None:
+            self._acks.append(job.outbox_id)
+            self._schedule()
+
+    def _schedule(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        while self._appends or self._acks:
+            await self.flush()
+
+    async def flush(self):
+        """Commit the queued appends and acknowledgements now."""
+        appends, self._appends = self._appends, []
+        acks, self._acks = self._acks, []
+        if not appends and not acks:
+            return
+        rows = [(job.chat_id, job.message_id, job.kind, job.text,
+                 json.dumps([entity.to_dict() for entity in job.entities]) if job.entities else None, time.time())
+                for job in appends]
+        try:
+            ids = await asyncio.get_running_loop().run_in_executor(None, self._commit, rows, acks)
+        except Exception as e:
+            # Send the edits anyway; they just cannot be replayed after a crash
+            logger.error("Could not write %d edits to the outbox: %s", len(appends), e)
+            ids = [None] * len(appends)
+        for job, row_id in zip(appends, ids):
+            job.outbox_id = row_id
+            if not job.saved.done():
+                job.saved.set_result(row_id)
+
+    def _commit(self, rows, acks):
+        with self._lock:
+            conn = self._connect()
+            compact = self._acked + len(acks) >= self.compact_after
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [conn.execute("INSERT INTO outbox (chat_id, message_id, kind, text, entities, created) "
+                                    "VALUES (?, ?, ?, ?, ?, ?)", row).lastrowid for row in rows]
+                conn.executemany("UPDATE outbox SET acked = 1 WHERE id = ?", [(row_id,) for row_id in acks])
+                if compact:
+                    conn.execute("DELETE FROM outbox WHERE acked = 1")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            
+            self._acked = 0 if compact else self._acked + len(acks)
+            self.stats['commits'] += 1
+            self.stats['appended'] += len(rows)
+            self.stats['acked'] += len(acks)
+            self.stats['compactions'] += compact
+        return ids
+
+    def pending(self, max_age=OUTBOX_MAX_AGE, before=None):
+        """
+        Return the unacknowledged jobs created before the given time (now by
+        default), oldest first, dropping any older than max_age.
+        """
+        from telegram import MessageEntity
+        before = time.time() if before is None else before
+        with self._lock:
+            conn = self._connect()
+            expired = conn.execute("UPDATE outbox SET acked = 1 WHERE acked = 0 AND created < ?",
+                                   (time.time() - max_age,)).rowcount
+            rows = conn.execute("SELECT id, chat_id, message_id, kind, text, entities FROM outbox "
+                                "WHERE acked = 0 AND created < ? ORDER BY id", (before,)).fetchall()
+            self._acked += expired
+        if expired:
+            logger.warning("Dropped %d unsent edits older than %d hours", expired, max_age // 3600)
+        
+        jobs = []
+        for row_id, chat_id, message_id, kind, text, entities in rows:
+            entities = [MessageEntity.de_json(entity, None) for entity in json.loads(entities)] if entities else None
+            job = EditJob(chat_id, message_id, kind, text, entities)
+            job.outbox_id = row_id
+            jobs.append(job)
+        return jobs
+
+    async def close(self):
+        """Write everything still queued, compact and close the database."""
+        if self._flusher is not None:
+            await self._flusher
+        await self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM outbox WHERE acked = 1")
+                self._conn.close()
+                self._conn = None
+
+    def report(self):
+        return (f"{self.stats['appended']} edits saved in {self.stats['commits']} synced commits, "
+                f"{self.stats['compactions']} compactions")
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    if hasattr(retry_after, 'total_seconds'):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class EditDispatcher:
+    """
+    Sends edits through per-chat queues with a bounded pool of workers.
+
+    Each chat has its own FIFO queue and token bucket, and only one worker
+    serves a chat at a time, so edits to a chat stay in order while a slow
+    or flood-limited chat never holds up the others. A global bucket keeps
+    the bot inside Telegram's overall budget, and RetryAfter pauses the
+    affected chat for as long as Telegram asks.
+    """
+
+    def __init__(self, workers=EDIT_WORKERS, chat_rate=CHAT_EDITS_PER_MINUTE / 60,
+                 chat_burst=CHAT_EDIT_BURST, global_rate=GLOBAL_EDITS_PER_SECOND, outbox=None,
+                 reply_on_failure=REPLY_ON_EDIT_FAILURE):
+        self.worker_count = workers
+        self.outbox = outbox
+        self.reply_on_failure = reply_on_failure
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.bot = None
+        self.stats = collections.Counter()
+        self.latencies = collections.deque(maxlen=1000)
+        self._queues = {}
+        self._buckets = {}
+        self._ready = None
+        self._workers = []
+        self._pending = 0
+        self._idle = None
+        self._replay = None
+
+    def start(self, bot):
+        """Start the worker pool on the running event loop."""
+        if self._workers:
+            return
+        self.bot = bot
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        # Chats queued before the workers existed
+        for chat_id in self._queues:
+            self._ready.put_nowait(chat_id)
+        if self._pending:
+            self._idle.clear()
+        logger.info("Edit dispatcher started with %d workers", self.worker_count)
+        
+        # Edits a killed process never got to send; the chat buckets pace them
+        if self.outbox is not None and self._replay is None:
+            self._replay = asyncio.create_task(self._replay_outbox(time.time()))
+
+    async def _replay_outbox(self, started):
+        """
+        Queue the outbox's unsent edits ahead of any newer ones. The database
+        is read on a worker thread, and the workers wait until this is done.
+        """
+        try:
+            # Rows from after the start belong to jobs this process already queued
+            jobs = await asyncio.to_thread(self.outbox.pending, before=started)
+        except Exception as e:
+            logger.error("Could not read unsent edits from the outbox: %s", e)
+            return
+        for job in reversed(jobs):
+            self.enqueue(job, first=True)
+        self.stats['replayed'] += len(jobs)
+        if jobs:
+            logger.info("Replaying %d unsent edits from the outbox", len(jobs))
+
+    async def stop(self, drain=True):
+        """Stop the workers, by default after every queued job has been sent."""
+        if self._replay is not None:
+            await asyncio.wait([self._replay])
+        if drain:
+            await self.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self.outbox is not None:
+            # Jobs still queued stay unacknowledged and are replayed on the next start
+            await self.outbox.close()
+
+    async def join(self):
+        """Wait until every queued job has been handled."""
+        if self._replay is not None:
+            await asyncio.wait([self._replay])
+        if self._idle is not None:
+            await self._idle.wait()
+
+    def enqueue(self, job, first=False):
+        """Queue a job for its chat (ahead of its queued jobs if first); returns immediately."""
+        if self.outbox is not None and job.outbox_id is None:
+            self.outbox.append(job)
+        queue = self._queues.get(job.chat_id)
+        if queue is None:
+            queue = self._queues[job.chat_id] = collections.deque()
+            if self._ready is not None:
+                self._ready.put_nowait(job.chat_id)
+        if first:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self._pending += 1
+        if self._idle is not None:
+            self._idle.clear()
+
+    def queued(self):
+        """Number of jobs not yet handled."""
+        return self._pending
+
+    async def wait_for_room(self, limit):
+        """Wait until fewer than limit jobs are queued, for producers with a lot to send."""
+        while self._pending >= limit:
+            await asyncio.sleep(0.1)
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _ready_later(self, chat_id, delay):
+        asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+
+    def _finish(self, job):
+        if self.outbox is not None:
+            self.outbox.ack(job)
+        self._pending -= 1
+        if self._pending == 0:
+            self._idle.set()
+
+    async def _worker(self):
+        if self._replay is not None:
+            # Replayed edits are older than anything queued meanwhile; wait() never cancels them
+            await asyncio.wait([self._replay])
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._queues[chat_id]
+            
+            # Respect the chat's budget without tying up this worker
+            delay = self._bucket(chat_id).wait_time()
+            if delay > 0:
+                self._ready_later(chat_id, delay)
+                continue
+            
+            self._bucket(chat_id).reserve()
+            job = queue.popleft()
+            retry_delay = None
+            try:
+                if job.saved is not None:
+                    # Never call the API before the edit is safely on disk
+                    await job.saved
+                await asyncio.sleep(self.global_bucket.reserve())
+                retry_delay = await self._run(job)
+            except Exception as e:
+                logger.error("Unexpected error sending %s for message %s: %s", job.kind, job.message_id, e)
+            
+            if retry_delay is not None:
+                # Put the job back at the head so the chat stays in order
+                queue.appendleft(job)
+                self._ready_later(chat_id, retry_delay)
+                continue
+            
+            self._finish(job)
+            if queue:
+                self._ready.put_nowait(chat_id)
+            else:
+                del self._queues[chat_id]
+
+    async def _call(self, job):
+        started = time.perf_counter()
+        try:
+            if job.kind == 'text':
+                await self.bot.edit_message_text(
+                    chat_id=job.chat_id,
+                    message_id=job.message_id,
+                    text=job.text,
+                    entities=job.entities
+                )
+            elif job.kind == 'caption':
+                await self.bot.edit_message_caption(
+                    chat_id=job.chat_id,
+                    message_id=job.message_id,
+                    caption=job.text,
+                    caption_entities=job.entities
+                )
+            else:
+                await self.bot.send_message(
+                    chat_id=job.chat_id,
+                    text=job.text,
+                    parse_mode="Markdown",
+                    reply_to_message_id=job.message_id
+                )
+        finally:
+            # Failed and flood-limited calls count too: they cost the same round trip
+            metrics.observe('edit_api', time.perf_counter() - started)
+
+    async def _run(self, job):
+        """Make the call for a job; returns a delay if it should be retried."""
+        from telegram.error import BadRequest, NetworkError, RetryAfter
+        job.attempts += 1
+        try:
+            await self._call(job)
+        except RetryAfter as e:
+            self.stats['flood_waits'] += 1
+            wait = _retry_after_seconds(e)
+            logger.warning("Flood limit in chat %s, retrying in %ss", job.chat_id, wait)
+            if job.attempts < EDIT_MAX_ATTEMPTS:
+                return wait
+            self._failed(job, e)
+            return None
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                logger.info("Message %s already up to date", job.message_id)
+                self.stats['not_modified'] += 1
+                return None
+            self._failed(job, e)
+            return None
+        except NetworkError as e:
+            # Timeouts and connection errors are worth another try
+            logger.warning("Could not send %s for message %s: %s", job.kind, job.message_id, e)
+            if job.attempts < EDIT_MAX_ATTEMPTS:
+                return float(job.attempts)
+            self._failed(job, e)
+            return None
+        except Exception as e:
+            self._failed(job, e)
+            return None
+        
+        self.stats['sent'] += 1
+        self.latencies.append(time.monotonic() - job.created)
+        if job.kind == 'reply':
+            logger.info("Sent reply with corrected text for message %s", job.message_id)
+        else:
+            logger.info("Edited %s in message %s", job.kind, job.message_id)
+        return None
 
-def remove_channel(channel_id):
-    """Remove a channel from the list of monitored channels."""
-    channels = load_channels()
-    initial_count = len(channels)
-    
-    # Normalize channel ID for comparison
-    normalized_id = str(channel_id).replace('@', '') if not channel_id.startswith('@') else channel_id
-    
-    # Check both formats (@username and username) for removal
-    if normalized_id in channels:
-        channels.remove(normalized_id)
-    elif f"@{normalized_id}" in channels:
-        channels.remove(f"@{normalized_id}")
-    elif normalized_id.replace('@', '') in channels:
-        channels.remove(normalized_id.replace('@', ''))
-    
-    if len(channels) < initial_count:
-        if save_channels(channels):
-            return True, f"Channel {channel_id} removed from monitoring list."
-    
-    return False, f"Channel {channel_id} not found in monitoring list."
+    def _failed(self, job, error):
+        self.stats['failed'] += 1
+        logger.error("Failed to send %s for message %s: %s", job.kind, job.message_id, error)
+        
+        # Let the message be processed again if Telegram delivers it again
+        if job.kind != 'reply':
+            processed_cache.forget(job.chat_id, job.message_id)
+        
+        # If editing fails, create a reply that shows what the text should be
+        if job.kind != 'reply' and self.reply_on_failure:
+            label = "Caption" if job.kind == 'caption' else "Message text"
+            self.stats['fallback_replies'] += 1
+            self.enqueue(EditJob(job.chat_id, job.message_id, 'reply',
+                                 f"*{label} should be:*\n\n{job.text}"))
 
-def list_channels():
-    """Get a formatted list of all monitored channels."""
-    channels = load_channels()
-    
-    if not channels:
-        return "No channels are being monitored."
-    
-    result = "Monitored channels:\n\n"
-    for i, channel in enumerate(channels, 1):
-        result += f"{i}. `{channel}`\n"
-    
-    return result
+edit_outbox = Outbox(OUTBOX_DB) if OUTBOX_DB else None
+edit_dispatcher = EditDispatcher(outbox=edit_outbox)
 
 # Bot Command Handlers
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -390,12 +3209,27 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "*Channel management commands:*\n"
         "/channels - List all monitored channels\n"
         "/addchannel channel_id - Add a channel to monitor\n"
-        "/removechannel channel_id - Remove a channel from monitoring\n\n"
+        "/removechannel channel_id - Remove a channel from monitoring\n"
+        "/settimezone channel_id source_tz target_tz - Convert a channel's timestamps between timezones\n"
+        "/settimezone channel_id default - Use the default fixed offset again\n"
+        "/setgroup channel_id group - Put a channel into a group for group filters\n\n"
         "*Filter management commands:*\n"
         "/filters - List all current text filters\n"
-        "/addfilter pattern replacement - Add a new filter\n"
+        "/addfilter pattern replacement - Add a new filter for every channel\n"
+        "/addchannelfilter channel_id pattern replacement - Add a filter for one channel\n"
+        "/addgroupfilter group pattern replacement - Add a filter for a channel group\n"
         "/removefilter pattern - Remove a filter\n"
-        "/testfilter sample_text regex_pattern - Test a regex pattern on sample text",
+        "/removechannelfilter channel_id pattern - Remove a channel's filter\n"
+        "/removegroupfilter group pattern - Remove a group's filter\n"
+        "/testfilter sample_text regex_pattern - Test a regex pattern on sample text\n"
+        "/profilefilter [regex_pattern] - Time a pattern, or all filters, on recent posts\n"
+        "/filterstats - Show filters that never match and the most expensive ones\n\n"
+        "*Trying filters first:*\n"
+        "/shadowfilter pattern replacement - Try a filter on new posts without editing them\n"
+        "/removeshadowfilter pattern - Remove a filter from the shadow set\n"
+        "/shadowreport - Show what the shadow set would change and what it costs\n"
+        "/promoteshadow - Make the shadow filters live for every channel\n"
+        "/clearshadow - Drop the shadow filters",
         parse_mode="Markdown"
     )
 
@@ -404,13 +3238,21 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     channels = list_channels().replace('`', '')
     filters_text = list_filters().replace('`', '')
+    counters_text = filter_engine.counters_report().replace('`', '')
+    processed_text = processed_cache.report()
+    albums_text = media_groups.report()
+    timings_text = metrics.report()
     
     status_text = (
         "📊 *Bot Status*\n\n"
         "✅ Bot is running and monitoring channels\n\n"
         f"*Monitored Channels:*\n{channels}\n\n"
         f"*Active Filters:*\n{filters_text}\n\n"
-        f"*Time Conversion:* Adds 3:30 hours to all timestamps"
+        f"*Filter Counters:*\n{counters_text}\n\n"
+        f"*Already Processed:*\n{processed_text}\n\n"
+        f"*Albums:* {albums_text}\n\n"
+        f"*Timings:*\n{timings_text}\n\n"
+        f"*Time Conversion:* Shifts all timestamps by {format_offset(TIME_OFFSET_MINUTES)}"
     )
     
     await update.message.reply_text(status_text, parse_mode="Markdown")
@@ -420,37 +3262,78 @@ async def filters_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     filters_text = list_filters()
     await update.message.reply_text(filters_text, parse_mode="Markdown")
 
-async def add_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Add a new filter."""
-    # Check arguments
-    if len(context.args) < 2:
-        await update.message.reply_text(
-            "❌ Usage: /addfilter pattern replacement\n\n"
-            "Example: /addfilter (?i)\\b(hello)\\b HELLO\n\n"
-            "This would replace all instances of 'hello' (case insensitive) with 'HELLO'"
-        )
+async def _add_filter_to_scope(update, scope, args, usage):
+    """Vet and add a filter given as [pattern, replacement words...] to a scope."""
+    if len(args) < 2:
+        await update.message.reply_text(usage)
         return
     
     # Get pattern and replacement
-    pattern = context.args[0]
-    replacement = ' '.join(context.args[1:])
+    pattern = args[0]
+    replacement = ' '.join(args[1:])
     
     try:
         # Test if pattern is valid regex
         re.compile(pattern)
         
+        # Make sure the pattern cannot hang the bot (runs in a worker thread)
+        safe, reason = await asyncio.get_running_loop().run_in_executor(None, vet_pattern, pattern)
+        if not safe:
+            await update.message.reply_text(f"❌ Pattern rejected: {reason}")
+            return
+        
         # Add the filter
-        if add_filter(pattern, replacement):
+        if add_filter(pattern, replacement, scope):
             await update.message.reply_text(
                 f"✅ Filter added successfully!\n\n"
                 f"Pattern: `{pattern}`\n"
-                f"Replacement: `{replacement}`",
+                f"Replacement: `{replacement}`\n"
+                f"Applies to: {describe_scope(scope)}",
                 parse_mode="Markdown"
             )
         else:
             await update.message.reply_text("❌ Failed to add filter.")
     except re.error as e:
         await update.message.reply_text(f"❌ Invalid regex pattern: {e}")
+    except Exception as e:
+        logger.error("Error adding filter '%s': %s", pattern, e)
+        await update.message.reply_text(f"❌ Failed to add filter: {e}")
+
+async def _remove_filter_from_scope(update, scope, pattern):
+    if remove_filter(pattern, scope):
+        await update.message.reply_text(f"✅ Filter with pattern `{pattern}` removed from {describe_scope(scope)}.",
+                                        parse_mode="Markdown")
+    else:
+        await update.message.reply_text(f"❌ No filter found with pattern `{pattern}` in {describe_scope(scope)}.",
+                                        parse_mode="Markdown")
+
+async def add_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Add a new filter for every channel."""
+    await _add_filter_to_scope(
+        update, '', context.args,
+        "❌ Usage: /addfilter pattern replacement\n\n"
+        "Example: /addfilter (?i)\\b(hello)\\b HELLO\n\n"
+        "This would replace all instances of 'hello' (case insensitive) with 'HELLO'"
+    )
+
+async def add_channel_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Add a filter that only applies to one channel."""
+    usage = ("❌ Usage: /addchannelfilter channel_id pattern replacement\n\n"
+             "Example: /addchannelfilter @mychannel (?i)\\b(hello)\\b HELLO")
+    if not context.args:
+        await update.message.reply_text(usage)
+        return
+    await _add_filter_to_scope(update, channel_scope(context.args[0]), context.args[1:], usage)
+
+async def add_group_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Add a filter that applies to the channels of a channel group."""
+    usage = ("❌ Usage: /addgroupfilter group pattern replacement\n\n"
+             "Example: /addgroupfilter news (?i)\\b(hello)\\b HELLO\n\n"
+             "Put channels into a group with /setgroup channel_id group")
+    if not context.args:
+        await update.message.reply_text(usage)
+        return
+    await _add_filter_to_scope(update, group_scope(context.args[0]), context.args[1:], usage)
 
 async def remove_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Remove a filter."""
@@ -462,26 +3345,51 @@ async def remove_filter_command(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return
     
-    pattern = context.args[0]
-    
-    # Remove the filter
-    if remove_filter(pattern):
-        await update.message.reply_text(f"✅ Filter with pattern `{pattern}` removed.", parse_mode="Markdown")
-    else:
-        await update.message.reply_text(f"❌ No filter found with pattern `{pattern}`.", parse_mode="Markdown")
+    await _remove_filter_from_scope(update, '', context.args[0])
+
+async def remove_channel_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove a filter from one channel."""
+    if len(context.args) < 2:
+        await update.message.reply_text("❌ Usage: /removechannelfilter channel_id pattern")
+        return
+    await _remove_filter_from_scope(update, channel_scope(context.args[0]), context.args[1])
+
+async def remove_group_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove a filter from a channel group."""
+    if len(context.args) < 2:
+        await update.message.reply_text("❌ Usage: /removegroupfilter group pattern")
+        return
+    await _remove_filter_from_scope(update, group_scope(context.args[0]), context.args[1])
+
+# A "quoted argument" (outer quotes removed) or a plain word
+COMMAND_ARGUMENT = re.compile(r'"(.*?)"(?=\s|$)|(\S+)', re.DOTALL)
+
+def command_arguments(update):
+    """
+    The words after a command, with "quoted text" kept together.
+
+    Unlike context.args this keeps spaces inside quotes. Only quotes around
+    a whole argument are removed: quotes and backslashes inside one are
+    left alone, so regex patterns arrive exactly as typed.
+    """
+    _, _, rest = (update.message.text or '').partition(' ')
+    return [match.group(1) if match.group(1) is not None else match.group(2)
+            for match in COMMAND_ARGUMENT.finditer(rest)]
 
 async def test_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Test a regex pattern on sample text."""
+    args = command_arguments(update)
     # Check arguments
-    if len(context.args) < 2:
+    if len(args) < 2:
         await update.message.reply_text(
             "❌ Usage: /testfilter sample_text pattern\n\n"
             "Example: /testfilter \"Hello world\" (?i)\\b(hello)\\b"
         )
         return
     
-    sample_text = context.args[0]
-    pattern = context.args[1]
+    # The pattern is the last argument; an unquoted sample may span several words
+    sample_text = ' '.join(args[:-1])
+    pattern = args[-1]
     
     try:
         # Test the pattern
@@ -490,6 +3398,85 @@ async def test_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     except Exception as e:
         await update.message.reply_text(f"❌ Error testing pattern: {e}")
 
+async def profile_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Time a pattern, or the whole global filter set, on the most recent posts."""
+    posts = list(recent_posts)
+    if not posts:
+        await update.message.reply_text("No posts seen since the bot started. Try again once some have arrived.")
+        return
+    
+    args = command_arguments(update)
+    loop = asyncio.get_running_loop()
+    try:
+        if args:
+            pattern = args[0]
+            # Vetting catches the obvious cases; the profile itself still runs in a killable child
+            safe, reason = await loop.run_in_executor(None, vet_pattern, pattern)
+            if not safe:
+                await update.message.reply_text(f"❌ Pattern rejected: {reason}")
+                return
+            report = await loop.run_in_executor(None, run_profile, profile_pattern, (pattern, posts))
+        else:
+            report = await loop.run_in_executor(None, run_profile, profile_filter_set,
+                                                (filter_engine.pipeline().entries, posts))
+        if report is None:
+            await update.message.reply_text(
+                f"❌ Profiling was stopped after {PROFILE_TIMEOUT:.0f}s. "
+                "A pattern backtracks badly on one of the recent posts."
+            )
+            return
+        await update.message.reply_text(report)
+    except Exception as e:
+        await update.message.reply_text(f"❌ Error profiling: {e}")
+
+async def shadow_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Add a candidate filter to the shadow set, which runs on live posts without editing them."""
+    await _add_filter_to_scope(
+        update, SHADOW_SCOPE, context.args,
+        "❌ Usage: /shadowfilter pattern replacement\n\n"
+        "The filter runs on new posts after the live filters, but posts are not edited. "
+        "See what it would change with /shadowreport."
+    )
+    shadow_stats.reset()
+
+async def remove_shadow_filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Remove a candidate filter from the shadow set."""
+    if not context.args:
+        await update.message.reply_text("❌ Usage: /removeshadowfilter pattern")
+        return
+    await _remove_filter_from_scope(update, SHADOW_SCOPE, context.args[0])
+    shadow_stats.reset()
+
+async def shadow_report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show how many posts the shadow set would change, example changes and its cost."""
+    report = shadow_stats.report(load_filters(SHADOW_SCOPE))
+    await update.message.reply_text(report, parse_mode="Markdown")
+
+async def promote_shadow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Make the shadow filters live for every channel."""
+    promoted = promote_shadow_filters()
+    if promoted is None:
+        await update.message.reply_text("❌ Failed to promote the shadow filters.")
+    elif not promoted:
+        await update.message.reply_text("There are no shadow filters to promote.")
+    else:
+        await update.message.reply_text(f"✅ {promoted} shadow filters now apply to every channel.")
+    shadow_stats.reset()
+
+async def clear_shadow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop the shadow filters without making them live."""
+    removed = clear_shadow_filters()
+    if removed is None:
+        await update.message.reply_text("❌ Failed to remove the shadow filters.")
+    else:
+        await update.message.reply_text(f"✅ Removed {removed} shadow filters.")
+    shadow_stats.reset()
+
+async def filter_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show dead and expensive filters so they can be pruned."""
+    stats_text = filter_engine.filter_stats_report()
+    await update.message.reply_text(stats_text, parse_mode="Markdown")
+
 async def channels_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Display all monitored channels."""
     channels_text = list_channels()
@@ -537,138 +3524,601 @@ async def remove_channel_command(update: Update, context: ContextTypes.DEFAULT_T
     else:
         await update.message.reply_text(f"❌ {message}")
 
+async def set_group_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Put a channel into a channel group for group filters."""
+    if len(context.args) != 2:
+        await update.message.reply_text(
+            "❌ Usage: /setgroup channel_id group\n\n"
+            "Example: /setgroup @mychannel news\n"
+            "Use /setgroup channel_id none to take the channel out of its group."
+        )
+        return
+    
+    group = None if context.args[1].lower() == 'none' else context.args[1]
+    ok, message = set_channel_group(context.args[0], group)
+    await update.message.reply_text(("✅ " if ok else "❌ ") + message)
+
+async def set_timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Set the timezone conversion for a channel."""
+    # Check arguments
+    if len(context.args) == 2 and context.args[1].lower() == 'default':
+        success, message = clear_channel_timezone(context.args[0])
+    elif len(context.args) == 3:
+        success, message = set_channel_timezone(*context.args)
+    else:
+        await update.message.reply_text(
+            "❌ Usage: /settimezone channel_id source_tz target_tz\n\n"
+            "Examples:\n"
+            "/settimezone @channelname Europe/London Asia/Tehran\n"
+            "/settimezone @channelname default"
+        )
+        return
+    
+    if success:
+        await update.message.reply_text(f"✅ {message}")
+    else:
+        await update.message.reply_text(f"❌ {message}")
+
+def changed_segment(old, new):
+    """
+    Return (start, end) of the part of new that differs from old, widened
+    to whole words so filters and timestamps see complete tokens.
+
+    Words are runs of word characters, '@' and ':', so a mention or a clock
+    time is never cut in half. Other punctuation ends a word: typing '!'
+    right after a converted time must not pull that time back in.
+    """
+    prefix = len(os.path.commonprefix([old, new]))
+    limit = min(len(old), len(new)) - prefix
+    suffix = min(len(os.path.commonprefix([old[::-1], new[::-1]])), limit)
+    start, end = prefix, len(new) - suffix
+    
+    def in_word(ch):
+        return ch in '@:' or _is_word_char(ch)
+    
+    def splits_word(i):
+        return 0 < i < len(new) and in_word(new[i - 1]) and in_word(new[i])
+    
+    while splits_word(start):
+        start -= 1
+    while splits_word(end):
+        end += 1
+    return start, end
+
+async def rewrite_text(text, entities, time_offset, previous=None, scopes=None):
+    """
+    Run the text pipeline and remap the entities; returns (new_text, new_entities).
+
+    previous is the bot's own last output for an edited message. Only the
+    words the human edit changed are processed then, so timestamps the bot
+    already converted are not shifted a second time. Edits without a known
+    previous output are passed a time_offset of 0 by process_channel_post. scopes is the chat's
+    chain of filter scopes from FilterEngine.scopes_for().
+    """
+    start, end = (0, len(text)) if previous is None else changed_segment(previous, text)
+    if start >= end:
+        return text, entities
+    
+    script = EditScript() if entities else None
+    processed = await pipeline_executor.process(text[start:end], time_offset, script, scopes)
+    new_text = text[:start] + processed + text[end:]
+    if script is None or new_text == text:
+        return new_text, entities
+    if start:
+        script.offset_by(start)
+    return new_text, script.remap_entities(entities, text, new_text)
+
+class MediaGroupBuffer:
+    """
+    Collects the items of an album (media group) for a short while and
+    processes them together.
+
+    Telegram delivers every album item as its own update. Items with the same
+    caption and entities share one pipeline run, and an edit is queued only
+    for items whose caption actually changes.
+    """
+
+    def __init__(self, wait=MEDIA_GROUP_WAIT):
+        self.wait = wait
+        self.stats = collections.Counter()
+        self._groups = {}  # (chat_id, media_group_id) -> [message]
+        self._tasks = {}  # Timers still collecting items
+        self._flushing = set()  # Timers whose album is being processed
+
+    def add(self, message):
+        key = (message.chat.id, message.media_group_id)
+        self._groups.setdefault(key, []).append(message)
+        self.stats['items'] += 1
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._flush_later(key))
+
+    def __len__(self):
+        return len(self._groups)
+
+    async def _flush_later(self, key):
+        await asyncio.sleep(self.wait)
+        task = self._tasks.pop(key, None)
+        self._flushing.add(task)
+        try:
+            await self.flush(key)
+        finally:
+            self._flushing.discard(task)
+
+    async def flush(self, key):
+        """Process one collected album."""
+        self._tasks.pop(key, None)
+        items = self._groups.pop(key, [])
+        if not items:
+            return
+        self.stats['albums'] += 1
+        logger.info("Processing album %s with %d captioned items from channel %s", key[1], len(items), key[0])
+        
+        results = {}
+        try:
+            scopes = filter_engine.scopes_for(items[0].chat)
+        except Exception as e:
+            logger.error("Error processing album %s: %s", key[1], e)
+            return
+        for message in items:
+            try:
+                time_offset = channel_time_offset(message.chat, message.date)
+                entities = message.caption_entities
+                signature = (message.caption, time_offset,
+                             tuple((e.type, e.offset, e.length, e.url) for e in entities or ()))
+                if signature in results:
+                    self.stats['deduplicated'] += 1
+                else:
+                    results[signature] = await rewrite_text(message.caption, entities, time_offset, scopes=scopes)
+                processed_caption, new_entities = results[signature]
+                
+                if processed_caption != message.caption:
+                    edit_dispatcher.enqueue(EditJob(message.chat.id, message.message_id, 'caption',
+                                                    processed_caption, new_entities))
+                    self.stats['edits'] += 1
+                processed_cache.remember(message.chat.id, message.message_id, message.caption, processed_caption)
+            except Exception as e:
+                logger.error("Error processing album item %s: %s", message.message_id, e)
+
+    async def flush_all(self, timeout=MEDIA_GROUP_SHUTDOWN_WAIT):
+        """
+        Process every pending album now, e.g. on shutdown, and wait up to
+        timeout seconds for the ones whose timer already took their items.
+        """
+        # Timers still collecting have not taken their items; flush those here
+        for task in self._tasks.values():
+            task.cancel()
+        for key in list(self._groups):
+            await self.flush(key)
+        if self._flushing:
+            _, unfinished = await asyncio.wait(self._flushing, timeout=timeout)
+            if unfinished:
+                logger.warning("Stopped waiting for %d albums still being processed", len(unfinished))
+
+    def report(self):
+        return (f"{self.stats['albums']} albums, {self.stats['items']} captioned items, "
+                f"{self.stats['deduplicated']} duplicate captions reused, {self.stats['edits']} edits")
+
+media_groups = MediaGroupBuffer()
+
 async def process_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Process new channel posts."""
-    message = update.channel_post
+    """Process new and edited channel posts."""
+    message = update.channel_post or update.edited_channel_post
+    edited = update.channel_post is None
     
     if not message:
         return
+    started = time.perf_counter()
     
     # Check if the message is from a monitored channel
-    monitored_channels = load_channels()
-    channel_match = False
-    
-    for channel in monitored_channels:
-        # Handle both username format (@channel) and numeric ID format
-        if channel.startswith('@'):
-            # Username format - compare with channel username
-            if message.chat.username and message.chat.username.lower() == channel.replace('@', '').lower():
-                channel_match = True
-                break
-        else:
-            # Numeric ID format - compare with channel ID
-            if message.chat.id and str(message.chat.id) == channel:
-                channel_match = True
-                break
+    monitored = channel_registry.should_process(message.chat)
+    metrics.observe('channel_lookup', time.perf_counter() - started)
+    if not monitored:
+        metrics.messages['ignored'] += 1
+        logger.debug("Ignoring message from non-monitored channel: %s", message.chat.id)
+        return
     
-    if not channel_match and monitored_channels:
-        logger.info(f"Ignoring message from non-monitored channel: {message.chat.id}")
+    # Skip messages already handled with this exact content, without any API call
+    content = message.text if PROCESS_TEXT else None
+    if not content and PROCESS_CAPTIONS:
+        content = message.caption
+    if content and edited:
+        # Our own edits come back as edit updates; only human edits are reprocessed
+        if processed_cache.is_own_edit(message.chat.id, message.message_id, content):
+            metrics.messages['own_edit'] += 1
+            logger.debug("Ignoring our own edit of message %s", message.message_id)
+            return
+    elif content and processed_cache.seen(message.chat.id, message.message_id, content):
+        metrics.messages['already_processed'] += 1
+        logger.debug("Message %s was already processed", message.message_id)
         return
     
-    logger.info(f"Processing message {message.message_id} from channel {message.chat.id}")
+    if content:
+        recent_posts.append(content)
+    
+    logger.info("Processing %s message %s from channel %s",
+                "edited" if edited else "new", message.message_id, message.chat.id)
+    
+    # Edits go through the dispatcher; make sure it is running
+    edit_dispatcher.start(context.bot)
+    
+    # New album items are collected and processed together
+    if (message.media_group_id and not edited and not (message.text and PROCESS_TEXT)
+            and message.caption and PROCESS_CAPTIONS):
+        media_groups.add(message)
+        metrics.messages['album_item'] += 1
+        return
     
     try:
+        # A bad stored timezone or a store error counts as a failed message
+        time_offset = channel_time_offset(message.chat, message.date)
+        scopes = filter_engine.scopes_for(message.chat)
+        previous = processed_cache.last_output(message.chat.id, message.message_id) if edited else None
+        if edited and previous is None:
+            # The bot's last output is gone (expired, or not persisted across a
+            # restart), so timestamps it already converted cannot be told apart
+            # from new ones: run the filters, but shift no times
+            logger.info("No earlier output recorded for edited message %s; leaving its times alone",
+                        message.message_id)
+            time_offset = 0
+        
         # Process text messages
         if message.text and PROCESS_TEXT:
             original_text = message.text
-            logger.info(f"Original text before processing: '{original_text}'")
+            logger.debug("Original text before processing: '%s'", original_text)
             
-            processed_text = process_message_text(original_text)
-            logger.info(f"Processed text after filters and time conversion: '{processed_text}'")
+            processed_text, entities = await rewrite_text(original_text, message.entities, time_offset,
+                                                          previous, scopes)
+            logger.debug("Processed text after filters and time conversion: '%s'", processed_text)
             
             # Only edit if the text has changed
             if processed_text != original_text:
-                logger.info(f"Text was changed! Will attempt to edit message {message.message_id}")
-                try:
-                    # Try to edit message directly
-                    await message.edit_text(processed_text, entities=message.entities)
-                    logger.info(f"Edited text message {message.message_id}")
-                except Exception as edit_error:
-                    # If editing fails (e.g., no permission), try alternative method
-                    logger.warning(f"Could not edit message directly: {edit_error}")
-                    
-                    try:
-                        # Try using bot API directly with context.bot
-                        await context.bot.edit_message_text(
-                            chat_id=message.chat.id,
-                            message_id=message.message_id,
-                            text=processed_text,
-                            entities=message.entities
-                        )
-                        logger.info(f"Edited text message {message.message_id} using bot API")
-                    except Exception as api_error:
-                        # If that also fails, log detailed error
-                        logger.error(f"Failed to edit message {message.message_id}: {api_error}")
-                        
-                        # If both editing methods fail, create a reply that shows what the text should be
-                        if REPLY_ON_EDIT_FAILURE:
-                            try:
-                                await context.bot.send_message(
-                                    chat_id=message.chat.id,
-                                    text=f"*Message text should be:*\n\n{processed_text}",
-                                    parse_mode="Markdown",
-                                    reply_to_message_id=message.message_id
-                                )
-                                logger.info(f"Sent reply with corrected text for message {message.message_id}")
-                            except Exception as reply_error:
-                                logger.error(f"Failed to send reply: {reply_error}")
+                logger.info("Text was changed! Queueing edit for message %s", message.message_id)
+                edit_dispatcher.enqueue(EditJob(message.chat.id, message.message_id, 'text',
+                                                processed_text, entities))
+                metrics.messages['changed'] += 1
             else:
-                logger.info(f"No changes needed for message {message.message_id}")
+                logger.debug("No changes needed for message %s", message.message_id)
+                metrics.messages['unchanged'] += 1
+            processed_cache.remember(message.chat.id, message.message_id, original_text, processed_text)
         
         # Process captions in media messages
         elif message.caption and PROCESS_CAPTIONS:
             original_caption = message.caption
-            processed_caption = process_message_text(original_caption)
+            processed_caption, entities = await rewrite_text(original_caption, message.caption_entities,
+                                                             time_offset, previous, scopes)
             
             # Only edit if the caption has changed
             if processed_caption != original_caption:
-                try:
-                    # Try to edit caption directly
-                    await message.edit_caption(processed_caption, caption_entities=message.caption_entities)
-                    logger.info(f"Edited caption in message {message.message_id}")
-                except Exception as edit_error:
-                    # If editing fails, try alternative method
-                    logger.warning(f"Could not edit caption directly: {edit_error}")
-                    
-                    try:
-                        # Try using bot API directly
-                        await context.bot.edit_message_caption(
-                            chat_id=message.chat.id,
-                            message_id=message.message_id,
-                            caption=processed_caption,
-                            caption_entities=message.caption_entities
-                        )
-                        logger.info(f"Edited caption in message {message.message_id} using bot API")
-                    except Exception as api_error:
-                        # If that also fails, log detailed error
-                        logger.error(f"Failed to edit caption in message {message.message_id}: {api_error}")
-                        
-                        # If both editing methods fail, create a reply that shows what the caption should be
-                        if REPLY_ON_EDIT_FAILURE:
-                            try:
-                                await context.bot.send_message(
-                                    chat_id=message.chat.id,
-                                    text=f"*Caption should be:*\n\n{processed_caption}",
-                                    parse_mode="Markdown",
-                                    reply_to_message_id=message.message_id
-                                )
-                                logger.info(f"Sent reply with corrected caption for message {message.message_id}")
-                            except Exception as reply_error:
-                                logger.error(f"Failed to send reply: {reply_error}")
+                logger.info("Caption was changed! Queueing edit for message %s", message.message_id)
+                edit_dispatcher.enqueue(EditJob(message.chat.id, message.message_id, 'caption',
+                                                processed_caption, entities))
+                metrics.messages['changed'] += 1
+            else:
+                metrics.messages['unchanged'] += 1
+            processed_cache.remember(message.chat.id, message.message_id, original_caption, processed_caption)
                 
     except Exception as e:
-        logger.error(f"Error processing message {message.message_id}: {e}")
+        metrics.messages['error'] += 1
+        logger.error("Error processing message %s: %s", message.message_id, e)
+    finally:
+        metrics.observe('message', time.perf_counter() - started)
 
-async def start_bot_async():
-    """Start the Telegram bot asynchronously."""
-    if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
-        logger.error("No bot token provided! Please set the BOT_TOKEN variable in this file.")
-        print("ERROR: Bot token not found! Please set the BOT_TOKEN variable in this file.")
-        print("Edit simple_bot.py and change the line: BOT_TOKEN = \"YOUR_BOT_TOKEN_HERE\"")
-        return
+# Backfill
+# Posts from before a channel was added can be run through the pipeline from
+# a Telegram Desktop export ("Export chat history", JSON format) or from a
+# JSONL file with one {"id": ..., "text": ...} object per line. See
+# backfill_main() for the command line.
+class JSONStream:
+    """
+    Reads one large JSON document a value at a time.
+
+    Only the current chunk and the value being decoded are kept in memory, so
+    an export with years of posts is read in a few hundred kilobytes.
+    """
+
+    WHITESPACE = ' \t\r\n'
+
+    def __init__(self, f, chunk_size=BACKFILL_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Read the next chunk, dropping what was consumed; False at the end of the file."""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character ('' at the end of the file)."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of chars."""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in the export, found {char or 'the end'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number cut off at the end of the chunk decodes too early
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def array(self):
+        """Yield the items of the array that starts here."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+def iter_export_messages(path, header=None):
+    """
+    Yield the messages of a channel export one at a time.
+
+    A Telegram Desktop export is a single object; its "messages" array is
+    streamed and the fields before it (name, type, id) are stored in header.
+    Files ending in .jsonl hold one message object per line.
+    """
+    header = {} if header is None else header
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        
+        stream = JSONStream(f)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.value()
+            stream.expect(':')
+            if key == 'messages':
+                yield from stream.array()
+            else:
+                header[key] = stream.value()
+            if stream.expect(',}') == '}':
+                return
+
+# Formatting that has to be sent back with an edit. Links, mentions, hashtags
+# and the like are detected by Telegram again and stay plain text here.
+EXPORT_ENTITY_TYPES = {'bold', 'italic', 'underline', 'strikethrough', 'spoiler', 'code', 'pre',
+                       'text_link', 'blockquote', 'custom_emoji'}
+EXPORT_MEDIA_KEYS = ('photo', 'file', 'media_type', 'caption')
+
+def _join_export_parts(parts):
+    """Join Telegram Desktop text parts into the text and its entities."""
+    from telegram import MessageEntity
+    pieces = []
+    entities = []
+    offset = 0
+    for part in parts:
+        piece = part.get('text', '')
+        length = len(piece.encode('utf-16-le')) // 2
+        kind = part.get('type')
+        emoji_id = str(part.get('document_id', ''))
+        if (kind in EXPORT_ENTITY_TYPES and length
+                and (kind != 'text_link' or part.get('href'))
+                and (kind != 'custom_emoji' or emoji_id.isdigit())):
+            entities.append(MessageEntity(kind, offset, length, url=part.get('href'),
+                                          language=part.get('language'),
+                                          custom_emoji_id=emoji_id if kind == 'custom_emoji' else None))
+        pieces.append(piece)
+        offset += length
+    return ''.join(pieces), entities
+
+def export_message_content(message):
+    """
+    Return (kind, text, entities) of an exported message, or None if it has
+    nothing to process.
+
+    Telegram Desktop stores the text (or the caption of a media post) either
+    as a string or as a list of plain strings and formatted parts, plus the
+    same parts in "text_entities". JSONL lines may also use the Bot API shape:
+    "text" or "caption" with "entities" or "caption_entities".
+    """
+    from telegram import MessageEntity
+    if message.get('type', 'message') != 'message':
+        return None  # Service messages: pins, title changes and the like
+    kind = 'caption' if any(key in message for key in EXPORT_MEDIA_KEYS) else 'text'
+    text = message.get('text', message.get('caption', ''))
     
-    # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    parts = message.get('text_entities')
+    if parts is None and isinstance(text, list):
+        parts = [part if isinstance(part, dict) else {'type': 'plain', 'text': part} for part in text]
+    if parts is not None:
+        text, entities = _join_export_parts(parts)
+    else:
+        entities = [MessageEntity.de_json(entity, None)
+                    for entity in message.get('entities') or message.get('caption_entities') or ()]
+    if not isinstance(text, str) or not text:
+        return None
+    return kind, text, entities or None
+
+def _export_date(message):
+    """When an exported message was posted, or None if the export doesn't say."""
+    stamp = message.get('date_unixtime', message.get('date'))
+    if isinstance(stamp, (int, float)) or (isinstance(stamp, str) and stamp.isdigit()):
+        return datetime.fromtimestamp(int(stamp), timezone.utc)
+    return None
+
+async def _backfill_chat(bot, channel, header):
+    """The channel an export belongs to, from --channel or the export's own id."""
+    from telegram import Chat
+    chat_id = None
+    if channel and channel.lstrip('-').isdigit():
+        chat_id = int(channel)
+    elif 'id' in header:
+        # Desktop exports leave out the -100 prefix the Bot API puts on channel ids
+        chat_id = int(f"-100{header['id']}")
+    username = channel[1:] if channel and channel.startswith('@') else None
+    
+    if bot is not None:
+        try:
+            return await bot.get_chat(chat_id if chat_id is not None else channel)
+        except Exception as e:
+            if chat_id is None:
+                raise ValueError(f"Could not look up {channel}: {e}") from e
+            logger.warning("Could not look up channel %s, using its id only: %s", chat_id, e)
+    elif chat_id is None and username is None:
+        raise ValueError("The export has no channel id; pass --channel")
+    return Chat(chat_id if chat_id is not None else 0, Chat.CHANNEL, username=username)
+
+def _backfill_outbox_path():
+    """Edits of a backfill get their own outbox, so a running bot never replays them."""
+    if not OUTBOX_DB:
+        return None
+    root, ext = os.path.splitext(OUTBOX_DB)
+    return f"{root}_backfill{ext}"
+
+def write_diff(out, message_id, old, new):
+    """Write a unified diff of one post's text for dry runs."""
+    import difflib
+    
+    for line in difflib.unified_diff(old.splitlines(), new.splitlines(), f"message {message_id}",
+                                     f"message {message_id} (processed)", lineterm=''):
+        out.write(line + '\n')
+
+async def backfill(path, channel=None, bot=None, dry_run=False, resume=True, out=None):
+    """
+    Run the posts of a channel export through the pipeline and edit the ones
+    that change.
+
+    Posts are read one at a time and reading pauses while
+    BACKFILL_QUEUE_LIMIT edits are waiting, so memory stays flat however
+    long the export is. Edits go through their own EditDispatcher, paced
+    like the live bot's and without fallback replies. Every
+    BACKFILL_CHECKPOINT_EVERY posts the last post id is saved once the edits
+    before it are in the outbox (or sent, without one); with resume the next
+    run starts after it. A dry run sends and saves nothing and writes a diff
+    of every change to out. Returns a Counter of outcomes.
+    """
+    out = out or sys.stdout
+    stats = collections.Counter()
+    header = {}
+    messages = iter_export_messages(path, header)
+    first = next(messages, None)  # Reading up to the first message fills in header
+    if first is None:
+        return stats
+    
+    chat = await _backfill_chat(bot, channel, header)
+    scopes = filter_engine.scopes_for(chat)
+    checkpoint_key = f"backfill:{chat.id}"
+    checkpoint = 0
+    if resume:
+        rows = state_store.query("SELECT value FROM meta WHERE key = ?", (checkpoint_key,))
+        checkpoint = int(rows[0][0]) if rows else 0
+        if checkpoint:
+            logger.info("Resuming the backfill of %s after message %d", chat.id, checkpoint)
+    
+    dispatcher = None
+    if not dry_run:
+        outbox_path = _backfill_outbox_path()
+        dispatcher = EditDispatcher(outbox=Outbox(outbox_path) if outbox_path else None, reply_on_failure=False)
+        dispatcher.start(bot)
+    unsaved = []
+    last_id = None
+    finished = False
+    
+    async def save_checkpoint():
+        saved = await asyncio.gather(*unsaved)
+        unsaved.clear()
+        if dispatcher.outbox is None or None in saved:
+            # Not replayable after a crash; wait until the edits are sent
+            await dispatcher.join()
+        state_store.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                            (checkpoint_key, str(last_id)))
+    
+    try:
+        for message in itertools.chain((first,), messages):
+            stats['read'] += 1
+            message_id = message.get('id')
+            if not isinstance(message_id, int):
+                stats['skipped'] += 1
+                continue
+            if message_id <= checkpoint:
+                stats['before_checkpoint'] += 1
+                continue
+            
+            content = export_message_content(message)
+            if content is None:
+                stats['skipped'] += 1
+            elif processed_cache.seen(chat.id, message_id, content[1]):
+                stats['already_processed'] += 1
+            else:
+                kind, text, entities = content
+                time_offset = channel_time_offset(chat, _export_date(message))
+                new_text, new_entities = await rewrite_text(text, entities, time_offset, scopes=scopes)
+                if new_text == text:
+                    stats['unchanged'] += 1
+                elif dry_run:
+                    stats['changed'] += 1
+                    write_diff(out, message_id, text, new_text)
+                else:
+                    stats['changed'] += 1
+                    job = EditJob(chat.id, message_id, kind, new_text, new_entities)
+                    dispatcher.enqueue(job)
+                    if job.saved is not None:
+                        unsaved.append(job.saved)
+                    processed_cache.remember(chat.id, message_id, text, new_text)
+            last_id = message_id
+            
+            if stats['read'] % 1000 == 0:
+                logger.info("Backfill of %s: %d posts read, %d changed", chat.id, stats['read'], stats['changed'])
+            if dispatcher is not None:
+                if stats['read'] % BACKFILL_CHECKPOINT_EVERY == 0:
+                    await save_checkpoint()
+                await dispatcher.wait_for_room(BACKFILL_QUEUE_LIMIT)
+        
+        if dispatcher is not None and last_id is not None:
+            await save_checkpoint()
+        finished = True
+    finally:
+        if dispatcher is not None:
+            # Interrupted runs leave their unsent edits in the outbox for the next run
+            await dispatcher.stop(drain=finished)
+            stats['sent'] = dispatcher.stats['sent']
+            stats['failed'] = dispatcher.stats['failed']
+            stats['replayed'] = dispatcher.stats['replayed']
+    return stats
+
+def build_application(token=None, base_url=None):
+    """Create the Application and register every handler."""
+    # telegram.ext pulls in the updater and webhook server; only the running bot needs them
+    from telegram.ext import Application, CommandHandler, MessageHandler, filters
+    
+    builder = Application.builder().token(token or BOT_TOKEN)
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
     
     # Register command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -676,42 +4126,132 @@ async def start_bot_async():
     application.add_handler(CommandHandler("status", status_command))
     application.add_handler(CommandHandler("filters", filters_command))
     application.add_handler(CommandHandler("addfilter", add_filter_command))
+    application.add_handler(CommandHandler("addchannelfilter", add_channel_filter_command))
+    application.add_handler(CommandHandler("addgroupfilter", add_group_filter_command))
     application.add_handler(CommandHandler("removefilter", remove_filter_command))
+    application.add_handler(CommandHandler("removechannelfilter", remove_channel_filter_command))
+    application.add_handler(CommandHandler("removegroupfilter", remove_group_filter_command))
     application.add_handler(CommandHandler("testfilter", test_filter_command))
+    application.add_handler(CommandHandler("profilefilter", profile_filter_command))
+    application.add_handler(CommandHandler("filterstats", filter_stats_command))
+    application.add_handler(CommandHandler("shadowfilter", shadow_filter_command))
+    application.add_handler(CommandHandler("removeshadowfilter", remove_shadow_filter_command))
+    application.add_handler(CommandHandler("shadowreport", shadow_report_command))
+    application.add_handler(CommandHandler("promoteshadow", promote_shadow_command))
+    application.add_handler(CommandHandler("clearshadow", clear_shadow_command))
     application.add_handler(CommandHandler("channels", channels_command))
     application.add_handler(CommandHandler("addchannel", add_channel_command))
     application.add_handler(CommandHandler("removechannel", remove_channel_command))
+    application.add_handler(CommandHandler("settimezone", set_timezone_command))
+    application.add_handler(CommandHandler("setgroup", set_group_command))
     
     # Register message handler for channel posts
-    application.add_handler(MessageHandler(filters.ChatType.CHANNEL, process_channel_post))
+    application.add_handler(MessageHandler(
+        filters.ChatType.CHANNEL & filters.UpdateType.CHANNEL_POSTS, process_channel_post
+    ))
+    return application
+
+async def start_application(application, mode=None):
+    """Start the application, the edit dispatcher and update delivery."""
+    mode = mode or UPDATE_MODE
+    await application.initialize()
+    await application.start()
+    edit_dispatcher.start(application.bot)
+    await start_metrics_server()
+    
+    if mode == "webhook":
+        # Registers the webhook with Telegram and serves it from this process
+        await application.updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+        )
+        logger.info("Webhook server listening on %s:%d/%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+    else:
+        await application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+        logger.info("Bot started and polling")
+
+async def stop_application(application):
+    """
+    Shut down gracefully: stop taking updates, let the handlers finish the
+    updates already received, then drain albums and queued edits. Also
+    cleans up after a start_application that failed halfway.
+    """
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await media_groups.flush_all()
+    await edit_dispatcher.stop()
+    pipeline_executor.shutdown()
+    await stop_metrics_server()
+    await application.shutdown()
+
+async def start_bot_async():
+    """Start the Telegram bot asynchronously."""
+    if not BOT_TOKEN or BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
+        logger.error("No bot token provided! Please set the BOT_TOKEN variable in this file.")
+        print("ERROR: Bot token not found! Please set the BOT_TOKEN variable in this file.")
+        print("Edit simple_bot.py and change the line: BOT_TOKEN = \"YOUR_BOT_TOKEN_HERE\"")
+        return
+    if UPDATE_MODE == "webhook" and not WEBHOOK_URL:
+        logger.error("UPDATE_MODE is webhook but WEBHOOK_URL is not set")
+        print("ERROR: Set WEBHOOK_URL to the public HTTPS address Telegram should post updates to.")
+        return
+    
+    # Build the in-memory indexes once, before the first update arrives
+    channels = load_channels()
+    channel_registry.load(channels)
+    filter_engine.prebuild(channels)
+    
+    # Create application
+    application = build_application()
+    
+    # Keep the bot running until Ctrl+C or a termination signal
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError, RuntimeError):
+            loop.add_signal_handler(sig, stop_requested.set)
     
     # Start the bot
     logger.info("Starting bot...")
     print("Starting Telegram Channel Message Editor Bot...")
-    await application.initialize()
-    await application.start()
-    await application.updater.start_polling()
-    logger.info("Bot started and polling")
-    print("Bot is running and polling for updates!")
-    print("Time Conversion: Will add 3:30 hours to all timestamps")
-    print("Use Ctrl+C to stop the bot")
-    
-    # Keep the bot running
     try:
-        while True:
-            await asyncio.sleep(1)
+        # A failed start (e.g. webhook mode without the webhooks extra) still shuts down cleanly
+        await start_application(application)
+        if UPDATE_MODE == "webhook":
+            print(f"Bot is running and receiving updates at {WEBHOOK_URL}")
+        else:
+            print("Bot is running and polling for updates!")
+        print(f"Time Conversion: Will shift all timestamps by {format_offset(TIME_OFFSET_MINUTES)}")
+        if pipeline_executor.mode != "process":
+            # Budget strikes only count a filter's time once it returns, so nothing stops a hang
+            logger.warning("PIPELINE_EXECUTOR is %s: posts have no %ss deadline, and a filter that hangs "
+                           "stalls the bot. Set PIPELINE_EXECUTOR=process to enforce it.",
+                           pipeline_executor.mode, PIPELINE_TIMEOUT)
+            print(f"WARNING: No per-post deadline in {pipeline_executor.mode} mode; "
+                  f"set PIPELINE_EXECUTOR=process to enforce one")
+        print("Use Ctrl+C to stop the bot")
+        
+        await stop_requested.wait()
+        logger.info("Bot stopping...")
+        print("Stopping bot...")
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopping...")
         print("Stopping bot...")
     finally:
-        await application.stop()
-        await application.shutdown()
+        await stop_application(application)
         logger.info("Bot stopped")
         print("Bot stopped")
 
 def main():
     """Main function to start the bot."""
     global BOT_TOKEN
+    setup_logging()
     try:
         print("Telegram Channel Message Editor Bot (Simple Version)")
         print("=================================================")
@@ -731,10 +4271,63 @@ def main():
         logger.info("Bot stopped by user")
         print("Bot stopped by user")
     except Exception as e:
-        logger.error(f"Error starting bot: {e}")
+        logger.error("Error starting bot: %s", e)
         print(f"Error starting bot: {e}")
         import traceback
         traceback.print_exc()
 
+def backfill_main(argv=None):
+    """
+    Command line for processing old posts:
+    python simple_bot.py backfill result.json [--channel @name] [--dry-run]
+    """
+    import argparse
+    from telegram import Bot
+    
+    setup_logging()
+    parser = argparse.ArgumentParser(
+        prog="simple_bot.py backfill",
+        description="Run the posts of a channel export through the filters and edit the ones that change."
+    )
+    parser.add_argument("export", help="Telegram Desktop export (result.json) or a .jsonl file")
+    parser.add_argument("--channel", help="@username or id of the channel (default: the id in the export)")
+    parser.add_argument("--dry-run", action="store_true", help="print a diff of every change instead of editing")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint and start from the first post")
+    parser.add_argument("--base-url", default="https://api.telegram.org/bot", help="Bot API server to send edits to")
+    args = parser.parse_args(argv)
+    
+    if not args.dry_run and BOT_TOKEN == "YOUR_BOT_TOKEN_HERE":
+        print("ERROR: Set TELEGRAM_BOT_TOKEN to edit posts, or use --dry-run to only see the changes.")
+        return 1
+    
+    async def run():
+        if args.dry_run:
+            return await backfill(args.export, args.channel, dry_run=True, resume=not args.restart)
+        async with Bot(BOT_TOKEN, base_url=args.base_url) as bot:
+            return await backfill(args.export, args.channel, bot, resume=not args.restart)
+    
+    try:
+        stats = asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Stopped. Run the same command again to continue after the last checkpoint.")
+        return 130
+    except (OSError, ValueError) as e:
+        logger.error("Backfill failed: %s", e)
+        print(f"ERROR: {e}")
+        return 1
+    finally:
+        pipeline_executor.shutdown()
+    
+    print(f"Read {stats['read']} posts: {stats['changed']} changed, {stats['unchanged']} unchanged, "
+          f"{stats['already_processed']} already processed, {stats['skipped']} without text, "
+          f"{stats['before_checkpoint']} before the checkpoint")
+    if args.dry_run:
+        print("Dry run: nothing was edited.")
+    else:
+        print(f"Sent {stats['sent']} edits, {stats['failed']} failed, {stats['replayed']} replayed from an interrupted run")
+    return 0
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["backfill"]:
+        sys.exit(backfill_main(sys.argv[2:]))
     main()
\ No newline at end of file